@@ -0,0 +1,304 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Client for the adb server host protocol
+
+Talks directly to the adb server (localhost:5037 by default) instead of
+spawning the adb program for every device check.  Requests are sent as a
+4 hexadecimal digits length followed by the request, answered by OKAY or
+FAIL and, for host services, a length-prefixed string.  The server closes
+the connection after answering a host request, so each query uses a fresh
+connection to localhost, which costs far less than a process spawn.
+
+Files are read from and written to the device with the sync service,
+which sends them as a stream of length-prefixed DATA packets, without a
+temporary copy.
+'''
+
+import sys
+import time
+import stat
+import errno
+import struct
+import socket
+
+from runner import runner
+
+# largest DATA packet of the sync service
+SYNC_DATA = 64 * 1024
+
+class AdbError(Exception):
+    '''the adb server could not be reached or reported a failure'''
+
+
+class AdbClient(object):
+    '''query the adb server, starting it with the adb program if needed'''
+
+    def __init__(self, host='127.0.0.1', port=5037, adb=None, timeout=5):
+        self.host = host
+        self.port = port
+        self.adb = adb
+        self.timeout = timeout
+
+    def connect(self, request):
+        '''open a connection and send a request, return the socket
+
+        the server has accepted the request when this returns'''
+        try:
+            try:
+                sock = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+            except socket.error, error:
+                if error.args[0] != errno.ECONNREFUSED or not self.adb:
+                    raise
+                self.start_server()
+                sock = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+            # the sync protocol ends each file with a small DONE packet,
+            # held back until the previous one is acknowledged otherwise
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self._send(sock, request)
+                self._status(sock)
+            except:
+                sock.close()
+                raise
+            return sock
+        except socket.error, error:
+            raise AdbError('cannot talk to the adb server: %s' % (error,))
+
+    def start_server(self):
+        '''launch the adb server in the background'''
+        print >> sys.stderr, 'Starting the adb server'
+        try:
+            runner.run([self.adb, 'start-server'], timeout=10)
+        except OSError, error:
+            # adb not found
+            raise AdbError('cannot start the adb server: %s' %
+                           error.strerror)
+
+    def query(self, request):
+        '''send a host request and return its answer'''
+        sock = self.connect(request)
+        try:
+            return read_string(sock)
+        except socket.error, error:
+            raise AdbError('cannot talk to the adb server: %s' % (error,))
+        finally:
+            sock.close()
+
+    def version(self):
+        '''version of the adb server'''
+        return int(self.query('host:version'), 16)
+
+    def devices(self):
+        '''list of (serial, state) of the devices seen by the server'''
+        return parse_devices(self.query('host:devices'))
+
+    def track_devices(self):
+        '''socket on which the server sends the device list at each change
+
+        read the lists with read_devices()'''
+        sock = self.connect('host:track-devices')
+        sock.settimeout(None)
+        return sock
+
+    def get_state(self, serial):
+        '''state of the given device (device, recovery, offline...)'''
+        return self.query('host-serial:%s:get-state' % serial)
+
+    def transport(self, serial, request):
+        '''socket connected to a service of the given device'''
+        sock = self.connect('host:transport:' + serial)
+        try:
+            self._send(sock, request)
+            self._status(sock)
+        except socket.error, error:
+            sock.close()
+            raise AdbError('cannot talk to the adb server: %s' % (error,))
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, serial, command):
+        '''run a shell command on the device and return its output'''
+        sock = self.transport(serial, 'shell:' + command)
+        chunks = []
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        except socket.error, error:
+            raise AdbError('connection to %s lost: %s' % (serial, error))
+        finally:
+            sock.close()
+        return ''.join(chunks).replace('\r\n', '\n')
+
+    def sync(self, serial):
+        '''SyncConnection to the file service of the given device'''
+        return SyncConnection(self.transport(serial, 'sync:'), serial)
+
+    def kill(self):
+        '''stop the adb server'''
+        try:
+            self.connect('host:kill').close()
+        except AdbError:
+            # not running
+            pass
+
+    def _send(self, sock, request):
+        sock.sendall('%04x%s' % (len(request), request))
+
+    def _status(self, sock):
+        status = recv_exactly(sock, 4)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            raise AdbError(read_string(sock))
+        raise AdbError('unexpected answer from the adb server: %r' % status)
+
+
+class SyncConnection(object):
+    '''list, read and write files of a device, one request at a time
+
+    requests and answers are a 4 letters id followed by a little endian
+    32 bits length or values'''
+
+    def __init__(self, sock, serial):
+        self.sock = sock
+        self.serial = serial
+
+    def list(self, path):
+        '''list of (name, mode, size, mtime) of the entries of a directory'''
+        entries = []
+        try:
+            self._request('LIST', path)
+            while True:
+                answer = recv_exactly(self.sock, 20)
+                if answer[:4] == 'DONE':
+                    return entries
+                if answer[:4] != 'DENT':
+                    raise AdbError('unexpected answer to LIST: %r' %
+                                   answer[:4])
+                mode, size, mtime, length = struct.unpack('<4I', answer[4:])
+                name = recv_exactly(self.sock, length)
+                if name not in ('.', '..'):
+                    entries.append((name, mode, size, mtime))
+        except socket.error, error:
+            raise AdbError('connection to %s lost: %s' % (self.serial, error))
+
+    def stat(self, path):
+        '''(mode, size, mtime) of a file, None if there is no such file'''
+        try:
+            self._request('STAT', path)
+            answer = recv_exactly(self.sock, 16)
+        except socket.error, error:
+            raise AdbError('connection to %s lost: %s' % (self.serial, error))
+        if answer[:4] != 'STAT':
+            raise AdbError('unexpected answer to STAT: %r' % answer[:4])
+        mode, size, mtime = struct.unpack('<3I', answer[4:])
+        return mode and (mode, size, mtime) or None
+
+    def directories(self, path):
+        '''names of the subdirectories of a directory'''
+        return [name for name, mode, size, mtime in self.list(path)
+                if stat.S_ISDIR(mode)]
+
+    def pull(self, path, write):
+        '''read a file, giving its content to write() as it arrives
+
+        return the number of bytes read'''
+        total = 0
+        try:
+            self._request('RECV', path)
+            while True:
+                answer = recv_exactly(self.sock, 8)
+                kind, length = answer[:4], struct.unpack('<I', answer[4:])[0]
+                if kind == 'DONE':
+                    return total
+                if kind == 'FAIL':
+                    raise AdbError('cannot read %s: %s' %
+                                   (path, recv_exactly(self.sock, length)))
+                if kind != 'DATA':
+                    raise AdbError('unexpected answer to RECV: %r' % kind)
+                data = recv_exactly(self.sock, length)
+                total += length
+                write(data)
+        except socket.error, error:
+            raise AdbError('connection to %s lost: %s' % (self.serial, error))
+
+    def push(self, path, chunks, mode=0644, mtime=None):
+        '''write a file from an iterable of strings, as they come
+
+        return the number of bytes written'''
+        total = 0
+        try:
+            self._request('SEND', '%s,%d' % (path, stat.S_IFREG | mode))
+            for chunk in chunks:
+                for start in range(0, len(chunk), SYNC_DATA):
+                    packet = chunk[start:start + SYNC_DATA]
+                    self.sock.sendall('DATA' + struct.pack('<I', len(packet))
+                                      + packet)
+                total += len(chunk)
+            self.sock.sendall('DONE' + struct.pack('<I', int(mtime or
+                                                             time.time())))
+            answer = recv_exactly(self.sock, 8)
+            kind, length = answer[:4], struct.unpack('<I', answer[4:])[0]
+            if kind == 'FAIL':
+                raise AdbError('cannot write %s: %s' %
+                               (path, recv_exactly(self.sock, length)))
+            if kind != 'OKAY':
+                raise AdbError('unexpected answer to SEND: %r' % kind)
+            return total
+        except socket.error, error:
+            raise AdbError('connection to %s lost: %s' % (self.serial, error))
+
+    def close(self):
+        '''end the sync session'''
+        try:
+            self.sock.sendall('QUIT' + struct.pack('<I', 0))
+        except socket.error:
+            pass
+        self.sock.close()
+
+    def _request(self, kind, path):
+        self.sock.sendall(kind + struct.pack('<I', len(path)) + path)
+
+
+def recv_exactly(sock, size):
+    '''read exactly size bytes from the socket'''
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            raise socket.error(errno.ECONNRESET,
+                               'connection closed by the adb server')
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+def read_string(sock):
+    '''read a string prefixed by its length in 4 hexadecimal digits'''
+    return recv_exactly(sock, int(recv_exactly(sock, 4), 16))
+
+def read_devices(sock):
+    '''read a device list sent by track-devices'''
+    try:
+        return parse_devices(read_string(sock))
+    except socket.error, error:
+        raise AdbError('device tracking interrupted: %s' % (error,))
+
+def parse_devices(output):
+    '''parse a device list into (serial, state) couples'''
+    devices = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            devices.append((fields[0], fields[1]))
+    return devices
@@ -0,0 +1,492 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Backups of the phones, kept on this computer without duplicates
+
+nandroid leaves its backups on the sdcard of the phone.  They are pulled
+through the adb sync service and cut, while they arrive, into chunks
+whose boundaries depend on their content: a boundary is put at a 512
+bytes aligned offset when the CRC-32 of the 512 bytes before it ends with
+9 zero bits, so chunks are 256 KB on average, between 64 KB and 1 MB.
+Chunks are stored compressed under their SHA-256 and a chunk already in
+the store is never written again; a manifest per backup lists the chunks
+of each of its files.  Phones on the same ROM share almost all the chunks
+of their system image.
+
+Images whose MD5, read from the nandroid.md5 of the backup, is already in
+the store are not pulled at all.
+
+A stored backup is restored by pushing it back to the sdcard of the phone
+running the recovery: chunks are read, decompressed and checked by a
+thread ahead of the push, and the MD5 of each file is checked by the
+phone while the next one is sent, so that the USB link stays busy.
+'''
+
+import os
+import re
+import sys
+import posixpath
+import stat
+import zlib
+import time
+import Queue
+import hashlib
+import threading
+
+import adbclient
+import config
+import partitions
+
+# boundaries are looked for at offsets multiple of ALIGN, after the WINDOW
+# bytes before them
+ALIGN = 512
+WINDOW = 512
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+MASK = 0x1ff
+# threads compressing and writing chunks
+WORKERS = 2
+# chunks waiting for them
+QUEUE_SIZE = 16
+# chunks read ahead of a push
+READ_AHEAD = 8
+
+NANDROID = '/sdcard/nandroid'
+MD5_FILE = 'nandroid.md5'
+MD5_LINE = re.compile(r'^([0-9a-f]{32})\s+\*?(\S+)$', re.M)
+
+class BackupError(Exception):
+    '''the backup cannot be pulled or read back'''
+
+
+class Chunker(object):
+    '''cut a stream into content defined chunks'''
+
+    def __init__(self, minimum=MIN_CHUNK, maximum=MAX_CHUNK, mask=MASK):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mask = mask
+        self._pending = ''
+        # offset where to look for the next boundary
+        self._next = minimum
+
+    def feed(self, data):
+        '''add data, return the list of chunks it completes'''
+        self._pending += data
+        chunks = []
+        cut = self._boundary()
+        while cut:
+            chunks.append(self._pending[:cut])
+            self._pending = self._pending[cut:]
+            self._next = self.minimum
+            cut = self._boundary()
+        return chunks
+
+    def finish(self):
+        '''the last chunk, '' if there is none'''
+        last, self._pending = self._pending, ''
+        self._next = self.minimum
+        return last
+
+    def _boundary(self):
+        pending = self._pending
+        end = min(len(pending), self.maximum)
+        position = self._next
+        while position <= end:
+            if zlib.crc32(buffer(pending, position - WINDOW, WINDOW)) & \
+               self.mask == 0:
+                return position
+            position += ALIGN
+        self._next = position
+        if len(pending) >= self.maximum:
+            return self.maximum
+        return None
+
+
+class ChunkWriter(object):
+    '''file-like object storing what is written to it as chunks
+
+    chunks are compressed and written by worker threads, while the next
+    data arrives; close() returns the description of the file, as kept in
+    manifests'''
+
+    def __init__(self, store, workers=WORKERS):
+        self.store = store
+        self.chunker = Chunker()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+        self.chunks = []
+        self.written = 0
+        self.error = None
+        self._queue = Queue.Queue(QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work)
+                         for number in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def write(self, data):
+        '''add data to the file'''
+        self.size += len(data)
+        self.sha256.update(data)
+        self.md5.update(data)
+        for chunk in self.chunker.feed(data):
+            self._add(chunk)
+
+    def close(self):
+        '''wait for the chunks to be stored, return the file description'''
+        last = self.chunker.finish()
+        if last:
+            self._add(last)
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self.error is not None:
+            raise BackupError('cannot store a chunk: %s' % (self.error,))
+        return {'size': self.size, 'sha256': self.sha256.hexdigest(),
+                'md5': self.md5.hexdigest(), 'chunks': self.chunks}
+
+    def abort(self):
+        '''stop the workers, keeping the chunks already stored'''
+        try:
+            self.close()
+        except BackupError:
+            pass
+
+    def _add(self, chunk):
+        digest = hashlib.sha256(chunk).hexdigest()
+        self.chunks.append([digest, len(chunk)])
+        self._queue.put((digest, chunk))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                if self.store.put_chunk(*item):
+                    with self._lock:
+                        self.written += len(item[1])
+            except (IOError, OSError), error:
+                self.error = error
+
+
+class Reassembler(object):
+    '''iterable content of a stored file, read by a thread ahead of its
+    consumer
+
+    the MD5 of the content is checked against the manifest at the end'''
+
+    def __init__(self, store, entry, ahead=READ_AHEAD):
+        self.store = store
+        self.entry = entry
+        self.error = None
+        self._md5 = hashlib.md5()
+        self._queue = Queue.Queue(ahead)
+        self._stopped = threading.Event()
+        thread = threading.Thread(target=self._read)
+        thread.daemon = True
+        thread.start()
+
+    def _read(self):
+        try:
+            # hashing each chunk again would make the reading slower than
+            # the push: a corrupted chunk changes the MD5 of the file
+            for data in self.store.read_file(self.entry, False):
+                self._md5.update(data)
+                while not self._stopped.is_set():
+                    try:
+                        self._queue.put(data, timeout=0.5)
+                        break
+                    except Queue.Full:
+                        pass
+                if self._stopped.is_set():
+                    return
+        except BackupError, error:
+            self.error = error
+        self._queue.put(None)
+
+    def __iter__(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                yield data
+        finally:
+            self._stopped.set()
+        if self.error is not None:
+            raise self.error
+        if self._md5.hexdigest() != self.entry['md5']:
+            raise BackupError('stored file does not match its MD5')
+
+
+class DeviceCheck(threading.Thread):
+    '''MD5 of a file computed by the phone, in the background'''
+
+    def __init__(self, client, serial, path, md5):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.client = client
+        self.serial = serial
+        self.path = path
+        self.md5 = md5
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            found = partitions.MD5.search(self.client.shell(
+                self.serial, "md5sum '%s'" % self.path))
+            if not found:
+                self.error = 'cannot compute the MD5 of ' + self.path
+            elif found.group(1) != self.md5:
+                self.error = self.path + ' was corrupted on its way'
+        except adbclient.AdbError, error:
+            self.error = 'cannot check %s: %s' % (self.path, error)
+
+
+class BackupStore(object):
+    '''content addressed chunks and the manifests of the backups using them
+
+    chunks/ab/abcd... hold the zlib compressed chunks,
+    manifests/<serial>/<date>.json the backups'''
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(config.DATADIR, 'backups')
+        self._images = None
+        self._lock = threading.Lock()
+
+    def chunk_path(self, digest):
+        '''path of a chunk'''
+        return os.path.join(self.root, 'chunks', digest[:2], digest)
+
+    def has_chunk(self, digest):
+        '''whether the store has the chunk'''
+        return os.path.exists(self.chunk_path(digest))
+
+    def put_chunk(self, digest, data):
+        '''store a chunk unless it is there, return True if it was written'''
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return False
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        tmppath = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                    threading.current_thread().ident)
+        with open(tmppath, 'wb') as chunkfile:
+            chunkfile.write(zlib.compress(data, 1))
+        if os.name == 'nt' and os.path.exists(path):
+            # the same chunk, stored by another thread
+            os.remove(tmppath)
+            return False
+        os.rename(tmppath, path)
+        return True
+
+    def get_chunk(self, digest, check=True):
+        '''content of a chunk, checked against its digest unless the
+        caller checks the whole file'''
+        try:
+            with open(self.chunk_path(digest), 'rb') as chunkfile:
+                data = zlib.decompress(chunkfile.read())
+        except (IOError, OSError, zlib.error), error:
+            raise BackupError('cannot read chunk %s: %s' % (digest, error))
+        if check and hashlib.sha256(data).hexdigest() != digest:
+            raise BackupError('chunk %s is corrupted' % digest)
+        return data
+
+    def read_file(self, entry, check=True):
+        '''iterate over the content of a file of a manifest'''
+        for digest, length in entry['chunks']:
+            yield self.get_chunk(digest, check)
+
+    def serials(self):
+        '''devices having backups'''
+        directory = os.path.join(self.root, 'manifests')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.listdir(directory))
+
+    def backups(self, serial):
+        '''dates of the backups of a device, oldest first'''
+        directory = os.path.join(self.root, 'manifests', safe_name(serial))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(directory)
+                      if name.endswith('.json'))
+
+    def manifest(self, serial, date=None):
+        '''manifest of a backup of a device, the last one without a date
+
+        None if there is no such backup'''
+        if date is None:
+            dates = self.backups(serial)
+            if not dates:
+                return None
+            date = dates[-1]
+        return config.load_json(os.path.join(self.root, 'manifests',
+                                             safe_name(serial),
+                                             date + '.json'))
+
+    def save_manifest(self, manifest):
+        '''record a backup whose chunks are all stored, return its path'''
+        path = os.path.join(self.root, 'manifests',
+                            safe_name(manifest['serial']),
+                            manifest['date'] + '.json')
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        config.save_json(path, manifest)
+        with self._lock:
+            if self._images is not None:
+                self._index(manifest)
+        return path
+
+    def find_file(self, md5, size=None):
+        '''description of a stored file with that MD5, None if there is none'''
+        with self._lock:
+            if self._images is None:
+                self._images = {}
+                for serial in self.serials():
+                    for date in self.backups(serial):
+                        self._index(self.manifest(serial, date) or {})
+            entry = self._images.get(md5)
+        if entry and (size is None or entry['size'] == size) and \
+           all(self.has_chunk(digest) for digest, length in entry['chunks']):
+            return entry
+        return None
+
+    def _index(self, manifest):
+        for entry in manifest.get('files', {}).values():
+            self._images[entry['md5']] = entry
+
+    def usage(self):
+        '''(number of chunks, bytes they take on disk)'''
+        count = size = 0
+        for directory, dirnames, filenames in os.walk(os.path.join(self.root,
+                                                                   'chunks')):
+            for name in filenames:
+                if not name.endswith('.tmp'):
+                    count += 1
+                    size += os.path.getsize(os.path.join(directory, name))
+        return count, size
+
+
+def safe_name(serial):
+    '''serial usable as a file name'''
+    return re.sub(r'[^\w.-]', '_', serial)
+
+def parse_md5sums(text):
+    '''parse an md5sum output into a dictionary name -> MD5'''
+    return dict((name, md5) for md5, name in MD5_LINE.findall(text))
+
+def latest_backup(sync, top=NANDROID):
+    '''directory of the last nandroid backup on the sdcard, None if none
+
+    nandroid keeps them in a directory per kernel command line, named
+    BCDS-<date>-<time> unless the user named them'''
+    latest = None
+    for kernel in sync.directories(top):
+        parent = top + '/' + kernel
+        for name, mode, size, mtime in sync.list(parent):
+            if stat.S_ISDIR(mode) and (latest is None or mtime > latest[0]):
+                latest = (mtime, parent + '/' + name)
+    return latest and latest[1]
+
+def pull_backup(client, serial, store, remote=None, report=None):
+    '''copy a nandroid backup of the device to the store
+
+    the last one unless the directory of another one is given; report(name,
+    size) is called after each file.  Return the manifest'''
+    sync = client.sync(serial)
+    try:
+        if remote is None:
+            remote = latest_backup(sync)
+            if remote is None:
+                raise BackupError('no nandroid backup on the sdcard of ' +
+                                  serial)
+        listing = [(name, size) for name, mode, size, mtime
+                   in sync.list(remote) if not stat.S_ISDIR(mode)]
+        md5sums = {}
+        if MD5_FILE in dict(listing):
+            content = []
+            sync.pull(remote + '/' + MD5_FILE, content.append)
+            md5sums = parse_md5sums(''.join(content))
+        manifest = {'serial': serial, 'source': remote,
+                    'date': time.strftime('%Y%m%d-%H%M%S'), 'files': {}}
+        pulled = written = 0
+        for name, size in sorted(listing):
+            entry = md5sums.get(name) and store.find_file(md5sums[name],
+                                                          size)
+            if entry is None:
+                writer = ChunkWriter(store)
+                try:
+                    sync.pull(remote + '/' + name, writer.write)
+                except:
+                    writer.abort()
+                    raise
+                entry = writer.close()
+                if md5sums.get(name, entry['md5']) != entry['md5']:
+                    raise BackupError('%s differs from its MD5 in %s' %
+                                      (name, MD5_FILE))
+                pulled += entry['size']
+                written += writer.written
+            manifest['files'][name] = entry
+            if report:
+                report(name, size)
+        manifest['pulled'] = pulled
+        manifest['written'] = written
+    finally:
+        sync.close()
+    store.save_manifest(manifest)
+    print >> sys.stderr, 'Backup of %s: %d files, %d bytes pulled, %d ' \
+            'new bytes stored' % (serial, len(manifest['files']), pulled,
+                                  written)
+    return manifest
+
+def push_backup(client, serial, store, manifest, report=None):
+    '''copy a backup of the store to the sdcard of a phone in recovery
+
+    it is put next to the backup it was pulled from, in a new directory
+    which nandroid takes as the latest backup; report(name, size) is
+    called after each file.  Return that directory'''
+    remote = posixpath.join(posixpath.dirname(manifest['source'].rstrip('/')),
+                            'HOST-' + manifest['date'])
+    client.shell(serial, 'mount /sdcard')
+    client.shell(serial, "rm -r '%s'" % remote)
+    checks = []
+    sync = client.sync(serial)
+    try:
+        for name, entry in sorted(manifest['files'].items()):
+            path = remote + '/' + name
+            try:
+                sync.push(path, Reassembler(store, entry))
+            except BackupError, error:
+                raise BackupError('%s: %s' % (name, error))
+            checks.append(DeviceCheck(client, serial, path, entry['md5']))
+            if report:
+                report(name, entry['size'])
+    finally:
+        sync.close()
+    errors = []
+    for check in checks:
+        check.join()
+        if check.error:
+            errors.append(check.error)
+    # nandroid mounts it itself
+    client.shell(serial, 'sync; umount /sdcard')
+    if errors:
+        raise BackupError('\n'.join(errors))
+    print >> sys.stderr, 'Backup %s of %s copied to %s' % (manifest['date'],
+                                                          serial, remote)
+    return remote
@@ -0,0 +1,142 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Fake adb program, for the benchmarks
+
+Understands devices, shell (nandroid-mobile.sh, reboot, sh of a script of
+the sdcard), reboot, remount, push, wait-for-device and logcat on the
+simulated phones of fakedevice.  The adb server itself is fakeserver,
+started by the benchmarks.
+'''
+
+import os
+import sys
+import time
+import subprocess
+
+import fakedevice
+
+def nandroid(config, target, transcript, delay, operation):
+    '''print a nandroid transcript line by line'''
+    if fakedevice.fails(config, target, operation):
+        fakedevice.say('error: nandroid %s failed' % operation, config, delay)
+        fakedevice.pause(config, config['failure_hang'])
+        # adb shell does not tell the exit code of the command
+        return 0
+    for line in transcript:
+        # the server is already running
+        if not line.startswith('* daemon'):
+            fakedevice.say(line, config, delay if line.strip() else 0)
+    return 0
+
+def dump_pages(source, target):
+    '''copy a partition as dump_image reads it back: the pages of yaffs2
+    partitions without their out of band data'''
+    chunk = not os.path.getsize(source) % 2112 and 2112 or None
+    with open(source, 'rb') as partition, open(target, 'wb') as out:
+        while True:
+            data = partition.read(chunk or 1024 * 1024)
+            if not data:
+                break
+            out.write(chunk and data[:2048] or data)
+
+def script(config, target, path, args):
+    '''run a script of the sdcard with the sh of this computer, where
+    dump_image and flash_image read and write the partitions of the phone
+    at its write throughput'''
+    sdcard = fakedevice.sdcard(target)
+    partitions = os.path.dirname(fakedevice.partition(target, 'system'))
+    with open(os.path.join(sdcard, path[len('/sdcard/'):])) as source:
+        text = source.read().replace('/sdcard/', sdcard + '/')
+    delays = ''.join('%s) sleep %f;; ' % (
+        name[:-len('.img')], os.path.getsize(os.path.join(partitions, name)) /
+        config['write_throughput'] * config['time_scale'])
+                     for name in os.listdir(partitions))
+    prelude = ('wait_nand() { case "$1" in %sesac; }\n' % delays +
+               'dump_image() { wait_nand $1; "%s" "%s" --dump-pages '
+               '"%s/$1.img" "$2"; }\n' % (sys.executable,
+                                          os.path.abspath(__file__),
+                                          partitions) +
+               'flash_image() { wait_nand $1; cp "$2" "%s/$1.img"; }\n'
+               % partitions)
+    sys.stdout.flush()
+    command = subprocess.Popen(['sh', '-s'] + args, stdin=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    command.communicate(prelude + text)
+    # adb shell does not tell the exit code of the command
+    return 0
+
+def main(args):
+    config = fakedevice.load_config()
+    devices = fakedevice.Devices()
+    serial = None
+    if args[:1] == ['-s'] and len(args) > 1:
+        serial = args[1]
+        args = args[2:]
+    fakedevice.pause(config, config['latency'])
+    if args and args[0] in ('start-server', 'kill-server'):
+        return 0
+    if args == ['devices']:
+        print 'List of devices attached'
+        for device, state in sorted(devices.states().items()):
+            if state in ('device', 'recovery'):
+                print '%s\t%s' % (device, state)
+        print
+        return 0
+    if args == ['wait-for-device']:
+        while not devices.target(serial, ('device',)):
+            time.sleep(0.05)
+        return 0
+    target = devices.target(serial, ('device', 'recovery'))
+    if target is None:
+        print 'error: device not found'
+        return 1
+    transcripts = fakedevice.transcripts()
+    if args[:2] == ['shell', 'nandroid-mobile.sh']:
+        if '-r' in args:
+            return nandroid(config, target, transcripts['restore'],
+                            config['restore_line'], 'restore')
+        return nandroid(config, target, transcripts['backup'],
+                        config['backup_line'], 'backup')
+    if args[:2] == ['shell', 'sh'] and len(args) > 2 and \
+       args[2].startswith('/sdcard/'):
+        return script(config, target, args[2], args[3:])
+    if args in (['shell', 'reboot'], ['reboot'], ['reboot', 'bootloader']):
+        later = args[-1] == 'bootloader' and 'fastboot' or 'device'
+        devices.set(target, None, later,
+                    config['reboot_delay'] * config['time_scale'])
+        return 0
+    if args == ['remount']:
+        print 'remount succeeded'
+        return 0
+    if args[:1] == ['push'] and len(args) == 3:
+        size = os.path.getsize(args[1])
+        if fakedevice.fails(config, target, 'push'):
+            print 'failed to copy \'%s\' to \'%s\': No space left on device' \
+                    % tuple(args[1:])
+            return 1
+        seconds = fakedevice.pause(config,
+                                   float(size) / config['push_throughput'])
+        print '%d KB/s (%d bytes in %.3fs)' % (size / 1024 /
+                                               max(seconds, 0.001), size,
+                                               seconds)
+        return 0
+    if args[:1] == ['logcat']:
+        number = 0
+        while True:
+            number += 1
+            fakedevice.say(time.strftime('%m-%d %H:%M:%S.000') +
+                           ' I/FakeDevice(  %d): line %d' % (os.getpid(),
+                                                             number),
+                           config, config['logcat_line'])
+    print 'Android Debug Bridge version 1.0.26'
+    return 1
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--dump-pages']:
+        dump_pages(*sys.argv[2:4])
+        sys.exit(0)
+    sys.exit(main(sys.argv[1:]))
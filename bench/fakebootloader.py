@@ -0,0 +1,146 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Fake bootloader listening on the network, for the benchmarks
+
+Speaks the fastboot protocol over TCP for a simulated phone of
+fakedevice, known as tcp:127.0.0.1:PORT: the FB01 handshake while the
+phone is in fastboot mode, then getvar, download, flash, erase, boot,
+reboot and reboot-bootloader, taking the time of the simulated phone.
+Downloaded data is really received and counted, and refused beyond
+max_download_size.  The "info" messages of the configuration are sent
+as INFO lines before the answer to flash.
+'''
+
+import struct
+import threading
+import SocketServer
+
+import fakedevice
+
+class Handler(SocketServer.BaseRequestHandler):
+    '''one session of a client'''
+
+    def _recv(self, size):
+        data = []
+        while size:
+            chunk = self.request.recv(min(size, 1024 * 1024))
+            if not chunk:
+                return None
+            data.append(chunk)
+            size -= len(chunk)
+        return ''.join(data)
+
+    def receive(self):
+        header = self._recv(8)
+        if header is None:
+            return None
+        return self._recv(struct.unpack('>Q', header)[0])
+
+    def send(self, message):
+        self.request.sendall(struct.pack('>Q', len(message)) + message)
+
+    def handle(self):
+        server = self.server
+        if server.devices.states().get(server.serial) != 'fastboot' or \
+           self._recv(4) != 'FB01':
+            return
+        self.request.sendall('FB01')
+        downloaded = 0
+        while True:
+            command = self.receive()
+            if command is None:
+                return
+            config = fakedevice.load_config(server.home)
+            fail = lambda operation: fakedevice.fails(config, server.serial,
+                                                      operation)
+            if command == 'getvar:max-download-size':
+                if config['max_download_size']:
+                    self.send('OKAY0x%08x' % config['max_download_size'])
+                else:
+                    self.send('FAILunknown variable')
+            elif command.startswith('getvar:'):
+                self.send('OKAY')
+            elif command.startswith('download:'):
+                size = int(command[len('download:'):], 16)
+                if config['max_download_size'] and \
+                   size > config['max_download_size']:
+                    self.send('FAILdata too large')
+                    continue
+                self.send('DATA%08x' % size)
+                received = 0
+                while received < size:
+                    data = self.receive()
+                    if data is None:
+                        return
+                    received += len(data)
+                fakedevice.pause(config, float(size) / config['throughput'])
+                server.received += size
+                downloaded = size
+                self.send('OKAY')
+            elif command.startswith('flash:'):
+                partition = command[len('flash:'):]
+                fakedevice.pause(config, float(downloaded) /
+                                 config['write_throughput'])
+                for message in config['info']:
+                    self.send('INFO' + message)
+                if fail('flash ' + partition):
+                    self.send('FAILflash write failure')
+                else:
+                    self.send('OKAY')
+            elif command.startswith('erase:'):
+                partition = command[len('erase:'):]
+                fakedevice.pause(config, config['erase'].get(partition, 0.5))
+                if fail('erase ' + partition):
+                    self.send('FAILerase failure')
+                else:
+                    self.send('OKAY')
+            elif command == 'boot':
+                fakedevice.pause(config, config['booting'])
+                if fail('boot'):
+                    self.send('FAILboot failure')
+                    continue
+                self.send('OKAY')
+                server.devices.set(server.serial, None, 'recovery',
+                                   config['boot_delay'] *
+                                   config['time_scale'])
+                return
+            elif command in ('reboot', 'reboot-bootloader'):
+                self.send('OKAY')
+                server.devices.set(server.serial, None,
+                                   command == 'reboot' and 'device' or
+                                   'fastboot', config['reboot_delay'] *
+                                   config['time_scale'])
+                return
+            else:
+                self.send('FAILunknown command')
+
+
+class FakeBootloader(SocketServer.ThreadingTCPServer):
+    '''the bootloader of a simulated phone, on a free loopback port'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, home):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 Handler)
+        self.home = home
+        self.devices = fakedevice.Devices(home)
+        self.serial = 'tcp:127.0.0.1:%d' % self.server_address[1]
+        # bytes downloaded by the clients
+        self.received = 0
+
+    def start(self):
+        '''serve in a background thread'''
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        '''stop serving'''
+        self.shutdown()
+        self.server_close()
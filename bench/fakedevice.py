@@ -0,0 +1,234 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Simulated phones for the benchmarks
+
+The fake adb and fastboot programs and the fake adb server share the
+state of the simulated phones through files of a directory given by the
+FAKE_HOME environment variable:
+
+    config.json   latency, throughputs, delays and injected failures
+    devices.json  state of each phone (device, recovery, fastboot...)
+    sdcard/SERIAL the sdcard of a phone
+    partitions/SERIAL/NAME.img
+                  the partitions of a phone, for the benchmarks reading
+                  them back, as flashed (with the yaffs2 out of band data)
+
+A state change may be delayed, such as a phone booting the recovery some
+seconds after "fastboot boot".  All delays are multiplied by time_scale,
+so that a whole update takes seconds instead of minutes.  The outputs
+imitate the transcripts of "command result.txt".
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import random
+import hashlib
+
+TRANSCRIPTS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'command result.txt')
+
+# measured on a GW620, see "command result.txt"
+DEFAULTS = {
+    'time_scale': 1.0,
+    # start up of adb or fastboot
+    'latency': 0.05,
+    # sending 'system' (183906 KB)... OKAY [ 27.922s]
+    'throughput': 183906 * 1024 / 27.922,
+    # writing 'system'... OKAY [ 35.563s]
+    'write_throughput': 183906 * 1024 / 35.563,
+    'push_throughput': 4 * 1024 * 1024,
+    # adb sync reads of the sdcard
+    'pull_throughput': 6 * 1024 * 1024,
+    'erase': {'userdata': 2.203, 'cache': 0.781},
+    'boot_delay': 5.0,
+    'reboot_delay': 20.0,
+    'booting': 0.1,
+    # nandroid backup about 160s, restore about 240s
+    'backup_line': 6.0,
+    'restore_line': 5.0,
+    'logcat_line': 0.05,
+    'max_download_size': None,
+    # INFO messages of the bootloader while flashing
+    'info': [],
+    # serial -> root port of its hub, e.g. {"A1": "1-1"}, phones behind
+    # the same hub share hub_throughput, and fail with "status read
+    # failed" when more than hub_senders receive an image at once
+    'hubs': {},
+    'hub_throughput': None,
+    'hub_senders': None,
+    # serial -> operations to fail, e.g. {"A1": ["flash system"]}
+    'failures': {},
+    'failure_rate': 0.0,
+    # seconds a command stays stuck after printing a failure, as on a
+    # stalled USB link
+    'failure_hang': 0.0,
+}
+
+def home():
+    '''directory of the shared state'''
+    return os.environ.get('FAKE_HOME') or os.getcwd()
+
+def sdcard(serial, directory=None):
+    '''directory holding the sdcard of a phone'''
+    return os.path.join(directory or home(), 'sdcard', serial)
+
+def partition(serial, name, directory=None):
+    '''file holding a partition of a phone'''
+    return os.path.join(directory or home(), 'partitions', serial,
+                        name + '.img')
+
+def page_md5(path, length):
+    '''MD5 of the first length bytes of a partition, as read back by the
+    recovery: yaffs2 partitions without their out of band data'''
+    size = os.path.getsize(path)
+    chunk = not size % 2112 and 2112 or None
+    md5 = hashlib.md5()
+    with open(path, 'rb') as source:
+        while length > 0:
+            data = source.read(chunk or min(length, 1024 * 1024))
+            if not data:
+                break
+            data = data[:min(length, chunk and 2048 or len(data))]
+            md5.update(data)
+            length -= len(data)
+    return md5.hexdigest()
+
+def load_config(directory=None):
+    '''configuration, with defaults for what it does not give'''
+    config = dict(DEFAULTS)
+    try:
+        with open(os.path.join(directory or home(), 'config.json')) as source:
+            config.update(json.load(source))
+    except (IOError, ValueError):
+        pass
+    return config
+
+def save_config(config, directory=None):
+    '''write the configuration'''
+    with open(os.path.join(directory or home(), 'config.json'), 'w') as out:
+        json.dump(config, out, indent=1, sort_keys=True)
+
+def pause(config, seconds):
+    '''simulate something lasting seconds, scaled'''
+    if seconds > 0:
+        time.sleep(seconds * config['time_scale'])
+    return seconds
+
+def fails(config, serial, operation):
+    '''should the operation fail on that phone'''
+    return operation in config['failures'].get(serial, []) or \
+            random.random() < config['failure_rate']
+
+
+class Devices(object):
+    '''the states of the phones, locked against the other fake programs'''
+
+    def __init__(self, directory=None):
+        self.path = os.path.join(directory or home(), 'devices.json')
+
+    def _locked(self, update):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as source:
+                    devices = json.load(source)
+            except (IOError, ValueError):
+                devices = {}
+            now = time.time()
+            for serial, device in devices.items():
+                if device.get('at') is not None and device['at'] <= now:
+                    device['state'] = device.pop('next')
+                    del device['at']
+            result = update(devices)
+            # also saves the delayed changes which took place
+            tmppath = self.path + '.tmp'
+            with open(tmppath, 'w') as out:
+                json.dump(devices, out)
+            os.rename(tmppath, self.path)
+            return result
+
+    def states(self):
+        '''serial -> current state, None while rebooting'''
+        return self._locked(lambda devices: dict(
+            (serial, device['state']) for serial, device in devices.items()))
+
+    def set(self, serial, state, later=None, delay=0):
+        '''change the state now, and to later after delay seconds'''
+        def update(devices):
+            device = devices.setdefault(serial, {})
+            device['state'] = state
+            device.pop('at', None)
+            device.pop('next', None)
+            if later is not None:
+                device['next'] = later
+                device['at'] = time.time() + delay
+        self._locked(update)
+
+    def sending(self, serial, active):
+        '''mark a phone as receiving an image or not, return the phones
+        receiving one'''
+        def update(devices):
+            if serial in devices:
+                devices[serial]['sending'] = active
+            return [device for device, info in devices.items()
+                    if info.get('sending')]
+        return self._locked(update)
+
+    def remove(self, serial):
+        '''unplug a phone'''
+        self._locked(lambda devices: devices.pop(serial, None))
+
+    def target(self, serial, states):
+        '''the phone a command is for, None if there is none
+
+        without serial, there must be a single phone in one of the states'''
+        current = self.states()
+        if serial:
+            return current.get(serial) in states and serial or None
+        found = [device for device, state in current.items()
+                 if state in states]
+        return len(found) == 1 and found[0] or None
+
+
+def transcripts(path=TRANSCRIPTS):
+    '''output of the commands in "command result.txt", by title
+
+    the console wrapped long lines at 80 columns and the prompt lines are
+    not part of the output'''
+    with open(path) as source:
+        text = source.read().replace('\r\n', '\n')
+    result = {}
+    for section in re.split(r'\n=+\n', '\n' + text):
+        lines = section.split('\n')
+        if len(lines) < 3 or not lines[1].startswith('---'):
+            continue
+        title = lines[0].strip().rstrip(':').strip()
+        output = []
+        wrapped = ''
+        for line in lines[2:]:
+            if len(line) == 80:
+                wrapped += line
+                continue
+            line, wrapped = wrapped + line, ''
+            if re.match(r'^[A-Za-z]:\\', line):
+                # prompt and command
+                continue
+            output.append(line)
+        while output and not output[-1].strip():
+            output.pop()
+        result[title] = output
+    return result
+
+def say(line, config, delay=0):
+    '''print a line of output after delay seconds'''
+    pause(config, delay)
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
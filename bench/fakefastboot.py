@@ -0,0 +1,109 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Fake fastboot program, for the benchmarks
+
+Understands devices, -w, flash, boot, getvar, reboot and
+reboot-bootloader on the simulated phones of fakedevice, taking the time
+and printing what the real one does.
+'''
+
+import os
+import sys
+import time
+
+import fakedevice
+
+def timed(label, seconds, config, failed=False, reason='remote: failure'):
+    '''print a phase as fastboot does, with its duration'''
+    sys.stdout.write(label.rjust(30) + '... ')
+    sys.stdout.flush()
+    seconds = fakedevice.pause(config, seconds)
+    if failed:
+        sys.stdout.write('FAILED (%s)\n' % reason)
+        sys.stdout.flush()
+        fakedevice.pause(config, config['failure_hang'])
+    else:
+        sys.stdout.write('OKAY [%7.3fs]\n' % seconds)
+    sys.stdout.flush()
+    return not failed
+
+def main(args):
+    config = fakedevice.load_config()
+    devices = fakedevice.Devices()
+    started = time.time()
+    serial = None
+    if args[:1] == ['-s'] and len(args) > 1:
+        serial = args[1]
+        args = args[2:]
+    fakedevice.pause(config, config['latency'])
+    if args == ['devices']:
+        for device, state in sorted(devices.states().items()):
+            if state == 'fastboot':
+                print '%s\tfastboot' % device
+        return 0
+    target = devices.target(serial, ('fastboot',))
+    if target is None:
+        # the real one waits forever
+        print '< waiting for device >'
+        return 1
+    fail = lambda operation: fakedevice.fails(config, target, operation)
+    ok = True
+    if args == ['-w']:
+        for partition in ('userdata', 'cache'):
+            ok = ok and timed("erasing '%s'" % partition,
+                              config['erase'][partition], config,
+                              fail('erase ' + partition))
+    elif args[:1] == ['flash'] and len(args) == 3:
+        partition, imgfile = args[1:]
+        size = os.path.getsize(imgfile)
+        hub = config['hubs'].get(target)
+        sharing = [target]
+        if hub:
+            sharing = [phone for phone in devices.sending(target, True)
+                       if config['hubs'].get(phone) == hub]
+        rate = config['throughput']
+        if hub and config['hub_throughput']:
+            rate = min(rate, config['hub_throughput'] / len(sharing))
+        try:
+            ok = timed("sending '%s' (%d KB)" % (partition, size // 1024),
+                       float(size) / rate, config,
+                       bool(hub and config['hub_senders'] and
+                            len(sharing) > config['hub_senders']),
+                       'status read failed (Too many links)')
+        finally:
+            if hub:
+                devices.sending(target, False)
+        ok = ok and timed("writing '%s'" % partition,
+                          float(size) / config['write_throughput'], config,
+                          fail('flash ' + partition),
+                          'remote: flash write failure')
+    elif args[:1] == ['boot'] and len(args) == 2:
+        size = os.path.getsize(args[1])
+        ok = timed("downloading 'boot.img'",
+                   float(size) / config['throughput'], config) and \
+                timed('booting', config['booting'], config, fail('boot'))
+        if ok:
+            devices.set(target, None, 'recovery',
+                        config['boot_delay'] * config['time_scale'])
+    elif args == ['getvar', 'max-download-size']:
+        if config['max_download_size']:
+            print 'max-download-size: 0x%x' % config['max_download_size']
+    elif args in (['reboot'], ['reboot-bootloader']):
+        ok = timed('rebooting', config['booting'], config, fail('reboot'))
+        if ok:
+            later = args == ['reboot'] and 'device' or 'fastboot'
+            devices.set(target, None, later,
+                        config['reboot_delay'] * config['time_scale'])
+    else:
+        print 'usage: fastboot [ <option> ] <command>'
+        return 1
+    print 'finished. total time: %.3fs' % ((time.time() - started) /
+                                           config['time_scale'])
+    return not ok and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,297 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Fake adb server, for the benchmarks
+
+Speaks the host protocol of the real server on a loopback port: version,
+devices, track-devices, get-state, kill and the shell and sync services
+of the simulated phones of fakedevice in normal or recovery mode.
+'''
+
+import os
+import re
+import time
+import shutil
+import hashlib
+import struct
+import socket
+import threading
+import SocketServer
+
+import fakedevice
+
+# answers of the recovery shell to the commands of partitions
+SHELL = {
+    'cat /proc/mtd': 'dev:    size   erasesize  name\n'
+                     'mtd0: 00500000 00020000 "boot"\n'
+                     'mtd1: 0b400000 00020000 "system"\n'
+                     'mtd2: 0a000000 00020000 "userdata"\n',
+}
+MTD = {'mtd0': 'boot', 'mtd1': 'system', 'mtd2': 'userdata'}
+# dev=/dev/mtd/mtd1; [ -e $dev ] || dev=/dev/mtd1; head -c 1234 $dev | md5sum
+PARTITION_MD5 = re.compile(r'^dev=/dev/mtd/(mtd\d+);.*head -c (\d+) ')
+# seconds between two looks at the states, for track-devices
+TRACK_POLL = 0.05
+# largest DATA packet of the sync service
+SYNC_DATA = 64 * 1024
+
+def encode(text):
+    '''string prefixed by its length, as the server sends them'''
+    return '%04x%s' % (len(text), text)
+
+def device_list(states):
+    '''device list, as sent for host:devices'''
+    return ''.join('%s\t%s\n' % (serial, state)
+                   for serial, state in sorted(states.items())
+                   if state in ('device', 'recovery'))
+
+
+def local_path(sdcard, path):
+    '''file of the simulated sdcard for a path of the phone'''
+    if not path.startswith('/sdcard/'):
+        return sdcard
+    return os.path.join(sdcard, path[len('/sdcard/'):])
+
+def usb(config, started, seconds):
+    '''wait until a transfer started at started took seconds over USB,
+    scaled, without adding up the oversleeps of a pause per packet'''
+    if config['time_scale'] > 0:
+        fakedevice.pause(config, seconds - (time.time() - started) /
+                         config['time_scale'])
+
+
+class Handler(SocketServer.BaseRequestHandler):
+    '''one connection of a client'''
+
+    def read_request(self):
+        length = self._recv(4)
+        return length and self._recv(int(length, 16))
+
+    def _recv(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return ''
+            data += chunk
+        return data
+
+    def fail(self, message):
+        self.request.sendall('FAIL' + encode(message))
+
+    def handle(self):
+        server = self.server
+        config = fakedevice.load_config(server.home)
+        fakedevice.pause(config, server.latency)
+        request = self.read_request()
+        if request == 'host:version':
+            self.request.sendall('OKAY' + encode('%04x' % 32))
+        elif request == 'host:devices':
+            self.request.sendall('OKAY' +
+                                 encode(device_list(server.devices.states())))
+        elif request == 'host:track-devices':
+            self.request.sendall('OKAY')
+            self.track()
+        elif request.startswith('host-serial:') and \
+             request.endswith(':get-state'):
+            serial = request[len('host-serial:'):-len(':get-state')]
+            state = server.devices.states().get(serial)
+            if state in ('device', 'recovery'):
+                self.request.sendall('OKAY' + encode(state))
+            else:
+                self.fail('device not found')
+        elif request.startswith('host:transport:'):
+            serial = request[len('host:transport:'):]
+            if server.devices.states().get(serial) not in ('device',
+                                                           'recovery'):
+                self.fail('device not found')
+                return
+            self.request.sendall('OKAY')
+            service = self.read_request()
+            if service == 'sync:':
+                self.request.sendall('OKAY')
+                self.sync(config, fakedevice.sdcard(serial, server.home))
+                return
+            if not service.startswith('shell:'):
+                self.fail('unknown service')
+                return
+            self.request.sendall('OKAY')
+            self.request.sendall(self.shell(service[len('shell:'):],
+                                            fakedevice.sdcard(serial,
+                                                              server.home),
+                                            serial))
+        elif request == 'host:kill':
+            self.request.sendall('OKAY')
+            threading.Thread(target=server.shutdown).start()
+        else:
+            self.fail('unknown host service')
+
+    def track(self):
+        last = None
+        while not self.server.stopping:
+            current = device_list(self.server.devices.states())
+            if current != last:
+                try:
+                    self.request.sendall(encode(current))
+                except socket.error:
+                    return
+                last = current
+            time.sleep(TRACK_POLL)
+
+    def sync(self, config, sdcard):
+        '''file requests, until QUIT'''
+        while True:
+            header = self._recv(8)
+            if not header or header[:4] == 'QUIT':
+                return
+            path = self._recv(struct.unpack('<I', header[4:])[0])
+            if header[:4] == 'SEND':
+                path, mode = path.rsplit(',', 1)
+            local = local_path(sdcard, path)
+            if header[:4] == 'LIST':
+                names = os.path.isdir(local) and os.listdir(local) or []
+                for name in sorted(names):
+                    info = os.stat(os.path.join(local, name))
+                    self.request.sendall('DENT' + struct.pack(
+                        '<4I', info.st_mode, info.st_size,
+                        int(info.st_mtime), len(name)) + name)
+                self.request.sendall('DONE' + struct.pack('<4I', 0, 0, 0, 0))
+            elif header[:4] == 'STAT':
+                if os.path.exists(local):
+                    info = os.stat(local)
+                    self.request.sendall('STAT' + struct.pack(
+                        '<3I', info.st_mode, info.st_size,
+                        int(info.st_mtime)))
+                else:
+                    self.request.sendall('STAT' + struct.pack('<3I', 0, 0, 0))
+            elif header[:4] == 'RECV':
+                if not os.path.isfile(local):
+                    message = 'No such file or directory'
+                    self.request.sendall('FAIL' + struct.pack('<I',
+                                                              len(message)) +
+                                         message)
+                    continue
+                started = time.time()
+                sent = 0
+                with open(local, 'rb') as source:
+                    data = source.read(SYNC_DATA)
+                    while data:
+                        sent += len(data)
+                        usb(config, started, float(sent) /
+                            config['pull_throughput'])
+                        self.request.sendall('DATA' +
+                                             struct.pack('<I', len(data)) +
+                                             data)
+                        data = source.read(SYNC_DATA)
+                self.request.sendall('DONE' + struct.pack('<I', 0))
+            elif header[:4] == 'SEND':
+                if os.path.isdir(local):
+                    # the data is sent all the same before the answer
+                    kind = self._recv(8)
+                    while kind[:4] == 'DATA':
+                        self._recv(struct.unpack('<I', kind[4:])[0])
+                        kind = self._recv(8)
+                    message = "couldn't create file: Is a directory"
+                    self.request.sendall('FAIL' + struct.pack('<I',
+                                                              len(message)) +
+                                         message)
+                    continue
+                if not os.path.isdir(os.path.dirname(local)):
+                    os.makedirs(os.path.dirname(local))
+                started = time.time()
+                received = 0
+                with open(local, 'wb') as out:
+                    while True:
+                        kind = self._recv(8)
+                        length = struct.unpack('<I', kind[4:])[0]
+                        if kind[:4] != 'DATA':
+                            break
+                        out.write(self._recv(length))
+                        received += length
+                        usb(config, started, float(received) /
+                            config['push_throughput'])
+                self.request.sendall('OKAY' + struct.pack('<I', 0))
+            else:
+                return
+
+    def shell(self, command, sdcard, serial):
+        if command in SHELL:
+            return SHELL[command]
+        if command.startswith('cat /sys/class/mtd/'):
+            return '2048\n'
+        found = PARTITION_MD5.match(command)
+        if found:
+            path = fakedevice.partition(serial, MTD[found.group(1)],
+                                        self.server.home)
+            if os.path.isfile(path):
+                return '%s  -\n' % fakedevice.page_md5(path,
+                                                       int(found.group(2)))
+        if command.startswith('mkdir -p /sdcard/'):
+            path = local_path(sdcard, command.split()[-1])
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            return ''
+        if command.startswith("md5sum '/sdcard/"):
+            path = local_path(sdcard, command.split("'")[1])
+            if not os.path.isfile(path):
+                return 'md5sum: %s: No such file or directory\n' % path
+            md5 = hashlib.md5()
+            with open(path, 'rb') as source:
+                for data in iter(lambda: source.read(1024 * 1024), ''):
+                    md5.update(data)
+            return '%s  %s\n' % (md5.hexdigest(), command.split("'")[1])
+        if command.startswith("rm -r '/sdcard/"):
+            shutil.rmtree(local_path(sdcard, command.split("'")[1]), True)
+            return ''
+        paths = [local_path(sdcard, path)
+                 for path in command.split("'")[1::2]]
+        if command.startswith("rm '/sdcard/"):
+            if not os.path.exists(paths[0]):
+                return "rm: can't remove '%s': No such file\n" % paths[0]
+            os.remove(paths[0])
+            return ''
+        if command.startswith("mv '/sdcard/"):
+            os.rename(paths[0], paths[1])
+            return ''
+        if command.startswith("cat '/sdcard/") and '>>' in command:
+            with open(paths[1], 'ab') as out:
+                with open(paths[0], 'rb') as source:
+                    shutil.copyfileobj(source, out)
+            os.remove(paths[2])
+            return ''
+        if command in ('mount /sdcard', 'sync; umount /sdcard'):
+            return ''
+        if 'md5sum' in command:
+            return 'd41d8cd98f00b204e9800998ecf8427e  -\n'
+        return '/sbin/sh: %s: not found\n' % command.split()[0]
+
+
+class FakeAdbServer(SocketServer.ThreadingTCPServer):
+    '''the fake server, on a free loopback port unless one is given'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, home, port=0, latency=0):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', port),
+                                                 Handler)
+        self.home = home
+        self.latency = latency
+        self.devices = fakedevice.Devices(home)
+        self.stopping = False
+        self.port = self.server_address[1]
+
+    def start(self):
+        '''serve in a background thread'''
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        '''stop serving and close the tracking connections'''
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
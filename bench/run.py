@@ -0,0 +1,703 @@
+#!/usr/bin/env python
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Benchmarks of the flasher against simulated phones
+
+    python bench/run.py [--scale 0.02] [--devices 1,2,4,8] [-v]
+
+Fake adb and fastboot programs and a fake adb server (see fakedevice)
+take the place of the SDK and of the phones, with the latency and
+throughputs measured on a GW620 scaled down by --scale.  Reported:
+
+- overhead of one command run through do_and_log, the runner and the adb
+  server client, against a bare subprocess
+- how long it takes to notice a phone booted into the recovery
+- end to end time of the update, backup and gapps workflows against the
+  time the simulated phone takes
+- total throughput of fleet updates as the number of phones grows
+- fleet updates with an injected failure
+- the metrics scraped after a fleet update, and what recording costs
+- the delta between two builds of system, then the update of a phone
+  running the base build with it, against a phone running another build
+- a phone whose bootloader listens on the network, flashed by the
+  built-in fastboot client instead of the program
+- pulls of the backups of phones on the same ROM to the store of the
+  host, and the storage they take once deduplicated, then the restore of
+  one of them against the time its push takes on USB
+
+The report is printed and written to bench_output.txt at the top of the
+tree.  The data directory of the flasher is a temporary one.
+'''
+
+import os
+import sys
+import time
+import json
+import urllib2
+import random
+import hashlib
+import zipfile
+import shutil
+import struct
+import argparse
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+HOME = tempfile.mkdtemp(prefix='uniflasher-bench')
+os.environ['FAKE_HOME'] = HOME
+os.environ['UNIFLASHER_HOME'] = os.path.join(HOME, 'data')
+sys.path[:0] = [ROOT, BENCH]
+
+import adbclient
+import backupstore
+import delta
+import devicemonitor
+import fakebootloader
+import fakedevice
+import fakeserver
+import flasher
+import images
+import metrics
+import progress
+import staging
+import usbtopo
+from runner import runner
+
+OUTPUT = os.path.join(ROOT, 'bench_output.txt')
+# sizes of the transcripts of "command result.txt"
+BOOT_SIZE = 7040 * 1024
+# yaffs2 images are made of 2112 bytes chunks
+SYSTEM_SIZE = 183906 * 1024 // 2112 * 2112
+# ext4 system image of the delta updates, in 4096 bytes blocks
+EXT4_SIZE = 64 * 1024 * 1024
+GAPPS_SIZE = 8 * 1024 * 1024
+# files of the simulated nandroid backups
+BACKUP_FILES = (('boot.img', 4 * 1024 * 1024),
+                ('system.img', 32 * 1024 * 1024),
+                ('data.img', 4 * 1024 * 1024))
+# pages of system.img which differ from a phone to another
+CHANGED_PAGES = 4
+
+
+class QuietProgress(object):
+    '''progress display showing nothing'''
+
+    def __init__(self, title, message, maximum):
+        pass
+
+    def update(self, value, message):
+        return True
+
+    def destroy(self):
+        pass
+
+
+def boot_image(path, size):
+    '''a valid boot image of the given size'''
+    page = 2048
+    with open(path, 'wb') as out:
+        out.write('ANDROID!' + struct.pack('<8I', size - 2 * page, 0, page, 0,
+                                           0, 0, 0, page))
+        out.truncate(size)
+
+def ext4_image(path, size):
+    '''an ext4 system image of random blocks'''
+    data = bytearray(os.urandom(size))
+    # superblock: blocks count, 4096 bytes blocks, magic
+    data[1028:1032] = struct.pack('<I', size // 4096)
+    data[1048:1052] = struct.pack('<I', 2)
+    data[1080:1082] = struct.pack('<H', 0xef53)
+    with open(path, 'wb') as out:
+        out.write(data)
+
+def empty_file(path, size):
+    '''a file of size zeros, without writing them'''
+    with open(path, 'wb') as out:
+        out.truncate(size)
+
+def wrapper(name, script):
+    '''executable running a fake program with this interpreter'''
+    path = os.path.join(HOME, name)
+    with open(path, 'w') as out:
+        out.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable,
+                                                      script))
+    os.chmod(path, 0755)
+    return path
+
+def timed(function, *args):
+    '''(seconds, result) of a call'''
+    started = time.time()
+    result = function(*args)
+    return time.time() - started, result
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+class Bench(object):
+    '''simulated phones and a flasher using them'''
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.config = dict(fakedevice.DEFAULTS, time_scale=scale)
+        fakedevice.save_config(self.config)
+        self.devices = fakedevice.Devices()
+        self.adb = wrapper('adb', os.path.join(BENCH, 'fakeadb.py'))
+        self.fastboot = wrapper('fastboot',
+                                os.path.join(BENCH, 'fakefastboot.py'))
+        self.server = fakeserver.FakeAdbServer(HOME)
+        self.server.start()
+
+        self.bootimg = os.path.join(HOME, 'boot.img')
+        boot_image(self.bootimg, BOOT_SIZE)
+        self.systemimg = os.path.join(HOME, 'system.img')
+        empty_file(self.systemimg, SYSTEM_SIZE)
+        self.recoveryimg = os.path.join(HOME, 'recovery.img')
+        boot_image(self.recoveryimg, 2 * 1024 * 1024)
+        self.gapps = os.path.join(HOME, 'gapps.zip')
+        empty_file(self.gapps, GAPPS_SIZE)
+
+        flasher.progress_display = QuietProgress
+        self.flasher = flasher.Flasher()
+        self.flasher.adb = self.adb
+        self.flasher.fastboot = self.fastboot
+        self.flasher.recoveryimg = self.recoveryimg
+        self.flasher.adbclient = adbclient.AdbClient(port=self.server.port)
+        self.flasher.monitor = devicemonitor.DeviceMonitor(
+            self.flasher.adbclient, self.fastboot, poll=0.1,
+            sysfs=os.path.join(HOME, 'nosysfs'))
+        self.flasher.bootimg = self.bootimg
+        self.flasher.systemimg = self.systemimg
+        self.flasher.gapps = self.gapps
+        self.flasher.start()
+
+    def configure(self, **changes):
+        '''change the simulation'''
+        self.config.update(changes)
+        fakedevice.save_config(self.config)
+
+    def plug(self, serials, state):
+        '''only these phones, in that state, seen by the flasher'''
+        for serial in self.devices.states():
+            if serial not in serials:
+                self.devices.remove(serial)
+        for serial in serials:
+            self.devices.set(serial, state)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            states = self.flasher.monitor.devices()
+            if all(states.get(serial) == state for serial in serials) and \
+               all(serial in serials for serial in states):
+                return
+            time.sleep(0.05)
+        raise RuntimeError('the simulated phones are not seen')
+
+    def model(self, *phases):
+        '''seconds the simulated phone takes for the phases, scaled'''
+        return sum(phases) * self.scale
+
+    def close(self):
+        self.flasher.stop()
+        self.server.stop()
+
+
+def overhead(bench, repeat):
+    '''cost of running one command'''
+    bench.configure(latency=0)
+    bench.plug(['O1'], 'fastboot')
+    args = [bench.fastboot, 'getvar', 'max-download-size']
+    runs = [
+        ('bare subprocess', lambda: subprocess.Popen(
+            args, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT).communicate()),
+        ('runner.run', lambda: runner.run(args)),
+        ('do_and_log', lambda: flasher.do_and_log(args)),
+        ('do_and_log with progress', lambda: flasher.do_and_log(
+            args, progress=progress.Progress('getvar'))),
+    ]
+    lines = ['Per command overhead (%d runs, fake fastboot getvar)' % repeat]
+    base = None
+    for name, run in runs:
+        seconds = mean([timed(run)[0] for i in range(repeat)])
+        base = base or seconds
+        lines.append('  %-26s %7.1f ms  (+%.1f ms)' % (name, seconds * 1000,
+                                                       (seconds - base) *
+                                                       1000))
+    bench.plug(['O1'], 'device')
+    seconds = mean([timed(bench.flasher.adbclient.devices)[0]
+                    for i in range(repeat)])
+    lines.append('  %-26s %7.1f ms' % ('adb server host:devices',
+                                       seconds * 1000))
+    bench.configure(latency=fakedevice.DEFAULTS['latency'])
+    return lines
+
+def recovery(bench, repeat):
+    '''delay between the phone in recovery and the flasher knowing it'''
+    config = bench.config
+    device = bench.flasher.for_device('R1')
+    lines = ['Recovery detection (%d runs)' % repeat]
+    delays = []
+    for i in range(repeat):
+        bench.plug(['R1'], 'fastboot')
+        seconds, serial = timed(device.recovery)
+        if serial != 'R1':
+            lines.append('  recovery not reached')
+            continue
+        expected = bench.model(config['latency'],
+                               float(os.path.getsize(bench.recoveryimg)) /
+                               config['throughput'],
+                               config['booting'], config['boot_delay'])
+        delays.append(seconds - expected)
+    if delays:
+        lines.append('  noticed %.0f ms after the phone (mean), %.0f ms max'
+                     % (mean(delays) * 1000, max(delays) * 1000))
+    return lines
+
+def workflows(bench):
+    '''end to end time of the workflows, against the simulated time'''
+    config = bench.config
+    device = bench.flasher.for_device('W1')
+    send = lambda size: float(size) / config['throughput']
+    write = lambda size: float(size) / config['write_throughput']
+    transcripts = fakedevice.transcripts()
+    lines = ['Workflows (simulated time scaled by %g)' % bench.scale]
+    # done once per image, then remembered
+    seconds = timed(lambda: [bench.flasher.images.submit(path, kind).result()
+                             for path, kind in ((bench.bootimg, 'boot'),
+                                                (bench.systemimg,
+                                                 'system'))])[0]
+    lines.append('  %-18s %6.2f s, once per image' % ('image checks',
+                                                     seconds))
+    cases = [
+        ('update with wipe', 'fastboot', device.flash_openetna,
+         bench.model(3 * config['latency'], sum(config['erase'].values()),
+                     send(BOOT_SIZE), write(BOOT_SIZE), send(SYSTEM_SIZE),
+                     write(SYSTEM_SIZE))),
+        ('nandroid backup', 'recovery', device.nandroid_backup,
+         bench.model(config['latency'], config['backup_line'] *
+                     len([line for line in transcripts['backup']
+                          if line.strip() and
+                          not line.startswith('* daemon')]))),
+        ('install gapps', 'device', device.install_gapps,
+         bench.model(2 * config['latency'],
+                     float(GAPPS_SIZE) / config['push_throughput'])),
+        # already on the sdcard: only checked
+        ('gapps again', 'device', device.install_gapps,
+         bench.model(2 * config['latency'])),
+    ]
+    for name, state, workflow, expected in cases:
+        bench.plug(['W1'], state)
+        seconds, ok = timed(workflow)
+        lines.append('  %-18s %6.2f s for %6.2f s simulated, overhead %5.1f%%%s'
+                     % (name, seconds, expected,
+                        (seconds - expected) * 100 / expected,
+                        not ok and ' FAILED' or ''))
+    return lines
+
+def staged(bench):
+    '''preparation of a zipped release, then of the same build again'''
+    release = os.path.join(HOME, 'release.zip')
+    with zipfile.ZipFile(release, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(bench.bootimg, 'boot.img')
+        archive.write(bench.systemimg, 'system.img')
+    copied = os.path.join(HOME, 'copy', 'release.zip')
+    os.makedirs(os.path.dirname(copied))
+    shutil.copy(release, copied)
+    cache = staging.StagingCache(os.path.join(HOME, 'staging'))
+    lines = ['Staging cache (zipped release, system %d KB)'
+             % (SYSTEM_SIZE // 1024)]
+    # a new registry is a new session, a new index forgets the checksums
+    for label, path, index in (('first time', release, 'cold'),
+                               ('next session', release, 'cold'),
+                               ('copied elsewhere', copied, 'other')):
+        registry = images.ImageRegistry(os.path.join(HOME, index + '.json'),
+                                        cache)
+        seconds = timed(lambda: [registry.submit(path, kind).result()
+                                 for kind in ('boot', 'system')])[0]
+        lines.append('  %-18s %6.2f s' % (label, seconds))
+    lines.append('  %d entries, %d KB staged' % (len(cache.entries()),
+                                                 cache.usage() // 1024))
+    return lines
+
+def fleet(bench, counts):
+    '''throughput of fleet updates as the number of phones grows'''
+    lines = ['Fleet update with wipe (boot %d KB, system %d KB per phone)'
+             % (BOOT_SIZE // 1024, SYSTEM_SIZE // 1024)]
+    single = None
+    for count in counts:
+        serials = ['F%02d' % number for number in range(1, count + 1)]
+        bench.plug(serials, 'fastboot')
+        seconds, ok = timed(bench.flasher.flash_fleet, True, serials)
+        # in unscaled time, as with real phones
+        rate = count * (BOOT_SIZE + SYSTEM_SIZE) / (seconds / bench.scale)
+        single = single or rate
+        lines.append('  %2d phones: %6.2f s, %5.2f MB/s, x%.2f%s'
+                     % (count, seconds, rate / 1e6, rate / single,
+                        not ok and ' FAILED' or ''))
+    return lines
+
+def scraped(bench, count):
+    '''metrics of a fleet update with a failure, scraped over HTTP'''
+    serials = ['M%02d' % number for number in range(1, count + 1)]
+    server = metrics.start(0, monitor=bench.flasher.monitor)
+    url = 'http://127.0.0.1:%d/metrics' % server.port
+    lines = ['Metrics (%s, fleet update of %d phones, flash system failing '
+             'on M01)' % (url, count)]
+    try:
+        bench.configure(failures={'M01': ['flash system']})
+        bench.plug(serials, 'fastboot')
+        bench.flasher.flash_fleet(True, serials)
+        bench.configure(failures={})
+        seconds, text = timed(lambda: urllib2.urlopen(url).read())
+        samples = dict(line.rsplit(' ', 1) for line in text.splitlines()
+                       if line and not line.startswith('#'))
+        sent = sum(float(value) for name, value in samples.items()
+                   if name.startswith('uniflasher_sent_bytes_total') and
+                   '"M' in name)
+        sending = sum(float(value) for name, value in samples.items()
+                      if name.startswith('uniflasher_sending_seconds_total')
+                      and '"M' in name)
+        lines.append('  scraped in %.1f ms, %d samples' % (seconds * 1000,
+                                                           len(samples)))
+        for name in ('uniflasher_phones_total{outcome="updated"}',
+                     'uniflasher_phones_total{outcome="failed"}',
+                     'uniflasher_steps_total{step="flash system",'
+                     'outcome="failed"}',
+                     'uniflasher_devices{state="fastboot"}'):
+            lines.append('  %-60s %s' % (name, samples.get(name, 'MISSING')))
+        lines.append('  %-60s %.2f MB/s' % ('sent bytes / sending seconds',
+                                            sending and sent / sending / 1e6
+                                            or 0))
+        record = {'id': 1, 'parent': None, 'name': 'fastboot flash',
+                  'kind': 'command', 'thread': 'bench', 'start': 0,
+                  'duration': 1.5, 'phases': [
+                      {'name': 'sending boot', 'start': 0, 'duration': 1.0,
+                       'status': 'OKAY'}],
+                  'attributes': {'serial': 'M01', 'bytes': BOOT_SIZE,
+                                 'exit_code': 0}}
+        registry = metrics.Metrics()
+        seconds = timed(lambda: [registry.span_ended(record)
+                                 for i in range(10000)])[0]
+        lines.append('  recording a span: %.1f us' % (seconds * 100))
+    finally:
+        server.stop()
+    return lines
+
+def failures(bench):
+    '''fleet update with one phone failing'''
+    serials = ['X1', 'X2', 'X3', 'X4']
+    bench.configure(failures={'X2': ['flash system']})
+    bench.plug(serials, 'fastboot')
+    results = {}
+    def report(serial, step, state):
+        if state == 'failed':
+            results[serial] = step
+    import fleet
+    seconds, failed = timed(fleet.flash_fleet, flasher.do_and_log,
+                            bench.fastboot, serials,
+                            fleet.update_steps(bench.bootimg,
+                                               [bench.systemimg]),
+                            4, report)
+    bench.configure(failures={})
+    expected = {'X2': 'flash system'}
+    found = dict((serial, step) for serial, step in failed.items() if step)
+    return ['Failure injection (flash system on X2)',
+            '  %.2f s, failed: %s%s' % (seconds, json.dumps(found),
+                                        found != expected and
+                                        ' UNEXPECTED' or '')]
+
+def usb_tree(sysfs, ports):
+    '''fabricated sysfs of phones in fastboot on the given USB ports, e.g.
+    {"H1": "1-1.1"}, with the hubs and root hubs they are behind'''
+    def device(name, **attributes):
+        path = os.path.join(sysfs, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for attribute, value in attributes.items():
+            with open(os.path.join(path, attribute), 'w') as out:
+                out.write(value + '\n')
+    for serial, port in ports.items():
+        device('usb' + port.split('-')[0], bDeviceClass='09')
+        hub = port.rsplit('.', 1)[0]
+        while '.' in port and hub != port:
+            device(hub, bDeviceClass='09')
+            port, hub = hub, hub.rsplit('.', 1)[0]
+        device(ports[serial], bDeviceClass='00', serial=serial)
+        device(ports[serial] + ':1.0', bInterfaceClass='ff',
+               bInterfaceSubClass='42', bInterfaceProtocol='03')
+
+def hubs(bench):
+    '''fleet update of phones sharing hubs, with and without the scheduler'''
+    count = 6
+    # four phones behind the hub of port 1, two behind the one of port 2,
+    # on bus 1 for the first run and on bus 2 for the second one
+    ports = dict(('%s%d' % (prefix, number),
+                  '%d-%d.%d' % (bus, number <= 4 and 1 or 2, number))
+                 for bus, prefix in ((1, 'U'), (2, 'S'))
+                 for number in range(1, count + 1))
+    sysfs = os.path.join(HOME, 'sysfs')
+    usb_tree(sysfs, ports)
+    scheduler = usbtopo.HubScheduler(usbtopo.hubs(sysfs))
+    bench.configure(hubs=dict((serial, usbtopo.link(port))
+                              for serial, port in ports.items()),
+                    hub_throughput=2 * fakedevice.DEFAULTS['throughput'],
+                    hub_senders=usbtopo.HUB_TRANSFERS)
+    lines = ['Shared hubs (%d phones, 4 and 2 per hub, %d transfers at once '
+             'per hub before failures)' % (count, usbtopo.HUB_TRANSFERS)]
+    import fleet
+    for prefix, label, used in (('U', 'all at once', None),
+                                ('S', 'scheduled', scheduler)):
+        serials = ['%s%d' % (prefix, number)
+                   for number in range(1, count + 1)]
+        bench.plug(serials, 'fastboot')
+        retried = []
+        def report(serial, step, state):
+            if state == 'retried':
+                retried.append(serial)
+        seconds, results = timed(fleet.flash_fleet, flasher.do_and_log,
+                                 bench.fastboot, serials,
+                                 fleet.update_steps(bench.bootimg,
+                                                    [bench.systemimg]),
+                                 count, report, None, 0.1, None, None, None,
+                                 used)
+        failed = sorted(serial for serial in serials if results.get(serial))
+        lines.append('  %-12s %6.2f s, %d/%d updated, %d retries%s'
+                     % (label, seconds, count - len(failed), count,
+                        len(retried), failed and ' (failed: %s)' %
+                        ', '.join(failed) or ''))
+    bench.configure(hubs={}, hub_throughput=None, hub_senders=None)
+    return lines
+
+def fail_fast(bench):
+    '''failures noticed when they are printed, not when the command ends'''
+    hang = 300
+    bench.configure(failures={'Z1': ['flash boot', 'backup']},
+                    failure_hang=hang)
+    device = bench.flasher.for_device('Z1')
+    lines = ['Fail fast (the commands stall %.2f s after printing a failure)'
+             % (hang * bench.scale)]
+    for name, state, operation in (
+            ('flash boot', 'fastboot',
+             lambda: device.flash('boot', bench.bootimg)),
+            ('nandroid backup', 'recovery', device.nandroid_backup)):
+        bench.plug(['Z1'], state)
+        seconds, ok = timed(operation)
+        lines.append('  %-18s %6.2f s%s' % (name, seconds,
+                                            ok and ' UNNOTICED' or ''))
+    bench.configure(failures={}, failure_hang=0.0)
+    return lines
+
+def network(bench, repeat):
+    '''a phone flashed over TCP by the built-in fastboot client'''
+    config = bench.config
+    bootloader = fakebootloader.FakeBootloader(HOME)
+    bootloader.start()
+    serial = bootloader.serial
+    bench.flasher.monitor.network.append(serial)
+    send = lambda size: float(size) / config['throughput']
+    write = lambda size: float(size) / config['write_throughput']
+    lines = ['Fastboot over TCP (%s)' % serial]
+    try:
+        bench.configure(latency=0)
+        bench.plug(['N1', serial], 'fastboot')
+        for name, target in (('fastboot program', 'N1'),
+                             ('built-in client', serial)):
+            args = [bench.fastboot, '-s', target, 'getvar',
+                    'max-download-size']
+            seconds = mean([timed(flasher.do_and_log, args)[0]
+                            for i in range(repeat)])
+            lines.append('  getvar, %-18s %7.1f ms' % (name, seconds * 1000))
+        bench.configure(latency=fakedevice.DEFAULTS['latency'])
+        bench.plug([serial], 'fastboot')
+        expected = bench.model(sum(config['erase'].values()), send(BOOT_SIZE),
+                               write(BOOT_SIZE), send(SYSTEM_SIZE),
+                               write(SYSTEM_SIZE))
+        seconds, ok = timed(bench.flasher.for_device(serial).flash_openetna)
+        lines.append('  %-26s %6.2f s for %6.2f s simulated, %d KB received%s'
+                     % ('update with wipe', seconds, expected,
+                        bootloader.received // 1024,
+                        not ok and ' FAILED' or ''))
+    finally:
+        bench.flasher.monitor.network.remove(serial)
+        bootloader.stop()
+    return lines
+
+def build(path, source, changed, block=2112):
+    '''a build of system differing from source by changed blocks, yaffs2
+    chunks by default, keeping the first one'''
+    shutil.copy(source, path)
+    blocks = os.path.getsize(source) // block
+    with open(path, 'r+b') as out:
+        for number in random.sample(xrange(1, blocks), changed):
+            out.seek(number * block)
+            out.write(os.urandom(block))
+
+def deltas(bench):
+    '''updates sending only the blocks of system which changed'''
+    blocks = EXT4_SIZE // 4096
+    system = os.path.join(HOME, 'ext4-system.img')
+    ext4_image(system, EXT4_SIZE)
+    base = os.path.join(HOME, 'base-system.img')
+    build(base, system, blocks // 50, 4096)
+    other = os.path.join(HOME, 'other-system.img')
+    build(other, system, blocks // 50, 4096)
+    # yaffs2 images have no delta: the partitions which changed are flashed
+    yaffs2 = os.path.join(HOME, 'base-yaffs2-system.img')
+    build(yaffs2, bench.systemimg, SYSTEM_SIZE // 2112 // 50)
+    # serial, its system, the base build given and the image to flash
+    phones = (('D1', base, base, system, 'phone on the base build'),
+              ('D2', other, base, system, 'phone on another build'),
+              ('D3', yaffs2, yaffs2, bench.systemimg,
+               'phone on a yaffs2 build'))
+    for serial, installed, given, target, label in phones:
+        os.makedirs(os.path.dirname(fakedevice.partition(serial, 'system')))
+        shutil.copy(installed, fakedevice.partition(serial, 'system'))
+        shutil.copy(bench.bootimg, fakedevice.partition(serial, 'boot'))
+    lines = ['Delta update (%d of %d ext4 blocks changed, %d processes)'
+             % (blocks // 50, blocks, delta.WORKERS)]
+    for label in ('delta computed', 'delta again'):
+        seconds, paths = timed(bench.flasher.images.delta, base, system,
+                               'system')
+        lines.append('  %-26s %6.2f s, %d KB to send' % (
+            label, seconds, os.path.getsize(paths[0]) // 1024))
+    # long enough for the fastboot poll to see the phones leave fastboot
+    bench.configure(boot_delay=30.0)
+    for serial, installed, given, target, label in phones:
+        bench.plug([serial], 'fastboot')
+        device = bench.flasher.for_device(serial)
+        device.systemimg = target
+        seconds, ok = timed(device.flash_delta, given)
+        size = os.path.getsize(target)
+        updated = fakedevice.page_md5(
+            fakedevice.partition(serial, 'system'), size) == \
+                fakedevice.page_md5(target, size)
+        # left on the sdcard once the delta was applied
+        applied = os.path.exists(os.path.join(
+            fakedevice.sdcard(serial), delta.REMOTE[len('/sdcard/'):],
+            delta.SCRIPT))
+        # fakefastboot does not write the partitions it flashes
+        lines.append('  %-26s %6.2f s, %s%s' % (
+            label, seconds, applied and 'system %s from the delta' % (
+                updated and 'updated' or 'NOT updated') or
+            'whole partitions flashed', not ok and ' FAILED' or ''))
+    bench.configure(boot_delay=fakedevice.DEFAULTS['boot_delay'])
+    return lines
+
+def nandroid_backup(serial, rom):
+    '''nandroid backup on the sdcard of a phone, sharing boot and most of
+    system with the other phones'''
+    directory = os.path.join(fakedevice.sdcard(serial), 'nandroid',
+                             'no_console_suspend=1', 'BCDS-20110315-1918')
+    os.makedirs(directory)
+    md5sums = []
+    for name, size in BACKUP_FILES:
+        if name == 'data.img':
+            data = os.urandom(size)
+        else:
+            data = rom[name]
+        if name == 'system.img':
+            data = bytearray(data)
+            for number in range(CHANGED_PAGES):
+                offset = random.randrange(size // 2112) * 2112
+                data[offset:offset + 2112] = os.urandom(2112)
+            data = str(data)
+        with open(os.path.join(directory, name), 'wb') as out:
+            out.write(data)
+        md5sums.append('%s  %s\n' % (hashlib.md5(data).hexdigest(), name))
+    with open(os.path.join(directory, 'nandroid.md5'), 'w') as out:
+        out.write(''.join(md5sums))
+
+def backups(bench, count):
+    '''pulls of the backups of phones on the same ROM to the host store'''
+    serials = ['B%02d' % number for number in range(1, count + 1)]
+    rom = dict((name, os.urandom(size)) for name, size in BACKUP_FILES
+               if name != 'data.img')
+    for serial in serials:
+        nandroid_backup(serial, rom)
+    total = sum(size for name, size in BACKUP_FILES)
+    bench.plug(serials, 'device')
+    lines = ['Backups pulled to the host (%d KB per phone, %d pages of '
+             'system.img differ)' % (total // 1024, CHANGED_PAGES)]
+    store = bench.flasher.backups
+    for serial in serials:
+        seconds, ok = timed(bench.flasher.pull_backup, serial)
+        manifest = store.manifest(serial) or {}
+        lines.append('  %s: %5.2f s, %6d KB pulled, %6d KB new%s'
+                     % (serial, seconds, manifest.get('pulled', 0) // 1024,
+                        manifest.get('written', 0) // 1024,
+                        not ok and ' FAILED' or ''))
+    chunks, size = store.usage()
+    lines.append('  %d phones: %d KB of backups in %d chunks, %d KB stored'
+                 % (count, count * total // 1024, chunks, size // 1024))
+    config = bench.config
+    manifest = store.manifest(serials[0])
+    pushed = sum(entry['size'] for entry in manifest['files'].values())
+    bench.plug(serials[:1], 'recovery')
+    seconds = timed(backupstore.push_backup, bench.flasher.adbclient,
+                    serials[0], store, manifest)[0]
+    expected = bench.model(float(pushed) / config['push_throughput'])
+    lines.append('  push back to %s: %5.2f s for %5.2f s on USB, overhead '
+                 '%5.1f%%' % (serials[0], seconds, expected,
+                              (seconds - expected) * 100 / expected))
+    bench.plug(serials[:1], 'fastboot')
+    seconds, ok = timed(bench.flasher.restore_from_host, serials[0])
+    lines.append('  restore from the host: %5.2f s%s'
+                 % (seconds, not ok and ' FAILED' or ''))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the flasher ' +
+                                     'against simulated phones')
+    parser.add_argument('--scale', type=float, default=0.02,
+                        help='time scale of the simulated phones')
+    parser.add_argument('--devices', default='1,2,4,8',
+                        help='numbers of phones of the fleet updates')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='runs of the short benchmarks')
+    parser.add_argument('-o', '--output', default=OUTPUT,
+                        help='report file')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show the output of the flasher')
+    args = parser.parse_args()
+    stderr = sys.stderr
+    if not args.verbose:
+        sys.stderr = open(os.path.join(HOME, 'flasher.log'), 'w')
+    bench = None
+    report = ['uniFlasher benchmarks, ' + time.strftime('%Y-%m-%d %H:%M'),
+              '']
+    try:
+        bench = Bench(args.scale)
+        for lines in (overhead(bench, args.repeat),
+                      recovery(bench, min(args.repeat, 3)),
+                      workflows(bench),
+                      staged(bench),
+                      fleet(bench, [int(count) for count
+                                    in args.devices.split(',')]),
+                      failures(bench),
+                      scraped(bench, max(int(count) for count
+                                         in args.devices.split(','))),
+                      hubs(bench),
+                      fail_fast(bench),
+                      network(bench, args.repeat),
+                      deltas(bench),
+                      backups(bench, max(int(count) for count
+                                         in args.devices.split(',')))):
+            report += lines + ['']
+            print >> stderr, '\n'.join(lines)
+    finally:
+        if bench:
+            bench.close()
+        sys.stderr = stderr
+        shutil.rmtree(HOME, True)
+    with open(args.output, 'w') as out:
+        out.write('\n'.join(report))
+    print >> sys.stderr, 'Report written to', args.output
+
+if __name__ == '__main__':
+    main()
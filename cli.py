@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Command line interface of the flasher, for headless flashing hosts
+
+    cli.py flash --boot boot.img --system system.img [--no-wipe]
+    cli.py flash --boot boot.img [--wipe]
+    cli.py flash --boot boot.img --system system.img --base old/system.img
+    cli.py wipe | backup [--pull] | restore | devices
+    cli.py pull [--from /sdcard/nandroid/...]
+    cli.py restore --from-computer [--date 20110315-191800]
+    cli.py backups
+    cli.py gapps gapps.zip
+    cli.py logcat -o logcat.txt [--duration 60] [*:W]
+    cli.py job batch.json
+
+Without a command, the main window is opened: wx is only imported then,
+and the flashing operations only once a command is parsed, so that the
+command line starts quickly even on hosts without a display (-v shows the
+startup time).  --trace and --chrome-trace save the timings of every
+command and step, see tracing.  backup --pull and pull copy the backups
+to the store of this computer, see backupstore, backups lists them and
+restore --from-computer puts one back.  --staging-size bounds the cache of
+prepared images, see staging.  --fastboot-tcp adds a phone whose
+bootloader listens on the network, flashed by the built-in fastboot
+client, see fastbootproto; adb cannot reach its recovery, so --changed,
+--base, backup and restore refuse it.  --metrics-port serves the throughput of the
+station to Prometheus while the command runs, see metrics.
+
+A job file holds a JSON list of jobs run one after the other, stopping at
+the first failure unless "keep_going" is set at the top level (the list is
+then in "jobs").  A job is either a list of words of a command line, or an
+object such as {"command": "flash", "boot": "boot.img", "wipe": false}
+whose keys are the long options of the command, "args" giving its other
+arguments.
+'''
+
+import time
+STARTED = time.time()
+
+import os
+import sys
+import json
+import argparse
+
+def parser():
+    '''parser of the command line, also used for the jobs'''
+    main = argparse.ArgumentParser(
+        description='Flash OpenEtna images on LG Eve (GW620) phones')
+    main.add_argument('-v', '--verbose', action='store_true',
+                      help='show the startup time')
+    main.add_argument('--trace', metavar='FILE',
+                      help='append the timings of the commands to a JSON ' +
+                      'lines file')
+    main.add_argument('--chrome-trace', metavar='FILE',
+                      help='write the timings of the commands in the ' +
+                      'Chrome trace format at the end')
+    main.add_argument('--fastboot-tcp', metavar='HOST[:PORT]', action='append',
+                      default=[], help='fastboot device on the network, ' +
+                      'then known as tcp:HOST[:PORT]; may be repeated')
+    main.add_argument('--metrics-port', metavar='PORT', type=int,
+                      default=None, help='serve metrics in the Prometheus ' +
+                      'format on 127.0.0.1:PORT/metrics')
+    main.add_argument('--staging-size', metavar='MB', type=int, default=None,
+                      help='size limit of the cache of decompressed and ' +
+                      'converted images')
+    commands = main.add_subparsers(dest='command')
+
+    flash = commands.add_parser('flash', help='flash boot and system images')
+    flash.add_argument('--boot', default='', help='boot image')
+    flash.add_argument('--system', default='', help='system image')
+    flash.add_argument('--wipe', dest='wipe', action='store_true',
+                       default=None, help='wipe the user data, the default ' +
+                       'when flashing both images')
+    flash.add_argument('--no-wipe', dest='wipe', action='store_false',
+                       help='keep the user data, the default when flashing ' +
+                       'a single image')
+    flash.add_argument('--changed', action='store_true',
+                       help='only flash the partitions which differ ' +
+                       '(implies --no-wipe)')
+    flash.add_argument('--base', default='',
+                       help='system image the phone runs: only the blocks ' +
+                       'which differ are sent (implies --no-wipe)')
+    flash.add_argument('--all', action='store_true',
+                       help='update every phone in fastboot mode at once')
+    flash.add_argument('-s', '--serial', action='append', default=[],
+                       help='device to flash, may be repeated')
+
+    for name, description in (('wipe', 'wipe the user data'),
+                              ('devices', 'list the connected devices')):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('-s', '--serial', default=None,
+                             help='device to use')
+
+    backup = commands.add_parser('backup',
+                                 help='nandroid backup on the SD card')
+    backup.add_argument('--pull', action='store_true',
+                        help='then copy it to this computer')
+    backup.add_argument('-s', '--serial', default=None, help='device to use')
+
+    pull = commands.add_parser('pull', help='copy the last nandroid backup ' +
+                               'to this computer')
+    pull.add_argument('--from', dest='remote', default=None,
+                      help='directory of another backup on the SD card')
+    pull.add_argument('-s', '--serial', default=None, help='device to use')
+
+    restore = commands.add_parser('restore',
+                                  help='restore the last nandroid backup')
+    restore.add_argument('--from-computer', dest='host', action='store_true',
+                         help='restore a backup kept on this computer')
+    restore.add_argument('--date', default=None,
+                         help='backup to restore, the last one by default')
+    restore.add_argument('-s', '--serial', default=None, help='device to use')
+
+    stored = commands.add_parser('backups', help='list the backups kept ' +
+                                 'on this computer')
+    stored.add_argument('-s', '--serial', default=None,
+                        help='only those of that device')
+
+    gapps = commands.add_parser('gapps', help='install Google Apps')
+    gapps.add_argument('gapps', help='zipped gapps file')
+    gapps.add_argument('-s', '--serial', default=None, help='device to use')
+
+    log = commands.add_parser('logcat', help='capture the logcat')
+    log.add_argument('-o', '--output',
+                     default=time.strftime('logcat_%Y%m%d%H%M%S.txt',
+                                           time.localtime()),
+                     help='log file, one per device with several devices')
+    log.add_argument('--duration', type=float, default=None,
+                     help='seconds to capture, until interrupted otherwise')
+    log.add_argument('--rotate-size', type=int, default=None,
+                     help='rotate the log file after that many bytes')
+    log.add_argument('--rotate-age', type=float, default=None,
+                     help='rotate the log file after that many seconds')
+    log.add_argument('--compress', action='store_true',
+                     help='gzip the log files')
+    log.add_argument('-s', '--serial', action='append', default=None,
+                     help='device to capture, may be repeated')
+    log.add_argument('filters', nargs='*', help='logcat filters, e.g. *:W')
+
+    job = commands.add_parser('job', help='run the jobs of a JSON file')
+    job.add_argument('jobfile', help='JSON job file')
+
+    commands.add_parser('gui', help='open the main window')
+    return main
+
+def command_names(main):
+    '''names of the commands of a parser'''
+    return [name for action in main._actions
+            if isinstance(action, argparse._SubParsersAction)
+            for name in action.choices]
+
+def job_words(job):
+    '''command line words of a job of a job file'''
+    if isinstance(job, list):
+        return [unicode(word) for word in job]
+    job = dict(job)
+    words = [job.pop('command')]
+    positional = job.pop('args', [])
+    for key, value in sorted(job.items()):
+        option = '--' + key.replace('_', '-')
+        if key == 'wipe':
+            if value is not None:
+                words.append(value and '--wipe' or '--no-wipe')
+        elif value is True:
+            words.append(option)
+        elif isinstance(value, list):
+            for item in value:
+                words += [option, unicode(item)]
+        elif value not in (None, False):
+            words += [option, unicode(value)]
+    if isinstance(positional, list):
+        return words + [unicode(word) for word in positional]
+    return words + [unicode(positional)]
+
+def flash(flasher, args):
+    '''flash command'''
+    flasher.bootimg = args.boot
+    flasher.systemimg = args.system
+    wipe = args.wipe
+    if wipe is None:
+        # only a whole update wipes the user data unless asked to
+        wipe = bool(args.boot and args.system)
+    if args.changed or args.base:
+        # neither is done by the fleet update, and both keep the user data
+        if args.all or len(args.serial) > 1:
+            print >> sys.stderr, '--changed and --base update a single ' + \
+                    'phone: give at most one -s, without --all'
+            return False
+        if args.wipe:
+            print >> sys.stderr, '--changed and --base keep the user ' + \
+                    'data: --wipe cannot go with them'
+            return False
+    if args.all or len(args.serial) > 1:
+        return flasher.flash_fleet(wipe, args.serial or None)
+    if args.serial:
+        flasher = flasher.for_device(args.serial[0])
+    if args.base:
+        return flasher.flash_delta(args.base)
+    if args.changed:
+        return flasher.flash_changed()
+    if args.boot and args.system:
+        if wipe:
+            return flasher.flash_openetna()
+        return flasher.flash_openetna_wo_wipe()
+    if args.boot or args.system:
+        return (not wipe or flasher.wipe()) and \
+                flasher.flash(args.boot and 'boot' or 'system',
+                              args.boot or args.system)
+    print >> sys.stderr, 'Nothing to flash: give --boot and/or --system'
+    return False
+
+def logcat(flasher, args):
+    '''logcat command'''
+    captures = flasher.start_logcat(os.path.abspath(args.output),
+                                    args.serial, filters=args.filters,
+                                    max_bytes=args.rotate_size,
+                                    max_age=args.rotate_age,
+                                    compress=args.compress)
+    if not captures:
+        print >> sys.stderr, 'No device to capture the logcat of'
+        return False
+    deadline = args.duration and time.time() + args.duration
+    try:
+        while any(capture.running() for capture in captures) and \
+              (not deadline or time.time() < deadline):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    for capture in captures:
+        capture.stop()
+        print >> sys.stderr, capture.serial, ':', capture.lines, 'lines'
+    return True
+
+def devices(flasher, args):
+    '''devices command'''
+    for serial, state in sorted(flasher.monitor.devices().items()):
+        if not args.serial or serial == args.serial:
+            print serial + '\t' + state
+    return True
+
+def backups(flasher, args):
+    '''backups command'''
+    store = flasher.backups
+    for serial in args.serial and [args.serial] or store.serials():
+        for date in store.backups(serial):
+            manifest = store.manifest(serial, date) or {}
+            files = manifest.get('files', {})
+            print '%s\t%s\t%d bytes\t%s' % (
+                serial, date, sum(entry['size'] for entry in files.values()),
+                ' '.join(sorted(files)))
+    return True
+
+def run(flasher, args):
+    '''run a parsed command line, return True on success'''
+    if args.command == 'flash':
+        return flash(flasher, args)
+    if args.command == 'logcat':
+        return logcat(flasher, args)
+    if args.command == 'devices':
+        return devices(flasher, args)
+    if args.command == 'backups':
+        return backups(flasher, args)
+    if args.command == 'job':
+        return jobs(flasher, args.jobfile)
+    if args.serial:
+        flasher = flasher.for_device(args.serial)
+    if args.command == 'wipe':
+        return flasher.wipe()
+    if args.command == 'backup':
+        if args.pull:
+            return flasher.backup_to_host()
+        return flasher.simple_backup()
+    if args.command == 'pull':
+        return flasher.pull_backup(remote=args.remote)
+    if args.command == 'restore':
+        if args.host or args.date:
+            return flasher.restore_from_host(date=args.date)
+        return flasher.nandroid_restore()
+    if args.command == 'gapps':
+        flasher.gapps = os.path.abspath(args.gapps)
+        return flasher.install_gapps()
+    return False
+
+def jobs(flasher, jobfile):
+    '''run the jobs of a job file'''
+    try:
+        with open(jobfile) as jobs_file:
+            batch = json.load(jobs_file)
+    except (IOError, ValueError), error:
+        print >> sys.stderr, 'Cannot read', jobfile, ':', error
+        return False
+    keep_going = False
+    if isinstance(batch, dict):
+        keep_going = batch.get('keep_going', False)
+        batch = batch.get('jobs', [])
+    # relative paths in jobs are relative to the job file
+    directory = os.path.dirname(os.path.abspath(jobfile))
+    current = os.getcwd()
+    failed = 0
+    try:
+        os.chdir(directory)
+        for number, job in enumerate(batch):
+            try:
+                words = job_words(job)
+            except (KeyError, TypeError, AttributeError):
+                print >> sys.stderr, 'Invalid job #%d: %r' % (number + 1, job)
+                words = None
+            try:
+                args = words and parser().parse_args(words)
+            except SystemExit:
+                args = None
+            if args and args.command == 'job':
+                print >> sys.stderr, 'Job files cannot include other ones'
+                args = None
+            if args:
+                print >> sys.stderr, 'Job #%d: %s' % (number + 1,
+                                                     ' '.join(words))
+            if not args or not run(flasher, args):
+                print >> sys.stderr, 'Job #%d failed' % (number + 1)
+                failed += 1
+                if not keep_going:
+                    break
+    finally:
+        os.chdir(current)
+    return not failed
+
+def gui():
+    '''open the main window, the only place wx is imported'''
+    import wx
+    import uniflasher
+    # Create the app, don't redirect stdout/stderr.
+    app = wx.App(False)
+    frame = uniflasher.MainWindow()
+    app.MainLoop()
+    return True
+
+def main(argv=None):
+    '''run the command line, return the exit status'''
+    argv = sys.argv[1:] if argv is None else argv
+    options = parser()
+    # option values such as the file of --trace are not commands
+    names = command_names(options)
+    if not [word for word in argv if word in names] and \
+       not [word for word in argv if word in ('-h', '--help')]:
+        argv = argv + ['gui']
+    args = options.parse_args(argv)
+    if args.command == 'gui':
+        return not gui()
+    import flasher
+    if args.verbose:
+        print >> sys.stderr, 'Started in %d ms' % ((time.time() - STARTED)
+                                                    * 1000)
+    import tracing
+    if args.trace:
+        tracing.tracer.stream(args.trace)
+    device = flasher.Flasher()
+    if args.staging_size is not None:
+        device.images.cache.limit = args.staging_size * 1024 * 1024
+    device.monitor.network += ['tcp:' + host for host in args.fastboot_tcp]
+    server = None
+    if args.metrics_port is not None:
+        import metrics
+        server = metrics.start(args.metrics_port, monitor=device.monitor)
+    device.start()
+    try:
+        with tracing.tracer.start(' '.join(argv), 'session'):
+            return not run(device, args)
+    finally:
+        device.stop()
+        if server:
+            server.stop()
+        tracing.tracer.close()
+        if args.chrome_trace:
+            tracing.write_chrome_trace(tracing.tracer.spans(),
+                                       args.chrome_trace)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Where uniFlasher keeps its state between runs
+
+~/.uniflasher unless the UNIFLASHER_HOME environment variable says
+otherwise.
+'''
+
+import os
+import json
+import threading
+
+DATADIR = os.environ.get('UNIFLASHER_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.uniflasher')
+
+def datapath(*names):
+    '''path of a file of the data directory, creating its directory'''
+    path = os.path.join(DATADIR, *names)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by someone else in the meantime
+            if not os.path.isdir(directory):
+                raise
+    return path
+
+def load_json(path, default=None):
+    '''content of a JSON file, default if it is missing or broken'''
+    try:
+        with open(path) as jsonfile:
+            return json.load(jsonfile)
+    except (IOError, OSError, ValueError):
+        return default
+
+def save_json(path, data):
+    '''atomically replace a JSON file'''
+    tmppath = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                threading.current_thread().ident)
+    with open(tmppath, 'w') as jsonfile:
+        json.dump(data, jsonfile, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(path):
+        # no atomic replace there
+        os.remove(path)
+    os.rename(tmppath, path)
@@ -0,0 +1,108 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Live status of every connected phone
+
+One row per serial: its state as seen by the device monitor, the step
+being run on it, the throughput and the time left of its current
+command.  Operations update it from their own threads; the main window
+reads a copy of the rows on a timer, so that nothing but its own thread
+touches wx.  Commands showing progress stop when their phone is
+cancelled.
+'''
+
+import threading
+
+class Dashboard(object):
+    '''rows of the connected phones and of the ones being worked on'''
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def _row(self, serial):
+        if serial not in self._rows:
+            self._rows[serial] = {'serial': serial, 'state': None,
+                                  'step': '', 'rate': None,
+                                  'estimated': False, 'remaining': None,
+                                  'busy': False, 'cancelled': False}
+        return self._rows[serial]
+
+    def device_event(self, serial, state, previous=None):
+        '''device monitor subscriber'''
+        with self._lock:
+            row = self._row(serial)
+            row['state'] = state
+            if state is None and not row['busy']:
+                del self._rows[serial]
+
+    def start(self, serial, step):
+        '''an operation starts on the phone'''
+        with self._lock:
+            row = self._row(serial)
+            row.update(step=step, busy=True, cancelled=False, rate=None,
+                       estimated=False, remaining=None)
+
+    def step(self, serial, step):
+        '''what is being done on the phone'''
+        with self._lock:
+            self._row(serial)['step'] = step
+
+    def progress(self, serial, step, rate=None, remaining=None,
+                 estimated=False):
+        '''progress of the command run on the phone, estimated if the
+        rate was not measured'''
+        with self._lock:
+            self._row(serial).update(step=step, rate=rate,
+                                     estimated=estimated,
+                                     remaining=remaining)
+
+    def finish(self, serial, step):
+        '''the operation is over, step tells how it went'''
+        with self._lock:
+            row = self._row(serial)
+            row.update(step=step, busy=False, rate=None, estimated=False,
+                       remaining=None)
+            if row['state'] is None:
+                del self._rows[serial]
+
+    def cancel(self, serial):
+        '''stop the command run on the phone, if it shows progress'''
+        with self._lock:
+            if serial in self._rows and self._rows[serial]['busy']:
+                self._rows[serial]['cancelled'] = True
+
+    def cancelled(self, serial):
+        '''should the command run on the phone stop'''
+        with self._lock:
+            return serial in self._rows and self._rows[serial]['cancelled']
+
+    def busy(self, serial):
+        '''is an operation running on the phone'''
+        with self._lock:
+            return serial in self._rows and self._rows[serial]['busy']
+
+    def rows(self):
+        '''copy of the rows, by serial'''
+        with self._lock:
+            return [dict(self._rows[serial]) for serial in sorted(self._rows)]
+
+dashboard = Dashboard()
+
+
+class HiddenProgress(object):
+    '''progress display of do_and_log showing nothing by itself, for when
+    the dashboard shows the progress'''
+
+    def __init__(self, title, message, maximum):
+        pass
+
+    def update(self, value, message):
+        '''progress goes on'''
+        return True
+
+    def destroy(self):
+        '''progress is over'''
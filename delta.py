@@ -0,0 +1,226 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Block level differences between two builds of an image
+
+Successive OpenEtna builds leave most of system.img as it was.  The new
+image is compared to a base image block by block, by several processes
+each taking a range of blocks, and the blocks which differ are written
+one after the other to a payload, with a manifest listing their runs.
+The delta is applied to the base in memory and checked against the
+SHA-256 of the new image before being kept.
+
+On the phone, a script run by the busybox of the recovery dumps the
+partition holding the base build, writes the runs of the payload over it
+with dd, checks the MD5 of the result and only then flashes it: only the
+payload goes through USB.  dump_image only reads back the pages, not the
+out of band data of yaffs2 images, which therefore have no delta.
+
+    python delta.py base.img new.img outdir
+'''
+
+import os
+import sys
+import mmap
+import hashlib
+import multiprocessing
+
+import config
+
+BLOCK_SIZE = 4096
+# blocks compared at once before looking for the ones which differ
+WINDOW = 256
+# ranges of blocks per process, to even out their work
+SLICES = 4
+try:
+    WORKERS = multiprocessing.cpu_count()
+except NotImplementedError:
+    WORKERS = 1
+# below that size, starting processes costs more than it saves
+PARALLEL_SIZE = 16 * 1024 * 1024
+PAYLOAD = 'blocks.bin'
+MANIFEST = 'delta.json'
+SCRIPT = 'apply.sh'
+# directory of the sdcard where the delta is applied
+REMOTE = '/sdcard/uniflasher/delta'
+# read by buffers of that size
+COPY_SIZE = 1024 * 1024
+
+class DeltaError(Exception):
+    '''the delta cannot be computed or does not give the new image'''
+
+
+def _read(mapped, offset, length):
+    return mapped[offset:offset + length] if mapped is not None else ''
+
+def _map(imgfile):
+    if not os.fstat(imgfile.fileno()).st_size:
+        return None
+    return mmap.mmap(imgfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def changed_range(task):
+    '''blocks of [first, last) which differ between base and target
+
+    task is (base, target, block, first, last), so that it can be sent to
+    another process'''
+    base, target, block, first, last = task
+    changed = []
+    with open(base, 'rb') as basefile, open(target, 'rb') as targetfile:
+        old = _map(basefile)
+        new = _map(targetfile)
+        try:
+            for start in xrange(first, last, WINDOW):
+                stop = min(start + WINDOW, last)
+                length = (stop - start) * block
+                if _read(old, start * block, length) == \
+                   _read(new, start * block, length):
+                    continue
+                for number in xrange(start, stop):
+                    if _read(old, number * block, block) != \
+                       _read(new, number * block, block):
+                        changed.append(number)
+        finally:
+            for mapped in (old, new):
+                if mapped is not None:
+                    mapped.close()
+    return changed
+
+def changed_blocks(base, target, block=BLOCK_SIZE, workers=WORKERS):
+    '''numbers of the blocks of target which differ from base, in order
+
+    blocks past the end of base are changed'''
+    size = os.path.getsize(target)
+    total = (size + block - 1) // block
+    if workers < 2 or size < PARALLEL_SIZE:
+        return changed_range((base, target, block, 0, total))
+    step = max(WINDOW, (total + workers * SLICES - 1) //
+               (workers * SLICES) // WINDOW * WINDOW)
+    tasks = [(base, target, block, first, min(first + step, total))
+             for first in xrange(0, total, step)]
+    try:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+    except (OSError, ImportError), error:
+        print >> sys.stderr, 'Comparing in a single process :', error
+        return changed_range((base, target, block, 0, total))
+    try:
+        return [number for changed in pool.map(changed_range, tasks)
+                for number in changed]
+    finally:
+        pool.terminate()
+        pool.join()
+
+def runs(blocks):
+    '''[first, count] of the runs of consecutive block numbers'''
+    found = []
+    for number in blocks:
+        if found and found[-1][0] + found[-1][1] == number:
+            found[-1][1] += 1
+        else:
+            found.append([number, 1])
+    return found
+
+def checksums(base, payload, manifest):
+    '''(SHA-256, MD5) of base with the delta applied, without writing it'''
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    block = manifest['block']
+    size = manifest['size']
+
+    def copy(source, offset, length):
+        source.seek(offset)
+        while length > 0:
+            data = source.read(min(length, COPY_SIZE))
+            if not data:
+                break
+            sha256.update(data)
+            md5.update(data)
+            length -= len(data)
+    with open(base, 'rb') as basefile, open(payload, 'rb') as blocks:
+        position = 0
+        sent = 0
+        for first, count in manifest['runs'] + [[size // block + 1, 0]]:
+            start = min(first * block, size)
+            copy(basefile, position, start - position)
+            length = min(count * block, size - start)
+            copy(blocks, sent, length)
+            sent += length
+            position = start + length
+    return sha256.hexdigest(), md5.hexdigest()
+
+def script(manifest, partition):
+    '''shell script applying the delta to the partition, in REMOTE
+
+    with "boot" as argument, it also flashes the boot.img next to it'''
+    block = manifest['block']
+    image = partition + '.img'
+    lines = ['cd %s || exit 1' % REMOTE,
+             'echo "Dumping %s..."' % partition,
+             'dump_image %s %s || { echo "error: cannot read %s"; exit 1; }'
+             % (partition, image, partition)]
+    skip = 0
+    for first, count in manifest['runs']:
+        lines.append('dd if=%s of=%s bs=%d skip=%d seek=%d count=%d '
+                     'conv=notrunc 2>/dev/null || exit 1'
+                     % (PAYLOAD, image, block, skip, first, count))
+        skip += count
+    # the new image may be shorter or longer than the base
+    lines += ['dd if=/dev/null of=%s bs=1 seek=%d 2>/dev/null'
+              % (image, manifest['size']),
+              'echo "Verifying %s"' % image,
+              'echo "%s  %s" | md5sum -c || exit 1' % (manifest['md5'],
+                                                      image),
+              'echo "Flashing %s..."' % partition,
+              'flash_image %s %s || { echo "error: cannot write %s"; '
+              'exit 1; }' % (partition, image, partition),
+              'if [ "$1" = boot ]; then',
+              '    echo "Flashing boot..."',
+              '    flash_image boot boot.img || '
+              '{ echo "error: cannot write boot"; exit 1; }',
+              'fi',
+              'rm -f %s %s boot.img' % (image, PAYLOAD),
+              'echo "Delta applied"']
+    return '\n'.join(lines) + '\n'
+
+def build(base, target, directory, block=BLOCK_SIZE, sha256=None,
+          partition='system'):
+    '''write the delta from base to target in directory, return the paths
+    of its payload, manifest and script
+
+    the delta is checked against sha256, the SHA-256 of target'''
+    blocks = changed_blocks(base, target, block)
+    size = os.path.getsize(target)
+    payload = os.path.join(directory, PAYLOAD)
+    found = runs(blocks)
+    with open(target, 'rb') as source, open(payload, 'wb') as out:
+        for first, count in found:
+            source.seek(first * block)
+            length = min(count * block, size - first * block)
+            while length > 0:
+                data = source.read(min(length, COPY_SIZE))
+                out.write(data)
+                length -= len(data)
+    manifest = {'block': block, 'size': size,
+                'base_size': os.path.getsize(base), 'runs': found,
+                'changed': len(blocks)}
+    applied, manifest['md5'] = checksums(base, payload, manifest)
+    if sha256 and applied != sha256:
+        raise DeltaError('the delta does not give back %s' % target)
+    manifest['sha256'] = applied
+    path = os.path.join(directory, MANIFEST)
+    config.save_json(path, manifest)
+    commands = os.path.join(directory, SCRIPT)
+    with open(commands, 'w') as out:
+        out.write(script(manifest, partition))
+    return [payload, path, commands]
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print >> sys.stderr, 'usage: delta.py base.img new.img outdir'
+        sys.exit(2)
+    if not os.path.isdir(sys.argv[3]):
+        os.makedirs(sys.argv[3])
+    for written in build(*sys.argv[1:]):
+        print written
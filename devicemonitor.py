@@ -0,0 +1,200 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Background watcher of the phones connected to the computer
+
+The adb side is pushed by the adb server through host:track-devices, the
+fastboot side is a cheap enumeration of the USB devices in sysfs (or of
+"fastboot devices" where there is no sysfs), plus a handshake with the
+fastboot devices on the network it is told about (tcp:HOST:PORT).
+Subscribers are told about every change, e.g. "serial X is now in
+recovery", and workflows can wait for a state, returning the moment the
+phone shows up.
+'''
+
+import os
+import sys
+import time
+import socket
+import threading
+
+import adbclient
+import fastbootproto
+import fleet
+from runner import runner, monotonic
+
+SYSFS = '/sys/bus/usb/devices'
+
+def _read_sysfs(path):
+    try:
+        with open(path) as sysfile:
+            return sysfile.read().strip()
+    except (IOError, OSError):
+        return None
+
+def sysfs_fastboot_serials(sysfs=SYSFS):
+    '''serials of the USB devices exposing a fastboot interface
+
+    return None if there is no sysfs to look at'''
+    if not os.path.isdir(sysfs):
+        return None
+    serials = []
+    for name in os.listdir(sysfs):
+        if ':' not in name:
+            continue
+        interface = os.path.join(sysfs, name)
+        # vendor specific class, subclass 0x42, protocol 3: fastboot
+        if (_read_sysfs(os.path.join(interface, 'bInterfaceClass')),
+            _read_sysfs(os.path.join(interface, 'bInterfaceSubClass')),
+            _read_sysfs(os.path.join(interface, 'bInterfaceProtocol'))) != \
+           ('ff', '42', '03'):
+            continue
+        device = os.path.join(sysfs, name.split(':')[0])
+        serials.append(_read_sysfs(os.path.join(device, 'serial')) or '?')
+    return serials
+
+
+class DeviceMonitor(object):
+    '''keep track of the state of every connected phone
+
+    states are the adb ones (device, recovery, offline...) plus fastboot'''
+
+    def __init__(self, client, fastboot=None, poll=0.5, sysfs=SYSFS,
+                 network=()):
+        self.client = client
+        self.fastboot = fastboot
+        self.poll = poll
+        self.sysfs = sysfs
+        # tcp: serials of fastboot devices on the network
+        self.network = list(network)
+        self._sources = {'adb': {}, 'fastboot': {}}
+        self._states = {}
+        self._subscribers = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._tracking = None
+
+    def subscribe(self, callback):
+        '''call callback(serial, state, previous) at each change
+
+        state is None when the device is gone; callbacks are called from
+        the monitor threads'''
+        self._subscribers.append(callback)
+
+    def devices(self):
+        '''dictionary serial -> state of the connected devices'''
+        with self._condition:
+            return dict(self._states)
+
+    def start(self):
+        '''read the current states, then watch them in the background'''
+        self._running = True
+        try:
+            self._update('adb', dict(self.client.devices()))
+        except adbclient.AdbError, error:
+            print >> sys.stderr, 'Error :', error
+        self._update('fastboot', self._fastboot_devices())
+        for target in (self._track_adb, self._poll_fastboot):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        '''stop watching'''
+        self._running = False
+        if self._tracking:
+            try:
+                # wakes up the blocked reader
+                self._tracking.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def wait_for(self, state, serial=None, timeout=None):
+        '''wait until a device (or the given one) reaches a state
+
+        return the serial of the device or None after the timeout'''
+        deadline = timeout is not None and monotonic() + timeout
+        with self._condition:
+            while True:
+                for device, current in self._states.items():
+                    if current == state and serial in (None, device):
+                        return device
+                if deadline is False:
+                    remaining = 1
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                self._condition.wait(remaining)
+
+    def _update(self, source, states):
+        with self._condition:
+            self._sources[source] = states
+            if source == 'adb':
+                # a phone adb sees has left fastboot mode: the fastboot
+                # poll before must not bring it back when adb loses it
+                self._sources['fastboot'] = dict(
+                    (serial, state) for serial, state
+                    in self._sources['fastboot'].items()
+                    if serial not in states)
+            previous = self._states
+            # adb tells at once, fastboot only at the next poll: a phone
+            # which left fastboot mode for adb is no longer in fastboot
+            self._states = dict(self._sources['fastboot'])
+            self._states.update(self._sources['adb'])
+            changes = [(serial, self._states.get(serial),
+                        previous.get(serial))
+                       for serial in set(previous) | set(self._states)
+                       if self._states.get(serial) != previous.get(serial)]
+            if changes:
+                self._condition.notify_all()
+        for serial, state, before in changes:
+            print >> sys.stderr, 'Device', serial, ':', before, '->', state
+            for callback in self._subscribers:
+                try:
+                    callback(serial, state, before)
+                except Exception, error:
+                    print >> sys.stderr, 'Error in device subscriber :', error
+
+    def _track_adb(self):
+        while self._running:
+            try:
+                self._tracking = self.client.track_devices()
+                try:
+                    while self._running:
+                        self._update('adb', dict(adbclient.read_devices(
+                            self._tracking)))
+                finally:
+                    self._tracking.close()
+            except adbclient.AdbError, error:
+                if not self._running:
+                    return
+                print >> sys.stderr, 'Error :', error
+                self._update('adb', {})
+                time.sleep(1)
+
+    def _fastboot_devices(self):
+        serials = sysfs_fastboot_serials(self.sysfs)
+        if serials is None and self.fastboot:
+            try:
+                command = runner.run([self.fastboot, 'devices'], timeout=5)
+                serials = fleet.fastboot_serials(command.output)
+            except OSError, error:
+                print >> sys.stderr, 'Error :', error.strerror
+        serials = list(serials or [])
+        serials += [serial for serial in self.network
+                    if fastbootproto.probe(serial)]
+        return dict((serial, 'fastboot') for serial in serials)
+
+    def _poll_fastboot(self):
+        # fastboot has no server to push changes, enumeration is cheap
+        # with sysfs, otherwise this spawns fastboot at each poll
+        poll = self.poll
+        if not os.path.isdir(self.sysfs):
+            poll = max(poll, 1)
+        while self._running:
+            time.sleep(poll)
+            self._update('fastboot', self._fastboot_devices())
@@ -0,0 +1,422 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Built-in client of the fastboot protocol
+
+Commands are strings such as getvar:max-download-size, download:0001b800
+or flash:boot, answered by INFO lines then OKAY, FAIL or, for download,
+DATA followed by the size the bootloader expects.  The transport is
+pluggable: TCP is supported, as used by "fastboot -s tcp:HOST:PORT",
+where a FB01 handshake starts the session and every message is prefixed
+by its 8 bytes length.  Images are sent straight from the file with
+sendfile() where there is one (Python 3, or pysendfile on Python 2),
+otherwise from mmap buffers, without being copied into Python strings.
+
+A Session runs a fastboot command line (-w, erase, flash, boot, getvar,
+reboot...) for a tcp: serial in a thread and prints what the fastboot
+program would, with the interface of runner.Command: do_and_log uses it
+in place of the program for these devices, without a process spawn.
+'''
+
+import os
+import sys
+import mmap
+import errno
+import select
+import socket
+import struct
+import threading
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+from runner import monotonic
+
+PORT = 5554
+HANDSHAKE = 'FB01'
+# bytes of image data per transport message
+PACKET = 1024 * 1024
+# largest answer of the bootloader
+RESPONSE = 256
+
+class FastbootError(Exception):
+    '''the bootloader failed or could not be reached'''
+
+
+def is_network(serial):
+    '''is the serial the address of a fastboot device on the network'''
+    return bool(serial) and serial.startswith('tcp:')
+
+def address(serial):
+    '''(host, port) of a tcp:HOST[:PORT] serial'''
+    host, _, port = serial[len('tcp:'):].partition(':')
+    return host, port and int(port) or PORT
+
+def handles(args):
+    '''is the fastboot command line for a device on the network'''
+    return os.path.basename(args[0]).startswith('fastboot') and \
+            args[1:2] == ['-s'] and len(args) > 2 and is_network(args[2])
+
+
+class TcpTransport(object):
+    '''messages prefixed by their length, after the FB01 handshake'''
+
+    def __init__(self, host, port=PORT, timeout=10):
+        try:
+            self.sock = socket.create_connection((host, port), timeout)
+        except socket.error, error:
+            raise FastbootError('cannot reach %s:%d: %s' % (host, port, error))
+        try:
+            self.sock.sendall(HANDSHAKE)
+            reply = self._recv(4)
+        except (socket.error, FastbootError), error:
+            self.close()
+            raise FastbootError('no fastboot handshake: %s' % (error,))
+        if not reply.startswith('FB') or not reply[2:].isdigit() or \
+           int(reply[2:]) < 1:
+            self.close()
+            raise FastbootError('unknown fastboot handshake %r' % reply)
+
+    def send(self, data):
+        '''send a message'''
+        self.sock.sendall(struct.pack('>Q', len(data)) + data)
+
+    def send_file(self, imgfile, size, report=None):
+        '''send size bytes of a file, from its current position, as
+        messages of at most PACKET bytes, without copying them
+
+        report(sent) is called after each message'''
+        start = imgfile.tell()
+        mapped = None
+        if sendfile is None and size:
+            mapped = mmap.mmap(imgfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, size, PACKET):
+                length = min(PACKET, size - offset)
+                self.sock.sendall(struct.pack('>Q', length))
+                if mapped is None:
+                    self._sendfile(imgfile, start + offset, length)
+                else:
+                    self.sock.sendall(buffer(mapped, start + offset, length))
+                if report:
+                    report(offset + length)
+        finally:
+            if mapped is not None:
+                mapped.close()
+
+    def _sendfile(self, imgfile, offset, length):
+        end = offset + length
+        while offset < end:
+            try:
+                sent = sendfile(self.sock.fileno(), imgfile.fileno(), offset,
+                                end - offset)
+            except (OSError, IOError), error:
+                # sockets with a timeout are non blocking underneath
+                if error.errno != errno.EAGAIN:
+                    raise
+                if not select.select([], [self.sock], [],
+                                     self.sock.gettimeout())[1]:
+                    raise socket.timeout('timed out')
+                continue
+            if not sent:
+                raise FastbootError('connection closed by the bootloader')
+            offset += sent
+
+    def recv(self):
+        '''next message'''
+        length, = struct.unpack('>Q', self._recv(8))
+        return self._recv(length)
+
+    def _recv(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise FastbootError('connection closed by the bootloader')
+            data += chunk
+        return data
+
+    def close(self):
+        '''end the session, also interrupting a blocked send or receive'''
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class FastbootClient(object):
+    '''fastboot commands through a transport
+
+    info(message) is called with the INFO messages of the bootloader'''
+
+    def __init__(self, transport, info=None):
+        self.transport = transport
+        self.info = info
+
+    def command(self, command):
+        '''send a command, return the OKAY message or the DATA size'''
+        self.transport.send(command)
+        return self.response()
+
+    def response(self):
+        '''wait for the final answer to a command'''
+        while True:
+            reply = self.transport.recv()[:RESPONSE]
+            status, message = reply[:4], reply[4:]
+            if status in ('INFO', 'TEXT'):
+                if self.info:
+                    self.info(message)
+            elif status == 'OKAY':
+                return message
+            elif status == 'DATA':
+                return int(message, 16)
+            elif status == 'FAIL':
+                raise FastbootError('remote: ' + message)
+            else:
+                raise FastbootError('unknown answer %r' % reply)
+
+    def getvar(self, name):
+        '''value of a variable of the bootloader'''
+        return self.command('getvar:' + name)
+
+    def download(self, path, report=None):
+        '''send a file to the bootloader, for flash or boot'''
+        size = os.path.getsize(path)
+        if size > 0xffffffff:
+            raise FastbootError('%s is too large to be sent' % path)
+        expected = self.command('download:%08x' % size)
+        if expected != size:
+            raise FastbootError('the bootloader expects %d bytes instead of %d'
+                                % (expected, size))
+        with open(path, 'rb') as imgfile:
+            self.transport.send_file(imgfile, size, report)
+        return self.response()
+
+    def flash(self, partition):
+        '''write the downloaded file to a partition'''
+        return self.command('flash:' + partition)
+
+    def erase(self, partition):
+        '''erase a partition'''
+        return self.command('erase:' + partition)
+
+    def boot(self):
+        '''boot the downloaded file'''
+        return self.command('boot')
+
+    def reboot(self, bootloader=False):
+        '''restart the phone, in fastboot mode again if bootloader'''
+        return self.command(bootloader and 'reboot-bootloader' or 'reboot')
+
+    def close(self):
+        '''end the session'''
+        self.transport.close()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def probe(serial, timeout=0.5):
+    '''is the device of a tcp: serial in fastboot mode
+
+    a device running a session is, without disturbing it'''
+    with _sessions_lock:
+        if _sessions.get(serial):
+            return True
+    try:
+        TcpTransport(*address(serial), timeout=timeout).close()
+        return True
+    except FastbootError:
+        return False
+
+
+class Session(object):
+    '''a fastboot command line run by the built-in client, in a thread
+
+    with the interface of runner.Command: subscribers get each line of
+    output, then None once it is over'''
+
+    def __init__(self, args, timeout=None, subscribers=()):
+        self.args = args
+        self.serial = args[2]
+        self.words = args[3:]
+        self.timeout = timeout
+        self.returncode = None
+        self.timedout = False
+        self.started = monotonic()
+        self.finished = None
+        self._lines = []
+        self._partial = ''
+        self._subscribers = list(subscribers)
+        self._client = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._failed = False
+        self._done = threading.Event()
+        self._timer = None
+        if timeout:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def subscribe(self, callback):
+        '''call callback(line) for each line to come'''
+        self._subscribers.append(callback)
+
+    @property
+    def output(self):
+        '''everything printed so far'''
+        with self._lock:
+            return ''.join(line + '\n' for line in self._lines) + \
+                    self._partial
+
+    @property
+    def elapsed(self):
+        '''running time of the command, in seconds'''
+        return (self.finished or monotonic()) - self.started
+
+    def done(self):
+        '''has the command finished'''
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''wait for the end of the command and return its exit code'''
+        # set by the thread of the session as it ends
+        if timeout is None:
+            # Event.wait() without timeout cannot be interrupted
+            while not self._done.wait(1):
+                pass
+        else:
+            self._done.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        '''stop the command, closing its connection'''
+        with self._lock:
+            self._stopped = True
+            client = self._client
+        if client:
+            client.close()
+
+    def _expire(self):
+        self.timedout = True
+        print >> sys.stderr, 'Timeout after', self.timeout, 's :', \
+                ' '.join(self.args)
+        self.terminate()
+
+    def _print(self, text, end=True):
+        '''print as fastboot does: the phase, then its result on the same
+        line, which subscribers get as soon as the phase starts'''
+        with self._lock:
+            self._partial += text
+            line = self._partial
+            if end:
+                self._lines.append(line)
+                self._partial = ''
+        self._notify(text)
+
+    def _notify(self, line):
+        for callback in self._subscribers:
+            try:
+                callback(line)
+            except Exception, error:
+                print >> sys.stderr, 'Error in output subscriber :', error
+
+    def _phase(self, label, action):
+        '''run a step, printing its label, then OKAY or FAILED'''
+        self._print(label.rjust(30) + '... ', False)
+        started = monotonic()
+        try:
+            result = action()
+        except (FastbootError, socket.error, IOError, OSError), error:
+            self._failed = True
+            self._print('FAILED (%s)' % (error,))
+            raise
+        self._print('OKAY [%7.3fs]' % (monotonic() - started))
+        return result
+
+    def _run(self):
+        returncode = 1
+        with _sessions_lock:
+            _sessions[self.serial] = _sessions.get(self.serial, 0) + 1
+        try:
+            transport = TcpTransport(*address(self.serial))
+            client = FastbootClient(transport, lambda message:
+                                    self._print('(bootloader) ' + message))
+            with self._lock:
+                self._client = client
+                stopped = self._stopped
+            if stopped:
+                client.close()
+            try:
+                returncode = self._command(client)
+            finally:
+                client.close()
+            self._print('finished. total time: %.3fs' % self.elapsed)
+        except (FastbootError, socket.error, IOError, OSError), error:
+            if self._stopped:
+                returncode = -15
+            elif not self._failed:
+                self._print('error: %s' % (error,))
+        finally:
+            with _sessions_lock:
+                _sessions[self.serial] -= 1
+            if self._timer:
+                self._timer.cancel()
+            self.returncode = returncode
+            self.finished = monotonic()
+            self._done.set()
+            self._notify(None)
+
+    def _command(self, client):
+        '''run the words of the command line, return the exit code'''
+        words = self.words
+        if words == ['-w']:
+            for partition in ('userdata', 'cache'):
+                self._phase("erasing '%s'" % partition,
+                            lambda: client.erase(partition))
+        elif words[:1] == ['erase'] and len(words) == 2:
+            self._phase("erasing '%s'" % words[1],
+                        lambda: client.erase(words[1]))
+        elif words[:1] == ['flash'] and len(words) == 3:
+            partition, path = words[1:]
+            self._phase("sending '%s' (%d KB)" % (partition,
+                                                  os.path.getsize(path) //
+                                                  1024),
+                        lambda: client.download(path))
+            self._phase("writing '%s'" % partition,
+                        lambda: client.flash(partition))
+        elif words[:1] == ['boot'] and len(words) == 2:
+            self._phase("downloading 'boot.img'",
+                        lambda: client.download(words[1]))
+            self._phase('booting', client.boot)
+        elif words[:1] == ['getvar'] and len(words) == 2:
+            try:
+                value = client.getvar(words[1])
+            except FastbootError, error:
+                self._failed = True
+                self._print('getvar:%s FAILED (%s)' % (words[1], error))
+                raise
+            self._print('%s: %s' % (words[1], value))
+        elif words in (['reboot'], ['reboot-bootloader']):
+            self._phase('rebooting', lambda: client.reboot(
+                words == ['reboot-bootloader']))
+        else:
+            self._print('usage: fastboot [ <option> ] <command>')
+            return 1
+        return 0
+
+def start(args, timeout=None, subscribers=()):
+    '''run a fastboot command line for a tcp: serial, like runner.start'''
+    return Session(args, timeout, subscribers)
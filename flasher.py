@@ -0,0 +1,860 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Flashing operations, independent of any user interface
+
+The Flasher talks to the user through a small interface (notify, wait,
+progress): the main window implements it with dialogs, TextUI with
+messages on the terminal for the command line and batch jobs.  Nothing
+here imports wx.
+'''
+
+import os
+import sys
+import Queue
+import posixpath
+
+import adbclient
+import backupstore
+import config
+import dashboard
+import delta
+import devicemonitor
+import fastbootproto
+import fleet
+import images
+import logcat
+import outparse
+import partitions
+import progress
+import sparse
+import tracing
+import transfer
+import usbtopo
+import workflow
+from runner import runner, monotonic
+
+class TextProgress(object):
+    '''progress of a command, shown on the terminal'''
+
+    def __init__(self, title, message, maximum):
+        self.maximum = maximum
+        self.shown = None
+
+    def update(self, value, message):
+        '''show progress, return False to cancel the command'''
+        # every tenth, not at each refresh
+        step = value * 10 // self.maximum
+        if step != self.shown:
+            self.shown = step
+            print >> sys.stderr, '  %3d%% %s' % (value * 100 // self.maximum,
+                                                 message)
+        return True
+
+    def destroy(self):
+        '''progress is over'''
+
+
+class TextUI(object):
+    '''talk to the user through the terminal, never asking anything'''
+
+    def notify(self, message, title, warning=False):
+        '''tell something to the user'''
+        print >> sys.stderr, (warning and 'Warning: ' or '') + title + ':', \
+                message
+
+    def wait(self, title, message, poll):
+        '''call poll() until it returns something else than None
+
+        message may be a function giving the current message'''
+        result = poll()
+        if result is not None:
+            return result
+        last = None
+        while result is None:
+            current = message() if callable(message) else message
+            if current != last:
+                print >> sys.stderr, title + ':', current
+                last = current
+            result = poll()
+        return result
+
+# builds the display of do_and_log progress, replaced by the main window
+progress_display = TextProgress
+# seconds between two updates of the progress display
+REFRESH = 0.25
+
+
+class Flasher(object):
+    '''operations on a phone, or on every phone for fleet updates
+
+    with a serial, adb and fastboot commands target that device only'''
+
+    def __init__(self, ui=None, serial=None, parent=None):
+        self.ui = ui or TextUI()
+        self.serial = serial
+        # directory of the last nandroid backup made on the sdcard
+        self.backup_path = None
+        if parent is not None:
+            for name in ('osname', 'curpath', 'adb', 'fastboot',
+                         'recoveryimg', 'adbclient', 'monitor', 'images',
+                         'backups', 'bootimg', 'systemimg', 'gapps'):
+                setattr(self, name, getattr(parent, name))
+            return
+
+        if os.name == 'nt':
+            self.osname = 'Windows'
+            sdkpath = 'android-sdk-windows'
+        else:
+            # Linux on linux boxes Darwin on MacOS
+            self.osname = os.uname()[0]
+            sdkpath = 'android-sdk-' \
+                    + {'Darwin': 'mac', 'Linux': 'linux'}[self.osname] \
+                    + '_x86'
+
+        if __file__:
+            self.curpath = os.path.dirname(os.path.realpath(
+                os.path.abspath(__file__)))
+        else:
+            self.curpath = os.getcwd()
+
+        sdkpath = os.path.join(self.curpath, sdkpath)
+        self.adb = os.path.join(sdkpath, 'adb')
+        self.fastboot = os.path.join(sdkpath, 'fastboot')
+        self.recoveryimg = os.path.join(self.curpath, 'imgs',
+                                        'everarecovery.img')
+        self.adbclient = adbclient.AdbClient(adb=self.adb)
+        self.monitor = devicemonitor.DeviceMonitor(self.adbclient,
+                                                   self.fastboot)
+        self.images = images.ImageRegistry()
+        self.backups = backupstore.BackupStore()
+
+        self.bootimg = ''
+        self.systemimg = ''
+        self.gapps = ''
+
+    def for_device(self, serial):
+        '''a Flasher for one device, sharing this one's state'''
+        return Flasher(self.ui, serial, self)
+
+    def start(self):
+        '''start watching devices'''
+        self.monitor.start()
+
+    def stop(self):
+        '''stop watching devices and trim the staging cache'''
+        self.monitor.stop()
+        self.images.cleanup()
+
+    def adbcmd(self, *args):
+        '''adb command line for the device'''
+        if self.serial:
+            return [self.adb, '-s', self.serial] + list(args)
+        return [self.adb] + list(args)
+
+    def fastbootcmd(self, *args):
+        '''fastboot command line for the device'''
+        if self.serial:
+            return [self.fastboot, '-s', self.serial] + list(args)
+        return [self.fastboot] + list(args)
+
+    def check_image(self, partition, imgfile):
+        '''wait for the background check of an image
+
+        return the path of the uncompressed image to flash, warn and return
+        '' if it cannot be flashed'''
+        try:
+            name = os.path.split(imgfile)[1]
+            print >> sys.stderr, self.wait_task(
+                self.images.submit(imgfile, partition),
+                'Checking ' + partition + ' image', name).result()
+            return self.wait_task(
+                images.Task(self.images.prepare, imgfile, partition),
+                'Decompressing ' + partition + ' image', name).result()
+        except images.ImageError, error:
+            self.ui.notify(imgfile + ' cannot be flashed as ' + partition +
+                           ':\n' + str(error),
+                           'Invalid ' + partition + '.img', True)
+            return ''
+
+    def check_images(self):
+        '''check the boot and system images selected, before the phone is
+        touched; a missing one is reported when it is flashed'''
+        return all(not imgfile or self.check_image(partition, imgfile)
+                   for partition, imgfile in (('boot', self.bootimg),
+                                              ('system', self.systemimg)))
+
+    def wait_task(self, task, title, message):
+        '''let the user know a background task is running'''
+        self.ui.wait(title, message, lambda: task.wait(0.1) or None)
+        return task
+
+    def devices(self):
+        '''check if some device is connected and found by adb'''
+        # If adb doesn't find the device on a mac ->
+        # http://www.zacpod.com/p/157
+        # /System/Library/Extensions/IOUSBFamily.kext/Contents/PlugIns/IOUSBCompositeDriver.kext/Contents/
+        if 'recovery' in self.device_states():
+            print >> sys.stderr, "The device is in recovery mode"
+            found = True
+        else:
+            print >> sys.stderr, "No device in recovery mode"
+            found = False
+        return found
+
+    def device_states(self):
+        '''states of the connected devices (of the device, with a serial)'''
+        states = self.monitor.devices()
+        if self.serial:
+            return [state for serial, state in states.items()
+                    if serial == self.serial]
+        return states.values()
+
+    def serials(self, state):
+        '''serials of the devices in the given state'''
+        return sorted(serial for serial, current
+                      in self.monitor.devices().items()
+                      if current == state)
+
+    def fbdevices(self):
+        '''check if some device is connected and found by fastboot'''
+        if 'fastboot' in self.device_states():
+            print >> sys.stderr, "The device is in fastboot mode"
+            found = True
+        else:
+            print >> sys.stderr, "No device in fastboot"
+            found = False
+        return found
+
+    @tracing.traced('wipe')
+    def wipe(self):
+        '''wipe device'''
+        if self.fbdevices():
+            return print_and_log(self.fastbootcmd('-w'),
+                                 progress=progress.Progress('wipe'))
+        else:
+            self.ui.notify('You must connect your phone in fastboot mode' +
+                           ' first', 'No device in fastboot', True)
+            return False
+
+    @tracing.traced('reboot')
+    def reboot(self):
+        '''reboot device'''
+        return print_and_log(self.adbcmd('shell', 'reboot')) or \
+                print_and_log(self.adbcmd('reboot'))
+
+    @tracing.traced('flash')
+    def flash(self, partition, imgfile):
+        '''flash some image to the given partition on device'''
+        if not imgfile:
+            self.ui.notify('You need to select a ' + partition +
+                           ' image first',
+                           'Missing '+ partition +'.img', True)
+            return False
+        imgpath = self.check_image(partition, imgfile)
+        if not imgpath:
+            return False
+        if self.fbdevices():
+            parts = self.sparse_images(partition, imgfile, imgpath)
+            if not parts:
+                self.ui.notify('Nothing to flash from ' + imgfile,
+                               'Cannot flash ' + partition, True)
+                return False
+            ok = False
+            for part in parts:
+                ok = print_and_log(self.fastbootcmd('flash', partition, part),
+                                   progress=progress.Progress(
+                                       'flash ' + partition,
+                                       os.path.getsize(part)))
+                if not ok:
+                    break
+            return ok
+        else:
+            self.ui.notify('You must put your phone in fastboot mode' +
+                           ' first', 'No device in fastboot', True)
+            return False
+
+    def sparse_images(self, partition, imgfile, imgpath):
+        '''images to flash in place of imgfile, uncompressed in imgpath
+
+        ext4 images are converted to sparse images within the download
+        limit of bootloaders that report one, once for every phone, in the
+        staging cache.  Return the list of files'''
+        if self.images.submit(imgfile, partition).result().format != 'ext4':
+            return [imgpath]
+        maxsize = sparse.max_download_size(do_and_log(self.fastbootcmd(
+            'getvar', 'max-download-size')))
+        if not maxsize:
+            # older bootloaders only take raw images
+            return [imgpath]
+        try:
+            return self.images.sparse(imgfile, partition, maxsize)
+        except (images.ImageError, sparse.SparseError, IOError,
+                OSError), error:
+            print >> sys.stderr, 'Cannot convert to a sparse image :', error
+            return [imgpath]
+
+    @tracing.traced('recovery')
+    def recovery(self):
+        '''fastboot boot everarecovery.img'''
+        if fastbootproto.is_network(self.device_serial()):
+            # adb knows the recovery by its USB serial, not by tcp:HOST,
+            # so it could never be told from another phone's
+            self.ui.notify('Phones on the network can be flashed, but ' +
+                           'their recovery cannot be reached',
+                           'No recovery over the network', True)
+            return False
+        if self.fbdevices():
+            ok = print_and_log(self.fastbootcmd('boot', self.recoveryimg),
+                               progress=progress.Progress(
+                                   'boot', os.path.getsize(self.recoveryimg)))
+            if not ok:
+                return False
+            # since wait-for-device won't work in recovery
+            # wait for the device monitor to see it
+            return self.wait_state('recovery', 10)
+        else:
+            self.ui.notify('You must connect your phone in fastboot mode' +
+                           ' first', 'No device in fastboot', True)
+            return False
+
+    def wait_state(self, state, timeout):
+        '''wait for the device to reach a state, return its serial'''
+        deadline = monotonic() + timeout
+        serial = self.ui.wait('Waiting for device',
+                              'Device is not in ' + state + ' mode yet...',
+                              lambda: self.monitor.wait_for(state,
+                                                            self.serial,
+                                                            timeout=0.1) or
+                              (None if monotonic() < deadline else ''))
+        return serial or None
+
+    def device_serial(self):
+        '''serial of the device, or of the only one connected, None if
+        unknown'''
+        if self.serial:
+            return self.serial
+        serials = [serial for serial in self.monitor.devices()
+                   if serial != '?']
+        return len(serials) == 1 and serials[0] or None
+
+    def run_workflow(self, steps, *paths):
+        '''run a workflow on the device, resuming it after its last
+        completed step if it failed with the same files'''
+        return workflow.run(steps, self, self.device_serial(),
+                            workflow.fingerprint(*paths)) is None
+
+    @tracing.traced('update with wipe')
+    def flash_openetna(self):
+        '''very basic OpenEtna flash, adapted from OpenEtnaflash.bat'''
+        if not self.check_images():
+            return False
+        return self.run_workflow(UPDATE_WITH_WIPE, self.bootimg,
+                                 self.systemimg) and self.updated()
+
+    @tracing.traced('update without wipe')
+    def flash_openetna_wo_wipe(self):
+        '''very basic OpenEtna flash without wipe'''
+        if not self.check_images():
+            return False
+        return self.run_workflow(UPDATE, self.bootimg, self.systemimg) and \
+                self.updated()
+
+    def updated(self):
+        '''tell the user how to start the updated phone'''
+        self.ui.notify('You can now manually switch off your phone ' +
+                       'and restart it. This can take a long time ' +
+                       '(up to 10 minutes).', 'Reboot')
+        return True
+
+    @tracing.traced('update changed partitions')
+    def flash_changed(self):
+        '''update without wipe, skipping partitions already up to date
+
+        the phone is started in recovery to read back its partitions, then
+        put back in fastboot mode to flash the ones that differ'''
+        if not self.bootimg or not self.systemimg or \
+           not self.check_image('boot', self.bootimg) or \
+           not self.check_image('system', self.systemimg):
+            return False
+        serial = self.recovery()
+        if not serial:
+            return False
+        reader = partitions.PartitionReader(self.adbclient, serial)
+        changed = self.wait_task(
+            images.Task(lambda: [(partition, imgfile) for partition, imgfile
+                                 in (('boot', self.bootimg),
+                                     ('system', self.systemimg))
+                                 if reader.changed(partition, self.images,
+                                                   imgfile)]),
+            'Comparing partitions', 'Reading the partitions of ' +
+            serial).result()
+        if not changed:
+            print_and_log([self.adb, '-s', serial, 'reboot'])
+            self.ui.notify('The phone already has these images, ' +
+                           'it is now restarting.', 'Nothing to update')
+            return True
+        return self.flash_from_recovery(serial, changed)
+
+    def flash_from_recovery(self, serial, changed):
+        '''put the phone running the recovery back in fastboot mode and
+        flash the (partition, image) pairs'''
+        print >> sys.stderr, 'To update:', ', '.join(partition for partition,
+                                                     imgfile in changed)
+        print_and_log([self.adb, '-s', serial, 'reboot', 'bootloader'])
+        if not self.wait_state('fastboot', 60):
+            self.ui.notify('Put your phone in fastboot mode', 'Fastboot mode')
+            if not self.wait_state('fastboot', 60):
+                return False
+        for partition, imgfile in changed:
+            if not self.flash(partition, imgfile):
+                return False
+        return self.updated()
+
+    @tracing.traced('update from a base build')
+    def flash_delta(self, basefile):
+        '''update without wipe sending only the blocks of system which
+        differ from basefile, the system image the phone runs
+
+        the phone is started in recovery to read back its partitions; the
+        delta is pushed to the sdcard and applied there, see delta.  When
+        the phone does not run the base build or the delta does not give
+        the new image, the whole images are flashed instead'''
+        if not basefile or not self.bootimg or not self.systemimg or \
+           not self.check_image('boot', self.bootimg) or \
+           not self.check_image('system', self.systemimg) or \
+           not self.check_image('system', basefile):
+            return False
+        if 'yaffs2' in (self.images.submit(imgfile, 'system').result().format
+                        for imgfile in (self.systemimg, basefile)):
+            # the recovery cannot rebuild their out of band data
+            print >> sys.stderr, 'No delta of yaffs2 images, flashing the ' \
+                    'partitions which changed'
+            return self.flash_changed()
+        # computed while the phone boots the recovery
+        work = images.Task(self.images.delta, basefile, self.systemimg,
+                           'system')
+        serial = self.recovery()
+        if not serial:
+            return False
+        reader = partitions.PartitionReader(self.adbclient, serial)
+        boot, system = self.wait_task(
+            images.Task(lambda: (reader.changed('boot', self.images,
+                                                self.bootimg),
+                                 reader.holds('system', self.images,
+                                              [self.systemimg, basefile]))),
+            'Comparing partitions', 'Reading the partitions of ' +
+            serial).result()
+        changed = boot and [('boot', self.bootimg)] or []
+        if system == self.systemimg and not changed:
+            print_and_log([self.adb, '-s', serial, 'reboot'])
+            self.ui.notify('The phone already has these images, ' +
+                           'it is now restarting.', 'Nothing to update')
+            return True
+        if system != basefile:
+            if system is None:
+                print >> sys.stderr, serial, 'does not run the base build'
+                changed.append(('system', self.systemimg))
+            return self.flash_from_recovery(serial, changed)
+        if self.apply_delta(serial, work, boot) and \
+           not reader.changed('system', self.images, self.systemimg) and \
+           not (boot and reader.changed('boot', self.images, self.bootimg)):
+            print_and_log([self.adb, '-s', serial, 'reboot'])
+            self.ui.notify('Only the blocks of system which changed were ' +
+                           'sent, the phone is now restarting.', 'Updated')
+            return True
+        print >> sys.stderr, 'The delta was not applied, flashing the images'
+        return self.flash_from_recovery(serial, changed +
+                                        [('system', self.systemimg)])
+
+    def apply_delta(self, serial, work, boot=False):
+        '''push the delta computed by work to the phone running the
+        recovery and apply it, also flashing boot if asked'''
+        status = ['Copying the delta to ' + serial]
+        report = push_report(serial, status, 'copying the delta')
+
+        def push():
+            payload, manifest, script = work.result()
+            files = [(payload, delta.PAYLOAD), (script, delta.SCRIPT)]
+            if boot:
+                files.append((self.images.prepare(self.bootimg, 'boot'),
+                              'boot.img'))
+            self.adbclient.shell(serial, 'mkdir -p ' + delta.REMOTE)
+            for local, name in files:
+                transfer.push(self.adbclient, serial, local,
+                              posixpath.join(delta.REMOTE, name), report)
+            return config.load_json(manifest)
+        try:
+            manifest = self.wait_task(images.Task(push), 'Copying the delta',
+                                      lambda: status[0]).result()
+        except images.ImageError, error:
+            print >> sys.stderr, 'Delta not copied :', error
+            return False
+        print >> sys.stderr, '%d blocks of %d bytes changed' % (
+            manifest['changed'], manifest['block'])
+        return bool(print_and_log(
+            [self.adb, '-s', serial, 'shell', 'sh',
+             posixpath.join(delta.REMOTE, delta.SCRIPT)] +
+            (boot and ['boot'] or []),
+            progress=progress.Progress('delta', manifest['size'])))
+
+    @tracing.traced('fleet update')
+    def flash_fleet(self, wipe=True, serials=None):
+        '''OpenEtna update of every phone in fastboot mode, in parallel'''
+        bootpath = self.check_image('boot', self.bootimg)
+        systempath = bootpath and self.check_image('system', self.systemimg)
+        if not systempath:
+            return False
+        if serials is None:
+            serials = self.serials('fastboot')
+        if '?' in serials:
+            print >> sys.stderr, 'Ignoring phones without a serial number'
+            serials = [serial for serial in serials if serial != '?']
+        if not serials:
+            self.ui.notify('You must connect your phones in fastboot mode' +
+                           ' first', 'No device in fastboot', True)
+            return False
+        # the phones of a fleet share a model: the download limit of one
+        # stands for all
+        systemparts = self.for_device(serials[0]).sparse_images(
+            'system', self.systemimg, systempath)
+        if not systemparts:
+            self.ui.notify('Nothing to flash from ' + self.systemimg,
+                           'Cannot flash system', True)
+            return False
+        status = ['Updating ' + ', '.join(serials)]
+
+        def report(serial, step, state):
+            status[0] = serial + ': ' + step + ' ' + state
+            print >> sys.stderr, status[0]
+            dashboard.dashboard.step(serial, step + ' ' + state)
+
+        scheduler = usbtopo.HubScheduler(usbtopo.hubs(self.monitor.sysfs))
+        # phones behind different hubs are flashed at the same time
+        workers = max(4, scheduler.hubs and scheduler.capacity(serials) or 0)
+        work = images.Task(fleet.flash_fleet, do_and_log, self.fastboot,
+                           serials, fleet.update_steps(bootpath, systemparts,
+                                                       wipe),
+                           workers=workers, report=report,
+                           parent=tracing.tracer.current(),
+                           inputs=workflow.fingerprint(self.bootimg,
+                                                       self.systemimg),
+                           scheduler=scheduler)
+        results = self.wait_task(work, 'Updating %d phones' % len(serials),
+                                 lambda: status[0][:90]).result()
+        failed = [serial for serial in serials if results.get(serial)]
+        summary = '\n'.join(serial + ': ' +
+                             (results.get(serial) and
+                              'failed at ' + results[serial] or 'updated')
+                             for serial in serials)
+        self.ui.notify(summary, '%d/%d phones updated' %
+                       (len(serials) - len(failed), len(serials)),
+                       bool(failed))
+        return not failed
+
+    def wait_for_device(self):
+        '''ask adb to wait for the device to be ready
+
+        will not work for recovery, only "normal" device'''
+        return print_and_log(self.adbcmd('wait-for-device'))
+
+    @tracing.traced('nandroid backup')
+    def nandroid_backup(self):
+        '''launch nandroid backup on device (#duration : about 160s)
+
+        adb shell nandroid-mobile.sh -b --norecovery --nomisc --nosplash1
+            --nosplash2 --defaultinput --autoreboot'''
+        output = print_and_log(self.adbcmd('shell', 'nandroid-mobile.sh',
+                                           '-b', '--norecovery', '--nomisc',
+                                           '--nosplash1', '--nosplash2',
+                                           '--defaultinput', '--autoreboot'),
+                               progress=progress.Progress('backup'))
+        if output:
+            self.backup_path = outparse.parse(output).backup
+        return output
+
+    @tracing.traced('nandroid restore')
+    def nandroid_restore(self):
+        '''launch nandroid on device
+
+        adb shell nandroid-mobile.sh -r --defaultinput'''
+        if not self.run_workflow(RESTORE):
+            return False
+        # prints nothing when it works
+        print_and_log(self.adbcmd('shell', 'reboot'))
+        return True
+
+    def restore_backup(self):
+        '''restore the last backup on the sdcard, in recovery'''
+        return print_and_log(self.adbcmd('shell', 'nandroid-mobile.sh', '-r',
+                                         '--defaultinput'),
+                             progress=progress.Progress('restore'))
+
+    @tracing.traced('backup')
+    def simple_backup(self):
+        '''very basic backup, adapted from simplebackup.bat'''
+        return self.run_workflow(BACKUP)
+
+    @tracing.traced('pull backup')
+    def pull_backup(self, serial=None, remote=None):
+        '''copy a nandroid backup of the device to this computer
+
+        the last one unless the directory of another one is given'''
+        serial = serial or self.device_serial()
+        if not serial:
+            self.ui.notify('Connect exactly one phone, in normal or ' +
+                           'recovery mode', 'Backup not copied', True)
+            return False
+        status = ['Looking for the last backup of ' + serial]
+
+        def report(name, size):
+            status[0] = '%s: %s copied (%s)' % (serial, name,
+                                                progress.format_size(size))
+            print >> sys.stderr, status[0]
+
+        try:
+            self.wait_task(images.Task(backupstore.pull_backup,
+                                       self.adbclient, serial, self.backups,
+                                       remote, report),
+                           'Copying the backup', lambda: status[0]).result()
+        except images.ImageError, error:
+            self.ui.notify(str(error), 'Backup not copied', True)
+            return False
+        return True
+
+    @tracing.traced('backup to computer')
+    def backup_to_host(self):
+        '''nandroid backup, then copy of the backup to this computer once
+        the phone has restarted'''
+        if not self.simple_backup():
+            return False
+        serial = self.wait_state('device', 300)
+        return bool(serial) and self.pull_backup(serial, self.backup_path)
+
+    @tracing.traced('restore from computer')
+    def restore_from_host(self, serial=None, date=None):
+        '''restore a backup kept on this computer, the last one of the
+        device unless a date is given
+
+        the phone is started in recovery, the backup copied to its sdcard
+        and restored by nandroid'''
+        serial = serial or self.device_serial()
+        if not serial:
+            self.ui.notify('Connect exactly one phone, in fastboot mode',
+                           'No device in fastboot', True)
+            return False
+        manifest = self.backups.manifest(serial, date)
+        if manifest is None:
+            self.ui.notify('There is no such backup of ' + serial +
+                           ' on this computer', 'Backup not found', True)
+            return False
+        device = self.for_device(serial)
+        if not device.recovery():
+            return False
+        status = ['Copying the backup %s of %s' % (manifest['date'], serial)]
+
+        def report(name, size):
+            status[0] = '%s: %s restored (%s)' % (serial, name,
+                                                  progress.format_size(size))
+            print >> sys.stderr, status[0]
+
+        try:
+            self.wait_task(images.Task(backupstore.push_backup,
+                                       self.adbclient, serial, self.backups,
+                                       manifest, report),
+                           'Copying the backup', lambda: status[0]).result()
+        except images.ImageError, error:
+            self.ui.notify(str(error), 'Backup not copied', True)
+            return False
+        if not device.restore_backup():
+            return False
+        # prints nothing when it works
+        print_and_log(device.adbcmd('shell', 'reboot'))
+        return True
+
+    @tracing.traced('install gapps')
+    def install_gapps(self):
+        '''push gapps to device, unless it is already there'''
+        if not self.gapps:
+            print >> sys.stderr, "You need to select a zipped gapps file first"
+            return
+        serial = self.device_serial()
+        if not serial:
+            self.ui.notify('Connect exactly one phone, in normal mode',
+                           'No device found', True)
+            return False
+        status = ['Copying ' + os.path.basename(self.gapps) + ' to ' + serial]
+        try:
+            rate = self.wait_task(images.Task(
+                transfer.push, self.adbclient, serial, self.gapps,
+                '/sdcard/' + os.path.basename(self.gapps),
+                push_report(serial, status, 'copying gapps')),
+                'Copying gapps', lambda: status[0]).result()
+        except images.ImageError, error:
+            self.ui.notify(str(error), 'Gapps not copied', True)
+            return False
+        if rate is not None and rate < transfer.SLOW_RATE:
+            self.ui.notify('The copy ran at %s/s only: try another USB port '
+                           'or cable' % progress.format_size(rate),
+                           'Slow transfer', True)
+        # prints nothing when it works
+        self.reboot()
+        return True
+
+    def kill_server(self):
+        '''stop the adb server'''
+        return self.adbclient.kill()
+
+    def start_logcat(self, logfile, serials=None, **options):
+        '''start capturing the logcat of devices in normal mode
+
+        with several devices, each one gets its own file; options are
+        those of LogcatCapture.  Return the started captures'''
+        if serials is None:
+            serials = self.serial and [self.serial] or self.serials('device')
+        captures = []
+        for serial in serials:
+            path = logfile
+            if len(serials) > 1:
+                base, ext = os.path.splitext(logfile)
+                path = base + '_' + serial + ext
+            capture = logcat.LogcatCapture(self.adb, serial, path, **options)
+            try:
+                capture.start()
+                captures.append(capture)
+            except (IOError, OSError), error:
+                print >> sys.stderr, 'Error :', error
+        return captures
+
+
+# steps of the sequences, resumed after the last completed one when they
+# fail; the recovery is started again when needed
+UPDATE = workflow.Workflow('update without wipe', [
+    workflow.Step('flash boot',
+                  lambda device: device.flash('boot', device.bootimg),
+                  retries=1),
+    workflow.Step('flash system',
+                  lambda device: device.flash('system', device.systemimg),
+                  ['flash boot'], retries=1),
+])
+UPDATE_WITH_WIPE = workflow.Workflow('update with wipe', [
+    workflow.Step('wipe', Flasher.wipe, retries=1),
+    workflow.Step('flash boot',
+                  lambda device: device.flash('boot', device.bootimg),
+                  ['wipe'], retries=1),
+    workflow.Step('flash system',
+                  lambda device: device.flash('system', device.systemimg),
+                  ['flash boot'], retries=1),
+])
+BACKUP = workflow.Workflow('backup', [
+    workflow.Step('recovery', Flasher.recovery, persistent=False),
+    workflow.Step('nandroid backup', Flasher.nandroid_backup, ['recovery']),
+])
+RESTORE = workflow.Workflow('restore', [
+    workflow.Step('recovery', Flasher.recovery, persistent=False),
+    workflow.Step('nandroid restore', Flasher.restore_backup, ['recovery']),
+])
+
+def do_and_log(args, timeout=10, printout=False, progress=None):
+    '''spawn a subprocess to execute a command
+
+    kill the subprocess after a given timeout (monotonic clock),
+    optionally print out the result
+    with a progress.Progress, the progress of the command is displayed
+    while it runs (cancels timeout, forces printout).  The command is
+    stopped as soon as it prints a failure, see outparse.  fastboot
+    commands for tcp: serials are run by the built-in client instead of
+    the program, see fastbootproto'''
+    cmd = ' '.join(args)
+    print >> sys.stderr, cmd
+    span = tracing.command_span(args)
+    serial = span.attributes.get('serial')
+    parser = outparse.OutputParser()
+    if os.path.basename(args[0]).startswith('fastboot'):
+        parser.subscribe(tracing.fastboot_phases(span))
+    start = fastbootproto.handles(args) and fastbootproto.start or \
+            runner.start
+    try:
+        if progress:
+            lines = Queue.Queue()
+            command = start(args, subscribers=[parser, lines.put])
+            parser.when_failed(lambda event: command.terminate())
+            display = progress_display(os.path.split(cmd)[1], cmd[:90],
+                                       progress.maximum)
+            aborted = False
+            while True:
+                try:
+                    # refresh the display even when nothing is printed
+                    line = lines.get(timeout=REFRESH)
+                except Queue.Empty:
+                    line = ''
+                if line is None:
+                    break
+                if line:
+                    print >> sys.stderr, line
+                    progress.feed(line)
+                if serial:
+                    # measured once fastboot sent an image, estimated before
+                    rate = progress.rate()
+                    dashboard.dashboard.progress(serial, progress.step(),
+                                                 rate or
+                                                 progress.estimated_rate(),
+                                                 progress.remaining(),
+                                                 rate is None)
+                if not display.update(progress.value(),
+                                      progress.message()) or \
+                   serial and dashboard.dashboard.cancelled(serial):
+                    command.terminate()
+                    span.set(aborted=True)
+                    aborted = True
+                    break
+            display.destroy()
+            command.wait()
+            progress.finish(not aborted and command.returncode == 0)
+            output = not aborted and command.output or ''
+        else:
+            command = start(args, timeout, [parser])
+            parser.when_failed(lambda event: command.terminate())
+            command.wait()
+            output = command.output
+            if printout:
+                print >> sys.stderr, output
+        returncode = command.returncode
+        span.set(exit_code=returncode)
+        if parser.failure:
+            print >> sys.stderr, 'Failed :', parser.failure.reason
+            span.set(failure=parser.failure.reason)
+            return ''
+        if returncode and returncode > 0:
+            print >> sys.stderr, 'Error #', returncode
+            return ''
+        if returncode and returncode < 0:
+            print >> sys.stderr, 'Interrupted by signal #', returncode
+            return ''
+        return output
+    except OSError, error:
+        # adb or fastboot not found
+        print >> sys.stderr, 'Error :', error.strerror
+        span.set(error=error.strerror)
+        return ''
+    finally:
+        span.end()
+
+def print_and_log(*args, **kwargs):
+    '''call do_and_log and print the returned process output'''
+    return do_and_log(*args, printout=True, **kwargs)
+
+def push_report(serial, status, step):
+    '''report of transfer.push, showing the progress of the copy to the
+    phone in status[0], on the terminal and on the dashboard'''
+    def report(sent, size, rate):
+        status[0] = '%s: %s of %s, %s/s' % (
+            serial, progress.format_size(sent), progress.format_size(size),
+            progress.format_size(rate))
+        print >> sys.stderr, status[0]
+        dashboard.dashboard.progress(serial, step, rate,
+                                     (size - sent) / max(rate, 1))
+    return report
@@ -0,0 +1,148 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Update several phones at once
+
+Every phone in fastboot mode is addressed by its serial number and goes
+through the same sequence of fastboot commands, a bounded pool of workers
+taking care of the devices in parallel.  Each command is tried again once
+when it fails, and a phone whose update failed resumes it after its last
+completed step.  With a scheduler of usbtopo, the images are sent to a
+bounded number of phones behind each USB hub at a time.
+'''
+
+import sys
+import threading
+import Queue
+
+import tracing
+import workflow
+
+# times a fastboot command is tried again, seconds apart
+RETRIES = 1
+RETRY_DELAY = 2.0
+
+def fastboot_serials(output):
+    '''parse the output of "fastboot devices" into a list of serials'''
+    serials = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == 'fastboot':
+            serials.append(fields[0])
+    return serials
+
+def update_steps(bootimg, systemimgs, wipe=True):
+    '''(step, fastboot arguments, timeout) of a complete OpenEtna update
+
+    systemimgs are the files sending system, several for a sparse image
+    split within the download limit of the bootloader'''
+    steps = []
+    if wipe:
+        steps.append(('wipe', ['-w'], 60))
+    steps.append(('flash boot', ['flash', 'boot', bootimg], 60))
+    for number, systemimg in enumerate(systemimgs):
+        step = 'flash system'
+        if len(systemimgs) > 1:
+            step += ' %d/%d' % (number + 1, len(systemimgs))
+        steps.append((step, ['flash', 'system', systemimg], 600))
+    return steps
+
+def fastboot_step(run, fastboot, serial, step, args, timeout, parent=None,
+                  scheduler=None):
+    '''action of a workflow step running a fastboot command on a device
+
+    flashes wait for a transfer slot of the scheduler, if any'''
+    def action(target):
+        with tracing.tracer.start(step, 'step', parent,
+                                  serial=serial) as span:
+            if scheduler and args[:1] == ['flash']:
+                with scheduler.transfer(serial):
+                    ok = run([fastboot, '-s', serial] + args, timeout=timeout)
+            else:
+                ok = run([fastboot, '-s', serial] + args, timeout=timeout)
+            span.set(ok=bool(ok))
+        return ok
+    return action
+
+def update_workflow(run, fastboot, serial, steps, parent=None,
+                    scheduler=None):
+    '''workflow running the steps one after the other on a device'''
+    declared = []
+    previous = ()
+    for step, args, timeout in steps:
+        declared.append(workflow.Step(step, fastboot_step(run, fastboot,
+                                                          serial, step, args,
+                                                          timeout, parent,
+                                                          scheduler),
+                                      previous, RETRIES, RETRY_DELAY))
+        previous = (step,)
+    return workflow.Workflow('fleet update (%s)' %
+                             ', '.join(step for step, args, timeout in steps),
+                             declared)
+
+def flash_device(run, fastboot, serial, steps, report=None, parent=None,
+                 checkpoints=None, inputs=None, scheduler=None):
+    '''run all steps on the given device
+
+    steps already done by a failed run with the same inputs are skipped.
+    Return the name of the failed step, None if everything went fine'''
+    with tracing.tracer.start('phone update', 'step', parent,
+                              serial=serial) as span:
+        failed = workflow.run(update_workflow(run, fastboot, serial, steps,
+                                              span.id, scheduler),
+                              serial, serial, inputs, checkpoints, report)
+        span.set(ok=not failed, failed=failed)
+    return failed
+
+def flash_fleet(run, fastboot, serials, steps, workers=4, report=None,
+                idle=None, poll=0.1, parent=None, checkpoints=None,
+                inputs=None, scheduler=None):
+    '''run all steps on all devices, at most workers devices at a time
+
+    run is called like do_and_log, report(serial, step, status) is called
+    from the worker threads, idle() from the calling thread while waiting.
+    The steps are traced as children of the parent span, by default the
+    one open in the calling thread.  Each device resumes after the steps
+    it completed in a failed run with the same inputs, see workflow.  A
+    usbtopo.HubScheduler orders the devices and bounds the flashes behind
+    each hub.  Return a dictionary serial -> failed step (None if
+    successful)'''
+    if scheduler:
+        serials = scheduler.order(serials)
+    pending = Queue.Queue()
+    for serial in serials:
+        pending.put(serial)
+    results = {}
+    lock = threading.Lock()
+    if parent is None:
+        parent = tracing.tracer.current()
+
+    def worker():
+        while True:
+            try:
+                serial = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                failed = flash_device(run, fastboot, serial, steps, report,
+                                      parent, checkpoints, inputs, scheduler)
+            except Exception, error:
+                print >> sys.stderr, 'Error on', serial, ':', error
+                failed = 'unexpected error'
+            with lock:
+                results[serial] = failed
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(workers, len(serials))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(poll)
+            if idle:
+                idle()
+    return results
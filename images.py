@@ -0,0 +1,435 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Registry of the image files selected for flashing
+
+Each image gets its header and size checked and its SHA-256 computed
+before being sent to the phone, so that a truncated or wrong file is
+caught before a long transfer.  Results are remembered by (path, size,
+modification time) in a small index of the data directory, so that the
+same image flashed on the next phones is never read again.
+
+Images may also be gzip or xz compressed, or inside a zip archive such as
+the OpenEtna releases: they are then decompressed by bounded buffers to
+the staging cache, in the background, while something else is flashed.
+The cache is keyed by the SHA-256 of the archive, as are the conversions
+to sparse images by the SHA-256 of the image and the deltas between two
+builds by the SHA-256 of both images, so that the same build is prepared
+once whatever its path, see staging and delta.
+'''
+
+import os
+import sys
+import mmap
+import struct
+import gzip
+import hashlib
+import zipfile
+import threading
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import config
+import delta
+import sparse
+import staging
+
+# read by mmap windows of that size
+CHUNK = 16 * 1024 * 1024
+# decompress by buffers of that size
+COPY_SIZE = 1024 * 1024
+COMPRESSED = ('.gz', '.xz', '.zip')
+
+BOOT_MAGIC = 'ANDROID!'
+SPARSE_MAGIC = 0xed26ff3a
+EXT4_MAGIC = 0xef53
+# NAND page plus out of band data, as written by mkyaffs2image
+YAFFS2_CHUNKS = (2048 + 64, 4096 + 128)
+
+class ImageError(Exception):
+    '''the image cannot be flashed'''
+
+
+def check_header(kind, header, size):
+    '''check the beginning of an image against its size
+
+    return the format of the image, raise ImageError if it is not fit for
+    the given kind of partition (boot or system)'''
+    if not size:
+        raise ImageError('empty image')
+    if kind in ('boot', 'recovery'):
+        if not header.startswith(BOOT_MAGIC) or len(header) < 48:
+            raise ImageError('not an Android boot image')
+        (kernel_size, kernel_addr, ramdisk_size, ramdisk_addr, second_size,
+         second_addr, tags_addr, page_size) = struct.unpack('<8I',
+                                                            header[8:40])
+        if not page_size or page_size & (page_size - 1):
+            raise ImageError('invalid page size %d' % page_size)
+        pages = lambda length: (length + page_size - 1) // page_size
+        expected = page_size * (1 + pages(kernel_size) +
+                                pages(ramdisk_size) + pages(second_size))
+        if size < expected:
+            raise ImageError('truncated boot image: %d bytes instead of %d'
+                             % (size, expected))
+        return 'boot'
+    if len(header) >= 28 and \
+       struct.unpack('<I', header[:4])[0] == SPARSE_MAGIC:
+        major, minor, file_header, chunk_header = struct.unpack('<4H',
+                                                                header[4:12])
+        if major != 1 or file_header < 28 or chunk_header < 12:
+            raise ImageError('unsupported sparse image version')
+        return 'sparse'
+    if len(header) >= 1082 and \
+       struct.unpack('<H', header[1080:1082])[0] == EXT4_MAGIC:
+        blocks, = struct.unpack('<I', header[1028:1032])
+        log_block_size, = struct.unpack('<I', header[1048:1052])
+        expected = blocks * (1024 << log_block_size)
+        if size < expected:
+            raise ImageError('truncated ext filesystem: %d bytes instead of %d'
+                             % (size, expected))
+        return 'ext4'
+    for chunk in YAFFS2_CHUNKS:
+        if size % chunk == 0:
+            return 'yaffs2'
+    raise ImageError('unknown system image format or truncated image')
+
+def hash_file(path):
+    '''SHA-256 of a file, read through mmap'''
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        if size:
+            mapped = mmap.mmap(imgfile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, CHUNK):
+                    sha256.update(buffer(mapped, offset, CHUNK))
+            finally:
+                mapped.close()
+    return sha256.hexdigest()
+
+
+def md5_file(path, page=None, chunk=None):
+    '''MD5 of a file, or of the first page bytes of every chunk bytes'''
+    md5 = hashlib.md5()
+    with open(path, 'rb') as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        if size:
+            mapped = mmap.mmap(imgfile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if chunk:
+                    for offset in xrange(0, size, chunk):
+                        md5.update(buffer(mapped, offset, page))
+                else:
+                    for offset in xrange(0, size, CHUNK):
+                        md5.update(buffer(mapped, offset, CHUNK))
+            finally:
+                mapped.close()
+    return md5.hexdigest()
+
+def is_compressed(path):
+    '''is the image in a compressed file or archive'''
+    return path.lower().endswith(COMPRESSED)
+
+def open_image(path, kind):
+    '''file object reading the uncompressed image from path
+
+    for zip archives, such as the OpenEtna releases, the image is the
+    kind.img member (boot.img, system.img)'''
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if lower.endswith('.xz'):
+        if lzma is None:
+            raise ImageError('xz images need the lzma module ' +
+                             '(backports.lzma on Python 2)')
+        return lzma.LZMAFile(path, 'rb')
+    if lower.endswith('.zip'):
+        try:
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipfile, error:
+            raise ImageError('%s: %s' % (path, error))
+        names = [name for name in archive.namelist()
+                 if os.path.basename(name).lower() == kind + '.img']
+        if not names:
+            archive.close()
+            raise ImageError('no %s.img in %s' % (kind, path))
+        return archive.open(names[0])
+    return open(path, 'rb')
+
+def copy(source, out, size=COPY_SIZE):
+    '''copy a file object into another one by bounded buffers'''
+    while True:
+        data = source.read(size)
+        if not data:
+            return
+        out.write(data)
+
+
+class ImageInfo(object):
+    '''a checked image'''
+
+    def __init__(self, path, size, mtime, sha256, format):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.sha256 = sha256
+        self.format = format
+
+    def __repr__(self):
+        return '<%s image %s, %d bytes, sha256 %s>' % (self.format, self.path,
+                                                      self.size, self.sha256)
+
+
+class Task(object):
+    '''function running in a background thread'''
+
+    def __init__(self, function, *args, **kwargs):
+        self.value = None
+        self.error = None
+        self._done = threading.Event()
+        thread = threading.Thread(target=self._run, args=(function, args,
+                                                          kwargs))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, function, args, kwargs):
+        try:
+            self.value = function(*args, **kwargs)
+        except (ImageError, IOError, OSError), error:
+            self.error = error
+        except Exception, error:
+            print >> sys.stderr, 'Error in', function.__name__, ':', error
+            self.error = error
+        finally:
+            # result() waits for it without a timeout
+            self._done.set()
+
+    def wait(self, timeout=None):
+        '''wait at most timeout seconds, return True when the task is over'''
+        if timeout is None:
+            # Event.wait() without timeout cannot be interrupted
+            while not self._done.wait(1):
+                pass
+            return True
+        return self._done.wait(timeout)
+
+    def result(self):
+        '''the value returned by the function, raise ImageError if it failed'''
+        self.wait()
+        if self.error is not None:
+            if not isinstance(self.error, ImageError):
+                raise ImageError(str(self.error))
+            raise self.error
+        return self.value
+
+
+class ImageRegistry(object):
+    '''checked images, remembered by path, size and modification time
+
+    compressed images are decompressed once to the staging cache, which
+    is where they are flashed from'''
+
+    def __init__(self, index=None, cache=None):
+        self.index = index or config.datapath('images.json')
+        self.cache = cache or staging.StagingCache()
+        self._entries = config.load_json(self.index, {})
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._hashing = {}
+
+    def lookup(self, path):
+        '''index entry of an image that did not change since, or None'''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+        if entry and 'images' in entry and entry['size'] == stat.st_size and \
+           entry['mtime'] == stat.st_mtime:
+            return entry
+        return None
+
+    def file_sha256(self, path):
+        '''SHA-256 of the file itself, compressed or not, computed once'''
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self._hashing:
+                self._hashing[path] = threading.Lock()
+            hashing = self._hashing[path]
+        # boot and system are checked at once from the same archive
+        with hashing:
+            entry = self.lookup(path)
+            if entry is None:
+                stat = os.stat(path)
+                entry = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                         'images': {}}
+            if 'sha256' not in entry:
+                print >> sys.stderr, 'Computing the checksum of', path
+                entry = dict(entry, sha256=hash_file(path))
+                self._save(path, entry)
+            return entry['sha256']
+
+    def verify(self, path, kind):
+        '''check an image for the given kind of partition
+
+        return an ImageInfo, raise ImageError if it is not valid'''
+        path = os.path.abspath(path)
+        self.file_sha256(path)
+        entry = self.lookup(path)
+        if entry is None:
+            raise ImageError('%s changed while being checked' % path)
+        image = entry['images'].get(kind)
+        if image is None:
+            source = self.prepare(path, kind)
+            with open(source, 'rb') as imgfile:
+                header = imgfile.read(4096)
+            size = os.path.getsize(source)
+            image = {'size': size,
+                     'format': check_header(kind, header, size)}
+            if not is_compressed(path):
+                image['sha256'] = entry['sha256']
+            else:
+                print >> sys.stderr, 'Computing the checksum of', source
+                image['sha256'] = hash_file(source)
+        self._save(path, entry, kind, image)
+        return ImageInfo(path, image['size'], entry['mtime'],
+                         image['sha256'], image['format'])
+
+    def device_md5(self, path, kind, page_size):
+        '''(length, MD5) expected when reading back the flashed partition
+
+        yaffs2 images are compared on their page data, without the out of
+        band bytes; return None for images that cannot be compared'''
+        info = self.submit(path, kind).result()
+        if info.format == 'yaffs2':
+            # 64 bytes of out of band data for 2048 bytes pages
+            chunk = page_size + page_size // 32
+            if info.size % chunk:
+                return None
+            key = 'md5-%d' % page_size
+            length = info.size // chunk * page_size
+        elif info.format in ('boot', 'ext4'):
+            chunk = None
+            key = 'md5'
+            length = info.size
+        else:
+            return None
+        path = os.path.abspath(path)
+        entry = self.lookup(path)
+        image = entry['images'][kind]
+        if key not in image:
+            print >> sys.stderr, 'Computing the MD5 of', path
+            image = dict(image, **{key: md5_file(self.prepare(path, kind),
+                                                 chunk and page_size,
+                                                 chunk)})
+            self._save(path, entry, kind, image)
+        return length, image[key]
+
+    def _save(self, path, entry, kind=None, image=None):
+        '''record the entry of an image, and the checks of one of its kinds
+
+        entries are replaced, never changed in place, so that the index
+        can be written out of the lock while other images are checked'''
+        with self._lock:
+            entry = dict(entry)
+            if kind is not None:
+                images = dict(entry['images'])
+                current = self._entries.get(path)
+                if current and 'images' in current and \
+                   (current['size'], current['mtime']) == (entry['size'],
+                                                           entry['mtime']):
+                    # the other kinds checked meanwhile
+                    images.update(current['images'])
+                images[kind] = image
+                entry['images'] = images
+            self._entries[path] = entry
+            entries = dict(self._entries)
+        try:
+            config.save_json(self.index, entries)
+        except (IOError, OSError), error:
+            print >> sys.stderr, 'Cannot save the image index :', error
+
+    def submit(self, path, kind):
+        '''start checking an image in the background
+
+        return the Task, shared with previous calls for the same image and
+        kind'''
+        key = (os.path.abspath(path), kind)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or pending.wait(0) and \
+               (pending.error is not None or self.lookup(path) is None):
+                pending = Task(self.verify, path, kind)
+                self._pending[key] = pending
+        return pending
+
+    def prepare(self, path, kind):
+        '''path of the uncompressed image, ready to be flashed
+
+        compressed images are decompressed in the staging cache, only once
+        for a given archive content'''
+        if not is_compressed(path):
+            return path
+
+        def build(directory):
+            print >> sys.stderr, 'Decompressing', path
+            staged = os.path.join(directory, kind + '.img')
+            stream = open_image(path, kind)
+            try:
+                with open(staged, 'wb') as out:
+                    copy(stream, out)
+            finally:
+                stream.close()
+            return [staged]
+        return self.cache.get('%s-%s' % (kind, self.file_sha256(path)),
+                              build)[0]
+
+    def sparse(self, path, kind, max_size):
+        '''sparse images of at most max_size bytes holding the image, in
+        flashing order, converted only once'''
+        info = self.submit(path, kind).result()
+        source = self.prepare(path, kind)
+
+        def build(directory):
+            print >> sys.stderr, 'Converting', path, 'to sparse images'
+            return sparse.convert(source, directory, max_size)
+        return self.cache.get('%s-%s-sparse%d' % (kind, info.sha256,
+                                                  max_size), build)
+
+    def delta(self, base, path, kind):
+        '''payload, manifest and script of the delta from the image base
+        to the image path, computed only once for these two builds'''
+        old = self.submit(base, kind).result()
+        info = self.submit(path, kind).result()
+        if 'yaffs2' in (old.format, info.format):
+            # dump_image reads back the pages without their out of band
+            # data, which the image to flash needs
+            raise ImageError('no delta of yaffs2 images')
+        block = delta.BLOCK_SIZE
+        source = self.prepare(base, kind)
+        target = self.prepare(path, kind)
+
+        def build(directory):
+            print >> sys.stderr, 'Comparing', path, 'to', base
+            try:
+                return delta.build(source, target, directory, block,
+                                   info.sha256, kind)
+            except delta.DeltaError, error:
+                raise ImageError(str(error))
+        return self.cache.get('%s-%s-delta-%s' % (kind, old.sha256,
+                                                  info.sha256), build)
+
+    def cleanup(self):
+        '''release the staged images and keep the staging cache within
+        its size limit'''
+        self.cache.release()
+        self.cache.trim()
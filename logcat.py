@@ -0,0 +1,118 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Streaming logcat capture
+
+Lines are written to disk as they arrive, the log file being rotated by
+size or age and optionally gzip compressed, while only the last lines are
+kept in memory for display.  Captures run in the background for as long
+as needed, one per device.
+'''
+
+import os
+import sys
+import gzip
+import collections
+
+from runner import runner, monotonic
+
+# rotation size used by the flasher
+ROTATE_BYTES = 16 * 1024 * 1024
+
+class LogcatCapture(object):
+    '''capture the logcat of one device to a file
+
+    filters are logcat filter specifications such as 'ActivityManager:I'
+    or '*:W'; with max_bytes or max_age (in seconds), the file is rotated
+    into path.1, path.2... keeping at most keep old files'''
+
+    def __init__(self, adb, serial, path, filters=(), max_bytes=None,
+                 max_age=None, keep=5, compress=False, tail=500):
+        self.adb = adb
+        self.serial = serial
+        self.path = compress and not path.endswith('.gz') and \
+                path + '.gz' or path
+        self.filters = list(filters)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self.compress = compress
+        self.lines = 0
+        self._tail = collections.deque(maxlen=tail)
+        self._out = None
+        self._written = 0
+        self._opened = None
+        self._command = None
+
+    def start(self):
+        '''start capturing, raise OSError if adb cannot be run'''
+        self._open()
+        args = [self.adb]
+        if self.serial:
+            args += ['-s', self.serial]
+        args += ['logcat', '-v', 'time'] + self.filters
+        print >> sys.stderr, ' '.join(args), '>', self.path
+        self._command = runner.start(args, subscribers=[self._line],
+                                     keep=False)
+
+    def stop(self):
+        '''stop capturing and close the log file'''
+        if self._command:
+            self._command.terminate()
+            self._command.wait()
+
+    def running(self):
+        '''is the capture still going on'''
+        return self._command is not None and not self._command.done()
+
+    def tail(self):
+        '''last captured lines'''
+        return list(self._tail)
+
+    def _open(self):
+        if self.compress:
+            self._out = gzip.open(self.path, 'wb')
+        else:
+            self._out = open(self.path, 'w')
+        self._written = 0
+        self._opened = monotonic()
+
+    def _rotated(self, number):
+        if self.compress:
+            return '%s.%d.gz' % (self.path[:-3], number)
+        return '%s.%d' % (self.path, number)
+
+    def _rotate(self):
+        self._out.close()
+        oldest = self._rotated(self.keep)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for number in range(self.keep - 1, 0, -1):
+            if os.path.exists(self._rotated(number)):
+                os.rename(self._rotated(number), self._rotated(number + 1))
+        if self.keep:
+            os.rename(self.path, self._rotated(1))
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _line(self, line):
+        # called from the runner thread
+        if line is None:
+            self._out.close()
+            return
+        self._tail.append(line)
+        self.lines += 1
+        self._out.write(line + '\n')
+        self._written += len(line) + 1
+        if self.max_bytes and self._written >= self.max_bytes or \
+           self.max_age and monotonic() - self._opened >= self.max_age:
+            try:
+                self._rotate()
+            except (IOError, OSError), error:
+                print >> sys.stderr, 'Cannot rotate', self.path, ':', error
+                if self._out.closed:
+                    self._open()
@@ -0,0 +1,279 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Throughput metrics of the flashing station, in the Prometheus format
+
+The registry listens to the spans of tracing as they end: commands are
+counted by name and outcome with a histogram of their durations, steps
+(wipe, flash boot, nandroid backup...) likewise, phones updated or not,
+and the images sent to each phone with the time their sending phase took.
+The states of the phones are read from the device monitor when scraped.
+Once started, an HTTP server in a thread answers on 127.0.0.1:
+
+    curl http://127.0.0.1:9620/metrics
+
+Recording a span is a few additions under a lock, so that it can be left
+on; nothing is recorded before start().  UNIFLASHER_METRICS_PORT starts
+it with the window.
+'''
+
+import sys
+import bisect
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import tracing
+
+PORT = 9620
+# upper bounds of the histogram buckets, in seconds
+COMMAND_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+STEP_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# steps updating a whole phone
+UPDATES = ('update with wipe', 'update without wipe',
+           'update changed partitions', 'update from a base build',
+           'phone update')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def outcome(attributes):
+    '''ok, failed or aborted, from the attributes of a span'''
+    if attributes.get('aborted'):
+        return 'aborted'
+    if attributes.get('error') or attributes.get('failure') or \
+       attributes.get('exit_code') or attributes.get('ok') is False:
+        return 'failed'
+    return 'ok'
+
+def escape(value):
+    '''label value in the text format'''
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+            .replace('\n', r'\n')
+
+def labels(names, values):
+    '''{name="value",...}, or nothing without labels'''
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value))
+                             for name, value in zip(names, values))
+
+def number(value):
+    '''a sample value as Prometheus writes it'''
+    if value == float('inf'):
+        return '+Inf'
+    if float(value) == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter(object):
+    '''values only going up, by label values'''
+
+    kind = 'counter'
+
+    def __init__(self, name, description, names=()):
+        self.name = name
+        self.description = description
+        self.names = names
+        self.values = {}
+
+    def inc(self, values=(), amount=1):
+        '''add amount to the sample of these label values'''
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def samples(self):
+        '''lines of the samples'''
+        return ['%s%s %s' % (self.name, labels(self.names, values),
+                             number(value))
+                for values, value in sorted(self.values.items())]
+
+
+class Histogram(object):
+    '''counts of observations by bucket, by label values'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, names=(), buckets=COMMAND_BUCKETS):
+        self.name = name
+        self.description = description
+        self.names = names
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, values, amount):
+        '''record an observation for these label values'''
+        # the last count is for the observations above every bucket
+        counts, total = self.values.get(values,
+                                        ([0] * (len(self.buckets) + 1), 0))
+        counts[bisect.bisect_left(self.buckets, amount)] += 1
+        self.values[values] = (counts, total + amount)
+
+    def samples(self):
+        '''lines of the buckets, cumulated, then of the sum and count'''
+        lines = []
+        names = self.names + ('le',)
+        for values, (counts, total) in sorted(self.values.items()):
+            seen = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                seen += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, labels(names, values + (number(bound),)),
+                    seen))
+            lines.append('%s_sum%s %s' % (self.name,
+                                          labels(self.names, values),
+                                          number(total)))
+            lines.append('%s_count%s %d' % (self.name,
+                                            labels(self.names, values), seen))
+        return lines
+
+
+class Metrics(object):
+    '''the metrics of the station, fed with the spans of tracing
+
+    monitor, if any, is the device monitor giving the states of the
+    phones'''
+
+    def __init__(self, monitor=None):
+        self.monitor = monitor
+        self._lock = threading.Lock()
+        self.commands = Counter('uniflasher_commands_total',
+                                'adb and fastboot commands run',
+                                ('command', 'outcome'))
+        self.command_seconds = Histogram('uniflasher_command_seconds',
+                                         'duration of the commands',
+                                         ('command',))
+        self.steps = Counter('uniflasher_steps_total',
+                             'steps of the workflows run', ('step', 'outcome'))
+        self.step_seconds = Histogram('uniflasher_step_seconds',
+                                      'duration of the steps', ('step',),
+                                      STEP_BUCKETS)
+        self.phones = Counter('uniflasher_phones_total',
+                              'phones updated, or whose update failed',
+                              ('outcome',))
+        self.sent = Counter('uniflasher_sent_bytes_total',
+                            'bytes of the images sent to the phones',
+                            ('serial',))
+        self.sending = Counter('uniflasher_sending_seconds_total',
+                               'time spent sending these images',
+                               ('serial',))
+        self._metrics = (self.commands, self.command_seconds, self.steps,
+                         self.step_seconds, self.phones, self.sent,
+                         self.sending)
+
+    def span_ended(self, record):
+        '''tracer subscriber'''
+        attributes = record['attributes']
+        name = record['name']
+        duration = record['duration'] or 0
+        result = outcome(attributes)
+        with self._lock:
+            if record['kind'] == 'command':
+                self.commands.inc((name, result))
+                self.command_seconds.observe((name,), duration)
+                if attributes.get('bytes') and result == 'ok':
+                    serial = attributes.get('serial') or ''
+                    # fastboot prints how long the sending took
+                    phases = [phase['duration'] for phase in record['phases']
+                              if phase['name'].startswith('sending') and
+                              phase['duration'] is not None]
+                    self.sent.inc((serial,), attributes['bytes'])
+                    self.sending.inc((serial,), phases and sum(phases) or
+                                     duration)
+            elif record['kind'] == 'step':
+                self.steps.inc((name, result))
+                self.step_seconds.observe((name,), duration)
+                if name in UPDATES and result != 'aborted':
+                    self.phones.inc((result == 'ok' and 'updated' or
+                                     'failed',))
+
+    def devices(self):
+        '''lines of the number of phones in each state'''
+        states = {}
+        if self.monitor:
+            for state in self.monitor.devices().values():
+                states[state] = states.get(state, 0) + 1
+        return ['# HELP uniflasher_devices phones connected, by state',
+                '# TYPE uniflasher_devices gauge'] + \
+                ['uniflasher_devices%s %d' % (labels(('state',), (state,)),
+                                              count)
+                 for state, count in sorted(states.items())]
+
+    def exposition(self):
+        '''the metrics in the Prometheus text format'''
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.append('# HELP %s %s' % (metric.name,
+                                               metric.description))
+                lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+                lines += metric.samples()
+        lines += self.devices()
+        return '\n'.join(lines) + '\n'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''GET /metrics'''
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        try:
+            body = self.server.registry.exposition()
+        except Exception, error:
+            print >> sys.stderr, 'Error in the metrics :', error
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scraped every few seconds, not worth a line each time
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''HTTP server of the metrics of a registry'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, registry, port=PORT, host='127.0.0.1'):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), Handler)
+        self.registry = registry
+        self.port = self.server_address[1]
+
+    def start(self):
+        '''serve in a background thread'''
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        '''stop serving'''
+        self.shutdown()
+        self.server_close()
+
+
+registry = Metrics()
+_subscribed = []
+
+def start(port=PORT, host='127.0.0.1', monitor=None):
+    '''record the metrics and serve them, return the server
+
+    port 0 picks a free one, see the port of the server'''
+    if monitor is not None:
+        registry.monitor = monitor
+    if not _subscribed:
+        tracing.tracer.subscribe(registry.span_ended)
+        _subscribed.append(True)
+    server = MetricsServer(registry, port, host)
+    server.start()
+    print >> sys.stderr, 'Metrics on http://%s:%d/metrics' % (host,
+                                                              server.port)
+    return server
@@ -0,0 +1,179 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Typed events from the output of adb, fastboot and nandroid-mobile.sh
+
+Lines are parsed as they come into events: a phase starts (sending
+'boot' and its size, Dumping system...), a phase is OKAY after some
+seconds, something
+FAILED and why, nandroid writes or reads a backup directory, the command
+says it is done.  A parser is a runner subscriber, so that do_and_log
+stops a command the moment it prints a failure instead of waiting for
+its end or its timeout, and so that adb shell, which does not tell the
+exit code of nandroid-mobile.sh, still fails when nandroid does:
+
+    booting... FAILED (status read failed (Too many links))
+    error: device not found
+    system.img: FAILED
+'''
+
+import re
+import threading
+
+PHASE = 'phase'
+OKAY = 'okay'
+FAILED = 'failed'
+BACKUP = 'backup'
+DONE = 'done'
+
+# sending 'boot' (7040 KB)... OKAY [  1.016s]
+FASTBOOT_PHASE = re.compile(r"^(sending|writing|erasing|formatting|"
+                            r"downloading|booting|rebooting)(?: sparse)?"
+                            r"(?: '([^']+)')?(?: \((\d+) KB\))?\.\.\.", re.I)
+# OKAY [  0.750s], FAILED (remote: flash write failure) at the end
+RESULT = re.compile(r'(OKAY|FAILED)(?:\s*\[\s*([\d.]+)s\])?'
+                    r'(?:\s*\((.*)\))?\s*$')
+# finished. total time: 2.359s
+FINISHED = re.compile(r'^finished\. total time: ([\d.]+)s')
+# Dumping boot to /sdcard/nandroid/.../boot.img...done
+NANDROID_PHASE = re.compile(r'^(dumping|flashing|restoring|erasing|'
+                            r'unpacking|verifying|generating)\s+([\w/.-]+)',
+                            re.I)
+DUMPING = re.compile(r'^Dumping \w+ to (/\S+)/[^/]+\.img\b')
+RESTORE_PATH = re.compile(r'^Restore path: (/\S+)')
+NANDROID_DONE = re.compile(r'^(Backup successful|Restore done)')
+# md5sum -c of the backup images before a restore
+CHECKSUM = re.compile(r'^(\S+): FAILED')
+ERROR = re.compile(r'^error\b:?\s*(.*)', re.I)
+# failed to copy 'gapps.zip' to '/sdcard/gapps.zip': No space left on device
+FAILED_TO = re.compile(r'^failed to \w+ ')
+
+class Event(object):
+    '''something a command printed'''
+
+    def __init__(self, kind, name=None, duration=None, reason=None,
+                 path=None, size=None):
+        self.kind = kind
+        self.name = name
+        self.duration = duration
+        self.reason = reason
+        self.path = path
+        # bytes of the image a phase sends
+        self.size = size
+
+    def __repr__(self):
+        details = [repr(value) for value in (self.name, self.duration,
+                                             self.reason, self.path,
+                                             self.size)
+                   if value is not None]
+        return '<%s %s>' % (self.kind, ' '.join(details))
+
+
+class OutputParser(object):
+    '''events of the lines of a command, as they come
+
+    usable as a runner subscriber; the first failure is kept in failure
+    and the last backup directory in backup, subscribers are given every
+    event'''
+
+    def __init__(self):
+        self.events = []
+        self.phase = None
+        self.failure = None
+        self.backup = None
+        self._lock = threading.Lock()
+        self._on_failure = []
+        self._subscribers = []
+
+    def __call__(self, line):
+        if line is not None:
+            self.feed(line)
+
+    def subscribe(self, callback):
+        '''call callback(event) for the events of the next lines'''
+        self._subscribers.append(callback)
+
+    def when_failed(self, callback):
+        '''call callback(event) at the first failure, now if it was seen'''
+        with self._lock:
+            if self.failure is None:
+                self._on_failure.append(callback)
+                return
+        callback(self.failure)
+
+    def feed(self, line):
+        '''parse a line of output, return its events'''
+        events = self._parse(line.strip())
+        callbacks = []
+        with self._lock:
+            for event in events:
+                self.events.append(event)
+                if event.kind == PHASE:
+                    self.phase = event.name
+                elif event.kind == BACKUP:
+                    self.backup = event.path
+                elif event.kind == FAILED and self.failure is None:
+                    self.failure = event
+                    callbacks, self._on_failure = self._on_failure, []
+        for callback in callbacks:
+            callback(self.failure)
+        for event in events:
+            for callback in self._subscribers:
+                callback(event)
+        return events
+
+    def _parse(self, line):
+        if not line:
+            return []
+        found = CHECKSUM.match(line)
+        if found:
+            return [Event(FAILED, self.phase,
+                          reason=found.group(1) + ' does not match its MD5')]
+        found = ERROR.match(line)
+        if found:
+            return [Event(FAILED, self.phase, reason=found.group(1) or line)]
+        if FAILED_TO.match(line):
+            return [Event(FAILED, self.phase, reason=line)]
+        found = FINISHED.match(line)
+        if found:
+            return [Event(DONE, duration=float(found.group(1)))]
+        found = NANDROID_DONE.match(line)
+        if found:
+            return [Event(DONE, found.group(1))]
+        events = []
+        found = FASTBOOT_PHASE.match(line)
+        if found:
+            name = ' '.join(word for word in (found.group(1).lower(),
+                                              found.group(2)) if word)
+            events.append(Event(PHASE, name, size=found.group(3) and
+                                int(found.group(3)) * 1024))
+        else:
+            found = NANDROID_PHASE.match(line)
+            if found:
+                events.append(Event(PHASE, '%s %s' % (
+                    found.group(1).lower(), found.group(2).rstrip('.'))))
+            found = DUMPING.match(line) or RESTORE_PATH.match(line)
+            if found and found.group(1) != self.backup:
+                events.append(Event(BACKUP, path=found.group(1)))
+        found = RESULT.search(line)
+        if found:
+            # the phase may have been printed on the previous line
+            name = events and events[0].name or self.phase
+            if found.group(1).upper() == 'OKAY':
+                events.append(Event(OKAY, name, found.group(2) and
+                                    float(found.group(2))))
+            else:
+                events.append(Event(FAILED, name, reason=found.group(3) or
+                                    'FAILED'))
+        return events
+
+
+def parse(output):
+    '''parser fed with the whole output of a command'''
+    parser = OutputParser()
+    for line in output.splitlines():
+        parser.feed(line)
+    return parser
@@ -0,0 +1,94 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Checksums of the partitions of a phone running the recovery
+
+The MTD partitions are read through the adb server with the busybox of
+the recovery (head and md5sum), so that an update can skip partitions
+which already hold the image about to be flashed, or tell which build a
+phone runs.  Reading a partition only gives back the page data, not the
+out of band area that yaffs2 images carry: those images are compared on
+their page data only.
+'''
+
+import re
+import sys
+
+import adbclient
+
+MD5 = re.compile(r'\b([0-9a-f]{32})\b')
+# assumed when the kernel does not tell
+PAGE_SIZE = 2048
+
+def mtd_partitions(output):
+    '''parse /proc/mtd into a dictionary name -> mtd device'''
+    partitions = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[0].startswith('mtd') and \
+           fields[0].endswith(':'):
+            partitions[fields[3].strip('"')] = fields[0][:-1]
+    return partitions
+
+class PartitionReader(object):
+    '''read checksums of partitions of one device'''
+
+    def __init__(self, client, serial):
+        self.client = client
+        self.serial = serial
+        self._partitions = None
+
+    def device(self, name):
+        '''mtd device of a partition, None if there is no such partition'''
+        if self._partitions is None:
+            self._partitions = mtd_partitions(
+                self.client.shell(self.serial, 'cat /proc/mtd'))
+        return self._partitions.get(name)
+
+    def page_size(self, name):
+        '''NAND page size of the partition'''
+        output = self.client.shell(self.serial,
+                                   'cat /sys/class/mtd/%s/writesize' %
+                                   self.device(name)).strip()
+        return output.isdigit() and int(output) or PAGE_SIZE
+
+    def md5(self, name, length):
+        '''MD5 of the first length bytes of a partition, None if unknown'''
+        device = self.device(name)
+        if device is None:
+            return None
+        output = self.client.shell(self.serial,
+                                   'dev=/dev/mtd/%s; [ -e $dev ] || ' % device +
+                                   'dev=/dev/%s; ' % device +
+                                   'head -c %d $dev | md5sum' % length)
+        found = MD5.search(output)
+        return found and found.group(1)
+
+    def holds(self, name, registry, imgfiles):
+        '''which of the images the partition holds, None if none of them
+        or if it cannot tell'''
+        try:
+            if self.device(name) is None:
+                return None
+            page = self.page_size(name)
+            # images of the same length are compared to a single read
+            read = {}
+            for imgfile in imgfiles:
+                expected = registry.device_md5(imgfile, name, page)
+                if expected is None:
+                    continue
+                length, checksum = expected
+                if length not in read:
+                    read[length] = self.md5(name, length)
+                if read[length] == checksum:
+                    return imgfile
+        except adbclient.AdbError, error:
+            print >> sys.stderr, 'Error :', error
+        return None
+
+    def changed(self, name, registry, imgfile):
+        '''does the partition differ from the image (or cannot tell)'''
+        return self.holds(name, registry, [imgfile]) is None
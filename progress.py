@@ -0,0 +1,253 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Progress of the operations, from what they print and from past runs
+
+The output of fastboot and of nandroid-mobile.sh is parsed into phases
+(sending 'boot', writing 'boot', Dumping system...) by outparse.  The
+durations of
+the phases of every successful run are kept per operation with the size
+of its image in the data directory, so that the next run knows how long
+each phase should take, scaled to the size of its own image, and how
+many bytes are through at any time.  Until an operation has been seen,
+a default throughput or duration is assumed.  The throughput shown is
+the one fastboot measures for the images it sent, or, before the first
+one, an estimate flagged as such.
+'''
+
+import sys
+import threading
+
+import config
+import outparse
+from runner import monotonic
+
+# progress is reported as a value between 0 and MAXIMUM
+MAXIMUM = 1000
+# runs remembered per operation
+HISTORY_SIZE = 20
+
+# before the first phase, such as the adb or fastboot start up
+STARTING = 'starting'
+# assumed before the first run of an operation
+DEFAULT_RATE = 2 * 1024 * 1024
+DEFAULT_DURATIONS = {'wipe': 10, 'boot': 10, 'backup': 160, 'restore': 240}
+
+def median(values):
+    '''median of a non empty list'''
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def format_size(size):
+    '''size in bytes, for humans'''
+    if size < 1024:
+        return '%d bytes' % size
+    for unit in ('KiB', 'MiB', 'GiB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GiB':
+            return '%.1f %s' % (size, unit)
+
+
+class History(object):
+    '''durations of past runs of the operations, kept in the data directory
+
+    each run is remembered with the size of its image and the duration of
+    its phases'''
+
+    def __init__(self, path=None):
+        self.path = path or config.datapath('durations.json')
+        self._runs = config.load_json(self.path, {})
+        self._lock = threading.Lock()
+
+    def runs(self, operation):
+        '''remembered runs of an operation, oldest first'''
+        with self._lock:
+            return list(self._runs.get(operation, []))
+
+    def record(self, operation, size, duration, phases=()):
+        '''remember a successful run'''
+        run = {'size': size, 'duration': duration,
+               'phases': [[name, length] for name, length in phases]}
+        with self._lock:
+            runs = self._runs.setdefault(operation, [])
+            runs.append(run)
+            del runs[:-HISTORY_SIZE]
+            saved = dict(self._runs)
+        try:
+            config.save_json(self.path, saved)
+        except (IOError, OSError), error:
+            print >> sys.stderr, 'Cannot save the durations :', error
+
+    def estimate(self, operation, size=0):
+        '''expected duration of a run and of its phases, from past runs
+
+        durations are scaled to the size of the image; return the total
+        duration and a list of (phase, duration), or None if the operation
+        was never seen'''
+        runs = self.runs(operation)
+        if not runs:
+            return None
+        scale = lambda run: size and run['size'] and \
+                float(size) / run['size'] or 1.0
+        same = [run for run in runs if run['size'] == size]
+        total = median([run['duration'] * scale(run)
+                        for run in (same or runs)])
+        last = (same or runs)[-1]
+        return total, [(name, length * scale(last))
+                       for name, length in last['phases']]
+
+    def rate(self, operation):
+        '''median throughput of an operation in bytes per second, or None'''
+        rates = [run['size'] / run['duration'] for run in self.runs(operation)
+                 if run['size'] and run['duration'] > 0]
+        return rates and median(rates) or None
+
+_history = None
+_history_lock = threading.Lock()
+
+def history():
+    '''History of the data directory, read on first use'''
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = History()
+        return _history
+
+
+class Progress(object):
+    '''progress of one run of an operation on an image of size bytes
+
+    feed it the lines of output; the value grows with the elapsed time of
+    each phase against its expected duration, and only reaches MAXIMUM
+    when the run is over'''
+
+    def __init__(self, operation, size=0, durations=None):
+        self.operation = operation
+        self.size = size
+        self.maximum = MAXIMUM
+        self.history = durations or history()
+        self.started = monotonic()
+        self.phase = STARTING
+        self.phases = []
+        self._phase_started = self.started
+        self.finished = False
+        # bytes fastboot sent and the seconds it took, as it prints them
+        self.sent = 0
+        self.sending_time = 0.0
+        self._sending = None
+        self._parser = outparse.OutputParser()
+        estimate = self.history.estimate(operation, size)
+        if estimate is None:
+            if size:
+                total = float(size) / DEFAULT_RATE
+            else:
+                total = DEFAULT_DURATIONS.get(operation, 60)
+            estimate = total, []
+        self.expected, self.expected_phases = estimate
+
+    def feed(self, line):
+        '''take a line of output into account'''
+        for event in self._parser.feed(line):
+            self.event(event)
+
+    def event(self, event):
+        '''take an event of outparse into account'''
+        if event.kind == outparse.PHASE:
+            # sending 'boot' (2048 KB)... then OKAY [  0.750s], on the
+            # same line or on the next one
+            self._sending = event.name.startswith('sending ') and \
+                    event.size or None
+            if event.name != self.phase and not self.finished:
+                now = monotonic()
+                self.phases.append((self.phase, now - self._phase_started))
+                self.phase = event.name
+                self._phase_started = now
+        elif event.kind == outparse.OKAY and self._sending and \
+                event.duration is not None:
+            self.sent += self._sending
+            self.sending_time += event.duration
+            self._sending = None
+        elif event.kind == outparse.FAILED:
+            self._sending = None
+
+    def elapsed(self):
+        '''seconds since the start of the run'''
+        return monotonic() - self.started
+
+    def fraction(self):
+        '''estimated part of the run already done, below 1 until the end'''
+        if self.finished:
+            return 1.0
+        if not self.expected:
+            return 0.99
+        names = [name for name, length in self.expected_phases]
+        if self.phase in names:
+            # the phases before this one are done
+            index = names.index(self.phase)
+            before = sum(length for name, length
+                         in self.expected_phases[:index])
+            current = self.expected_phases[index][1]
+            done = before + min(monotonic() - self._phase_started,
+                                current * 0.99)
+        else:
+            done = self.elapsed()
+        return min(done / self.expected, 0.99)
+
+    def value(self):
+        '''progress between 0 and maximum'''
+        return int(self.fraction() * self.maximum)
+
+    def remaining(self):
+        '''estimated seconds until the end'''
+        fraction = self.fraction()
+        if fraction >= 0.99:
+            # late: the last estimate was too short
+            return None
+        return max(self.expected * (1 - fraction), 0)
+
+    def step(self):
+        '''current phase, or the operation before the first one'''
+        return self.phase != STARTING and self.phase or self.operation
+
+    def rate(self):
+        '''bytes per second of the images fastboot sent so far, None
+        before it printed how long the first one took'''
+        if not self.sent or self.sending_time <= 0:
+            return None
+        return self.sent / self.sending_time
+
+    def estimated_rate(self):
+        '''bytes per second the progress estimate amounts to, None without
+        a size'''
+        elapsed = self.elapsed()
+        if not self.size or elapsed <= 0:
+            return None
+        return self.fraction() * self.size / elapsed
+
+    def message(self):
+        '''current phase, bytes through and remaining time'''
+        parts = [self.step()]
+        if self.size:
+            parts.append('%s of %s' % (format_size(self.fraction() *
+                                                   self.size),
+                                       format_size(self.size)))
+        remaining = self.remaining()
+        if remaining is not None:
+            parts.append('about %d s left' % (remaining + 0.5))
+        return ', '.join(parts)
+
+    def finish(self, ok):
+        '''the run is over, remember how long it took if it succeeded'''
+        now = monotonic()
+        if not self.finished:
+            self.phases.append((self.phase, now - self._phase_started))
+        self.finished = True
+        if ok:
+            self.history.record(self.operation, self.size, now - self.started,
+                                self.phases)
@@ -0,0 +1,272 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Event-driven runner for adb and fastboot commands
+
+A single background thread waits on the output pipes of all running
+commands with select(), so that a command is known to be finished as soon
+as its child exits, timeouts are checked against a monotonic clock and any
+number of commands can run at the same time.  A child which closed its
+output is reaped by a blocking wait in a short lived thread, and waiting
+for a command blocks on an event set at that moment.  On Windows, where
+select() does not work on pipes, each command gets its own reader thread
+instead.
+'''
+
+import os
+import sys
+import time
+import errno
+import select
+import subprocess
+import threading
+
+def _monotonic_clock():
+    '''return the best monotonic clock function available'''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if os.name == 'nt':
+        # QueryPerformanceCounter based
+        return time.clock
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        libname = ctypes.util.find_library('rt') or \
+                ctypes.util.find_library('c')
+        clock_gettime = ctypes.CDLL(libname, use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        # CLOCK_MONOTONIC
+        clockid = {'Darwin': 6}.get(os.uname()[0], 1)
+
+        def monotonic():
+            now = timespec()
+            if clock_gettime(clockid, ctypes.byref(now)):
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return now.tv_sec + now.tv_nsec * 1e-9
+
+        monotonic()
+        return monotonic
+    except (ImportError, AttributeError, TypeError, OSError):
+        return time.time
+
+monotonic = _monotonic_clock()
+
+
+class Command(object):
+    '''a running command, its output and the subscribers to its lines
+
+    subscribers are called with each output line (without the trailing
+    newline) from the runner thread, then with None once the command is
+    finished, from the thread reaping it; long running commands whose
+    lines are all handled by subscribers should not keep their output'''
+
+    def __init__(self, args, timeout=None, subscribers=(), keep=True):
+        self.args = args
+        self.timeout = timeout
+        self.keep = keep
+        self.returncode = None
+        self.timedout = False
+        self.pipe = None
+        self.started = monotonic()
+        self.deadline = timeout and self.started + timeout
+        self.finished = None
+        self._chunks = []
+        self._chunkslock = threading.Lock()
+        self._output = None
+        self._partial = ''
+        self._subscribers = list(subscribers)
+        self._done = threading.Event()
+
+    def subscribe(self, callback):
+        '''call callback(line) for each line to come'''
+        self._subscribers.append(callback)
+
+    @property
+    def output(self):
+        '''everything the command printed so far'''
+        with self._chunkslock:
+            if self._output is None or len(self._chunks) > 1:
+                self._output = ''.join(self._chunks)
+                self._chunks = [self._output]
+            return self._output
+
+    @property
+    def elapsed(self):
+        '''running time of the command, in seconds'''
+        return (self.finished or monotonic()) - self.started
+
+    def done(self):
+        '''has the command finished'''
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''wait for the end of the command and return its exit code'''
+        # signalled by the runner the moment the child is reaped
+        if timeout is None:
+            # Event.wait() without timeout cannot be interrupted
+            while not self._done.wait(1):
+                pass
+        else:
+            self._done.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        '''ask the command to stop'''
+        try:
+            self.pipe.terminate()
+        except OSError:
+            # already gone
+            pass
+
+    def _expire(self):
+        self.timedout = True
+        print >> sys.stderr, 'Timeout after', self.timeout, 's :', \
+                ' '.join(self.args)
+        self.terminate()
+
+    def _feed(self, data):
+        data = data.replace('\r\n', '\n')
+        if self.keep:
+            with self._chunkslock:
+                self._chunks.append(data)
+        if not self._subscribers:
+            self._partial = ''
+            return
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            # \r\n split over two reads
+            self._notify(line.rstrip('\r'))
+
+    def _finish(self, returncode):
+        if self._partial:
+            self._notify(self._partial)
+            self._partial = ''
+        self.returncode = returncode
+        self.finished = monotonic()
+        self._done.set()
+        self._notify(None)
+
+    def _notify(self, line):
+        for callback in self._subscribers:
+            try:
+                callback(line)
+            except Exception, error:
+                print >> sys.stderr, 'Error in output subscriber :', error
+
+
+class Runner(object):
+    '''run commands and collect their output from one select() loop'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reading = {}
+        self._reaping = []
+        self._thread = None
+        self._wakeup = None
+
+    def start(self, args, timeout=None, subscribers=(), keep=True):
+        '''launch a command and return it without waiting
+
+        raise OSError if the program cannot be run'''
+        command = Command(args, timeout, subscribers, keep)
+        command.pipe = subprocess.Popen(args,
+                                        bufsize=0,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        close_fds=os.name != 'nt')
+        if os.name == 'nt':
+            thread = threading.Thread(target=self._read_thread,
+                                      args=(command,))
+            thread.daemon = True
+            thread.start()
+            return command
+        with self._lock:
+            self._reading[command.pipe.stdout.fileno()] = command
+            if self._thread is None:
+                self._wakeup = os.pipe()
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+        os.write(self._wakeup[1], 'x')
+        return command
+
+    def run(self, args, timeout=None, subscribers=()):
+        '''launch a command and wait for its end'''
+        command = self.start(args, timeout, subscribers)
+        command.wait()
+        return command
+
+    def _read_thread(self, command):
+        '''blocking reads, for platforms where pipes cannot be selected'''
+        timer = None
+        if command.timeout:
+            timer = threading.Timer(command.timeout, command._expire)
+            timer.daemon = True
+            timer.start()
+        fileno = command.pipe.stdout.fileno()
+        while True:
+            data = os.read(fileno, 65536)
+            if not data:
+                break
+            command._feed(data)
+        command.pipe.stdout.close()
+        returncode = command.pipe.wait()
+        if timer:
+            timer.cancel()
+        command._finish(returncode)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                reading = dict(self._reading)
+                reaping = list(self._reaping)
+            now = monotonic()
+            for command in reading.values() + reaping:
+                if command.deadline and command.deadline <= now and \
+                   not command.timedout:
+                    command._expire()
+            deadlines = [command.deadline - now
+                         for command in reading.values() + reaping
+                         if command.deadline and not command.timedout]
+            wait = deadlines and max(0, min(deadlines)) or None
+            try:
+                readable = select.select(reading.keys() + [self._wakeup[0]],
+                                         [], [], wait)[0]
+            except (select.error, OSError), error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fileno in readable:
+                if fileno == self._wakeup[0]:
+                    os.read(fileno, 4096)
+                    continue
+                command = reading[fileno]
+                data = os.read(fileno, 65536)
+                if data:
+                    command._feed(data)
+                    continue
+                with self._lock:
+                    del self._reading[fileno]
+                    self._reaping.append(command)
+                command.pipe.stdout.close()
+                # closed its output, the child is about to exit
+                thread = threading.Thread(target=self._reap, args=(command,))
+                thread.daemon = True
+                thread.start()
+
+    def _reap(self, command):
+        '''blocking wait for the exit of a child, then its end'''
+        returncode = command.pipe.wait()
+        with self._lock:
+            self._reaping.remove(command)
+        command._finish(returncode)
+
+runner = Runner()
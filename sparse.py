@@ -0,0 +1,233 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Android sparse image format
+
+A sparse image is a header followed by chunks describing runs of blocks:
+RAW chunks carry data, FILL chunks repeat a 4 bytes value and DONT_CARE
+chunks leave blocks untouched.  Converting an image sends only its real
+data over USB, and splitting it into several sparse images, each covering
+the whole partition with DONT_CARE around its own part, keeps every
+transfer within the download limit of the bootloader.
+
+The image is scanned block by block and its data is copied only when the
+sparse file is written, so memory use does not depend on the image size.
+The last block of an image which is not a multiple of the block size is
+padded with zeros, as img2simg does.
+'''
+
+import os
+import struct
+
+BLOCK_SIZE = 4096
+
+MAGIC = 0xed26ff3a
+FILE_HEADER = struct.Struct('<I4H4I')
+CHUNK_HEADER = struct.Struct('<2H2I')
+
+RAW = 0xcac1
+FILL = 0xcac2
+DONT_CARE = 0xcac3
+CRC32 = 0xcac4
+
+# copy data by buffers of that size
+COPY_SIZE = 1024 * 1024
+
+class SparseError(Exception):
+    '''the image cannot be converted, or is not a valid sparse image'''
+
+
+def is_sparse(header):
+    '''does a file starting with header hold a sparse image'''
+    return len(header) >= 4 and struct.unpack('<I', header[:4])[0] == MAGIC
+
+def blocks(size, block_size=BLOCK_SIZE):
+    '''blocks holding size bytes, the last one maybe padded'''
+    return (size + block_size - 1) // block_size
+
+def scan(imgfile, size, block_size=BLOCK_SIZE):
+    '''describe an image as runs of blocks
+
+    return a list of (chunk type, first block, block count, fill value);
+    fill value is the 4 bytes of a FILL run, the file offset of a RAW one'''
+    runs = []
+    imgfile.seek(0)
+    for block in xrange(blocks(size, block_size)):
+        data = imgfile.read(block_size)
+        if len(data) != min(block_size, size - block * block_size):
+            raise SparseError('image shorter than %d bytes' % size)
+        data += '\0' * (block_size - len(data))
+        if data == data[:4] * (block_size // 4):
+            kind, value = FILL, data[:4]
+        else:
+            kind, value = RAW, block * block_size
+        if runs and runs[-1][0] == kind and \
+           (kind == RAW or runs[-1][3] == value):
+            last = runs[-1]
+            runs[-1] = (kind, last[1], last[2] + 1, last[3])
+        else:
+            runs.append((kind, block, 1, value))
+    return runs
+
+def chunk_size(run, block_size=BLOCK_SIZE):
+    '''size of the chunk of a run in the sparse file'''
+    kind, first, count, value = run
+    if kind == RAW:
+        return CHUNK_HEADER.size + count * block_size
+    if kind == FILL:
+        return CHUNK_HEADER.size + 4
+    return CHUNK_HEADER.size
+
+def split(runs, total_blocks, max_size, block_size=BLOCK_SIZE):
+    '''group runs into sparse images of at most max_size bytes
+
+    return a list of run lists, each covering all the blocks'''
+    # header, raw chunk of at least one block, DONT_CARE before and after
+    overhead = FILE_HEADER.size + 2 * CHUNK_HEADER.size
+    if max_size < overhead + chunk_size((RAW, 0, 1, 0), block_size):
+        raise SparseError('download limit of %d bytes is too small' %
+                          max_size)
+    parts = []
+    current = []
+    used = overhead
+    for run in runs:
+        while run:
+            kind, first, count, value = run
+            room = max_size - used
+            if chunk_size(run, block_size) <= room:
+                current.append(run)
+                used += chunk_size(run, block_size)
+                run = None
+                continue
+            fitting = (room - CHUNK_HEADER.size) // block_size
+            if kind == RAW and fitting > 0:
+                current.append((RAW, first, fitting, value))
+                run = (RAW, first + fitting, count - fitting,
+                       value + fitting * block_size)
+            parts.append(current)
+            current = []
+            used = overhead
+    if current or not parts:
+        parts.append(current)
+    return [_pad(part, total_blocks) for part in parts]
+
+def _pad(runs, total_blocks):
+    '''cover the blocks before and after runs with DONT_CARE'''
+    padded = []
+    position = 0
+    for run in runs:
+        if run[1] > position:
+            padded.append((DONT_CARE, position, run[1] - position, None))
+        padded.append(run)
+        position = run[1] + run[2]
+    if position < total_blocks:
+        padded.append((DONT_CARE, position, total_blocks - position, None))
+    return padded
+
+def write(runs, imgfile, out, total_blocks, block_size=BLOCK_SIZE):
+    '''write the runs as a sparse image, with data read from imgfile'''
+    out.write(FILE_HEADER.pack(MAGIC, 1, 0, FILE_HEADER.size,
+                               CHUNK_HEADER.size, block_size, total_blocks,
+                               len(runs), 0))
+    for run in runs:
+        kind, first, count, value = run
+        out.write(CHUNK_HEADER.pack(kind, 0, count,
+                                    chunk_size(run, block_size)))
+        if kind == FILL:
+            out.write(value)
+        elif kind == RAW:
+            imgfile.seek(value)
+            remaining = count * block_size
+            while remaining:
+                data = imgfile.read(min(remaining, COPY_SIZE))
+                if not data:
+                    if remaining >= block_size:
+                        raise SparseError('image shorter than expected')
+                    # end of an image which is not block aligned
+                    data = '\0' * remaining
+                out.write(data)
+                remaining -= len(data)
+
+def convert(path, outdir, max_size=None, block_size=BLOCK_SIZE):
+    '''convert an image into sparse images of at most max_size bytes
+
+    return the list of their paths, in flashing order'''
+    size = os.path.getsize(path)
+    total_blocks = blocks(size, block_size)
+    name = os.path.splitext(os.path.basename(path))[0]
+    paths = []
+    with open(path, 'rb') as imgfile:
+        runs = scan(imgfile, size, block_size)
+        if max_size:
+            parts = split(runs, total_blocks, max_size, block_size)
+        else:
+            parts = [runs]
+        for number, part in enumerate(parts):
+            partpath = os.path.join(outdir, '%s.sparse%d.img' % (name, number))
+            with open(partpath, 'wb') as out:
+                write(part, imgfile, out, total_blocks, block_size)
+            paths.append(partpath)
+    return paths
+
+def expand(sparsefile, out):
+    '''write the raw image described by a sparse image
+
+    blocks left as DONT_CARE are not written: out should be seekable and
+    prefilled if they matter.  Return the size of the raw image'''
+    header = sparsefile.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or not is_sparse(header):
+        raise SparseError('not a sparse image')
+    (magic, major, minor, file_header, chunk_header, block_size, total_blocks,
+     total_chunks, checksum) = FILE_HEADER.unpack(header)
+    if major != 1:
+        raise SparseError('unsupported sparse image version %d' % major)
+    sparsefile.read(file_header - FILE_HEADER.size)
+    position = 0
+    for chunk in xrange(total_chunks):
+        header = sparsefile.read(chunk_header)
+        if len(header) < CHUNK_HEADER.size:
+            raise SparseError('truncated sparse image')
+        kind, reserved, count, total = CHUNK_HEADER.unpack(
+            header[:CHUNK_HEADER.size])
+        datasize = total - chunk_header
+        length = count * block_size
+        if kind == RAW:
+            if datasize != length:
+                raise SparseError('bad raw chunk size')
+            out.seek(position)
+            while length:
+                data = sparsefile.read(min(length, COPY_SIZE))
+                if not data:
+                    raise SparseError('truncated sparse image')
+                out.write(data)
+                length -= len(data)
+        elif kind == FILL:
+            value = sparsefile.read(datasize)
+            out.seek(position)
+            block = value * (block_size // 4)
+            for i in xrange(count):
+                out.write(block)
+        elif kind in (DONT_CARE, CRC32):
+            sparsefile.read(datasize)
+        else:
+            raise SparseError('unknown chunk type %#x' % kind)
+        if kind != CRC32:
+            position += count * block_size
+    if position != total_blocks * block_size:
+        raise SparseError('chunks cover %d bytes instead of %d' %
+                          (position, total_blocks * block_size))
+    out.truncate(position)
+    return position
+
+def max_download_size(output):
+    '''download limit reported by "fastboot getvar max-download-size"'''
+    for line in output.splitlines():
+        if line.startswith('max-download-size:'):
+            try:
+                return int(line.split(':', 1)[1].strip(), 0)
+            except ValueError:
+                return None
+    return None
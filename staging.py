@@ -0,0 +1,169 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Local cache of the images prepared for flashing
+
+Decompressed images and their conversions to sparse images are kept in
+the data directory, each entry in a directory named after the content
+hash it was made from, so that flashing the same build on the next phone,
+or in the next session, reads it from the local disk (or the page cache)
+instead of converting it again from a network share or a USB stick.
+
+An entry is built in a temporary directory renamed once complete, only
+once at a time per key, so that several workers and processes can share
+the cache.  Above SIZE_LIMIT bytes, the least recently used entries are
+removed, except those used in the last RECENT seconds which may still be
+being flashed.  The entries a cache handed out stay in use until it
+releases them, touched every TOUCH seconds meanwhile so that the trims of
+other processes keep them too, however long the updates last.
+UNIFLASHER_STAGING_MB changes the default limit.
+'''
+
+import os
+import sys
+import time
+import shutil
+import threading
+
+import config
+
+SIZE_LIMIT = int(os.environ.get('UNIFLASHER_STAGING_MB') or 4096) * \
+        1024 * 1024
+# seconds during which an entry is not removed after being used
+RECENT = 600
+# seconds between two touches of the entries in use
+TOUCH = RECENT // 4
+# list of the files of an entry, in order
+ENTRY = 'entry.json'
+
+class StagingCache(object):
+    '''entries of prepared files, by key'''
+
+    def __init__(self, root=None, limit=None):
+        self.root = root or os.path.join(config.DATADIR, 'staging')
+        self.limit = SIZE_LIMIT if limit is None else limit
+        self._lock = threading.Lock()
+        self._building = {}
+        self._in_use = set()
+        self._toucher = None
+
+    def path(self, key):
+        '''directory of an entry'''
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        '''paths of the files of an entry, marked as just used, or None'''
+        directory = self.path(key)
+        entry = config.load_json(os.path.join(directory, ENTRY))
+        if not entry:
+            return None
+        paths = [os.path.join(directory, name) for name in entry['files']]
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        try:
+            os.utime(directory, None)
+        except OSError:
+            pass
+        with self._lock:
+            self._in_use.add(key)
+            if self._toucher is None:
+                self._toucher = threading.Thread(target=self._touch)
+                self._toucher.daemon = True
+                self._toucher.start()
+        return paths
+
+    def release(self):
+        '''the entries handed out so far are no longer in use'''
+        with self._lock:
+            self._in_use.clear()
+
+    def _touch(self):
+        while True:
+            time.sleep(TOUCH)
+            with self._lock:
+                keys = list(self._in_use)
+                if not keys:
+                    self._toucher = None
+                    return
+            for key in keys:
+                try:
+                    os.utime(self.path(key), None)
+                except OSError:
+                    # removed meanwhile
+                    pass
+
+    def get(self, key, build):
+        '''paths of the files of an entry, building it if needed
+
+        build(directory) writes the files in directory and returns their
+        paths, in order'''
+        paths = self.lookup(key)
+        if paths:
+            return paths
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        # several workers may need the same entry, build it once
+        with building:
+            paths = self.lookup(key)
+            if paths:
+                return paths
+            tmpdir = '%s.%d.%d.tmp' % (self.path(key), os.getpid(),
+                                       threading.current_thread().ident)
+            os.makedirs(tmpdir)
+            try:
+                names = [os.path.basename(path) for path in build(tmpdir)]
+                config.save_json(os.path.join(tmpdir, ENTRY),
+                                 {'key': key, 'files': names})
+                if os.path.isdir(self.path(key)):
+                    # built by another process in the meantime, or broken
+                    paths = self.lookup(key)
+                    if paths:
+                        return paths
+                    shutil.rmtree(self.path(key), True)
+                os.rename(tmpdir, self.path(key))
+            finally:
+                shutil.rmtree(tmpdir, True)
+        self.trim(key)
+        return self.lookup(key)
+
+    def entries(self):
+        '''(last use, size, key) of the entries, least recently used first'''
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for key in os.listdir(self.root):
+            directory = self.path(key)
+            if key.endswith('.tmp') or not os.path.isdir(directory):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(directory, name))
+                           for name in os.listdir(directory))
+                entries.append((os.path.getmtime(directory), size, key))
+            except OSError:
+                # removed by another process
+                continue
+        return sorted(entries)
+
+    def usage(self):
+        '''bytes used by the entries'''
+        return sum(size for used, size, key in self.entries())
+
+    def trim(self, keep=None):
+        '''remove the least recently used entries above the size limit'''
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        now = time.time()
+        with self._lock:
+            in_use = set(self._in_use)
+        for used, size, key in entries:
+            if total <= self.limit:
+                break
+            if key == keep or key in in_use or now - used < RECENT:
+                continue
+            print >> sys.stderr, 'Removing the staged', key
+            shutil.rmtree(self.path(key), True)
+            total -= size
+        return total
@@ -0,0 +1,178 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+The adb client against the fake adb server of the benchmarks
+'''
+
+import os
+import sys
+import stat
+import shutil
+import socket
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'bench')]
+
+import adbclient
+import fakedevice
+import fakeserver
+
+
+class AdbClientTest(unittest.TestCase):
+    '''a phone in normal mode and one in recovery'''
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='uniflasher-test')
+        config = dict(fakedevice.DEFAULTS)
+        config['time_scale'] = 0
+        fakedevice.save_config(config, self.home)
+        devices = fakedevice.Devices(self.home)
+        devices.set('A1', 'device')
+        devices.set('B2', 'recovery')
+        devices.set('C3', 'fastboot')
+        self.sdcard = fakedevice.sdcard('B2', self.home)
+        os.makedirs(os.path.join(self.sdcard, 'nandroid', 'B2'))
+        self.server = fakeserver.FakeAdbServer(self.home)
+        self.server.start()
+        self.client = adbclient.AdbClient(port=self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.home, True)
+
+
+class Host(AdbClientTest):
+    '''host requests'''
+
+    def test_version(self):
+        self.assertEqual(self.client.version(), 32)
+
+    def test_devices(self):
+        # phones in fastboot mode are not seen by adb
+        self.assertEqual(self.client.devices(), [('A1', 'device'),
+                                                 ('B2', 'recovery')])
+
+    def test_get_state(self):
+        self.assertEqual(self.client.get_state('B2'), 'recovery')
+
+    def test_fail(self):
+        try:
+            self.client.get_state('C3')
+        except adbclient.AdbError, error:
+            self.assertEqual(str(error), 'device not found')
+        else:
+            self.fail('no error for a device in fastboot mode')
+        self.assertRaises(adbclient.AdbError, self.client.query,
+                          'host:unknown')
+
+    def test_track_devices(self):
+        sock = self.client.track_devices()
+        try:
+            self.assertEqual(adbclient.read_devices(sock),
+                             [('A1', 'device'), ('B2', 'recovery')])
+            fakedevice.Devices(self.home).remove('A1')
+            self.assertEqual(adbclient.read_devices(sock),
+                             [('B2', 'recovery')])
+        finally:
+            sock.close()
+
+    def test_refused(self):
+        # without the adb program, the server is not started
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = adbclient.AdbClient(port=port)
+        self.assertRaises(adbclient.AdbError, client.version)
+
+    def test_parse_devices(self):
+        self.assertEqual(adbclient.parse_devices(
+            'List of devices attached\nA1\tdevice\n\nB2\toffline\n'),
+            [('A1', 'device'), ('B2', 'offline')])
+
+
+class Transport(AdbClientTest):
+    '''services of a device'''
+
+    def test_shell(self):
+        self.assertEqual(self.client.shell('B2', 'cat /proc/mtd'),
+                         fakeserver.SHELL['cat /proc/mtd'])
+
+    def test_no_device(self):
+        self.assertRaises(adbclient.AdbError, self.client.transport, 'Z9',
+                          'shell:ls')
+        self.assertRaises(adbclient.AdbError, self.client.shell, 'C3', 'ls')
+
+    def test_unknown_service(self):
+        self.assertRaises(adbclient.AdbError, self.client.transport, 'A1',
+                          'framebuffer:')
+
+
+class Sync(AdbClientTest):
+    '''files of the sdcard'''
+
+    def setUp(self):
+        AdbClientTest.setUp(self)
+        self.sync = self.client.sync('B2')
+
+    def tearDown(self):
+        self.sync.close()
+        AdbClientTest.tearDown(self)
+
+    def test_send_recv(self):
+        data = os.urandom(3 * adbclient.SYNC_DATA + 123)
+        written = self.sync.push('/sdcard/nandroid/B2/system.img',
+                                 [data[:1000], data[1000:]])
+        self.assertEqual(written, len(data))
+        with open(os.path.join(self.sdcard, 'nandroid', 'B2',
+                               'system.img'), 'rb') as source:
+            self.assertEqual(source.read(), data)
+        received = []
+        self.assertEqual(self.sync.pull('/sdcard/nandroid/B2/system.img',
+                                        received.append), len(data))
+        self.assertEqual(''.join(received), data)
+        self.assertTrue(max(len(chunk) for chunk in received) <=
+                        adbclient.SYNC_DATA)
+
+    def test_send_fail(self):
+        try:
+            self.sync.push('/sdcard/nandroid', ['data'])
+        except adbclient.AdbError, error:
+            self.assertTrue('Is a directory' in str(error))
+        else:
+            self.fail('no error writing over a directory')
+        # the session goes on after a failure
+        self.assertEqual(self.sync.push('/sdcard/after', ['ok']), 2)
+
+    def test_recv_fail(self):
+        try:
+            self.sync.pull('/sdcard/missing', lambda data: None)
+        except adbclient.AdbError, error:
+            self.assertTrue('No such file' in str(error))
+        else:
+            self.fail('no error reading a missing file')
+        self.assertTrue(self.sync.stat('/sdcard/nandroid'))
+
+    def test_stat(self):
+        self.sync.push('/sdcard/file', ['12345'])
+        mode, size, mtime = self.sync.stat('/sdcard/file')
+        self.assertTrue(stat.S_ISREG(mode))
+        self.assertEqual(size, 5)
+        self.assertTrue(stat.S_ISDIR(self.sync.stat('/sdcard/nandroid')[0]))
+        self.assertEqual(self.sync.stat('/sdcard/missing'), None)
+
+    def test_list(self):
+        self.sync.push('/sdcard/nandroid/B2/boot.img', ['boot'])
+        self.assertEqual(self.sync.directories('/sdcard/nandroid'), ['B2'])
+        self.assertEqual([entry[0] for entry in
+                          self.sync.list('/sdcard/nandroid/B2')],
+                         ['boot.img'])
+
+
+if __name__ == '__main__':
+    unittest.main()
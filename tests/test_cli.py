@@ -0,0 +1,90 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Options of the flash command, run on a flasher recording its calls
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import cli
+
+
+class Recorder(object):
+    '''flasher remembering the operations asked to it'''
+
+    def __init__(self):
+        self.calls = []
+        self.bootimg = self.systemimg = ''
+
+    def for_device(self, serial):
+        self.calls.append(('for_device', serial))
+        return self
+
+    def __getattr__(self, name):
+        def operation(*args):
+            self.calls.append((name,) + args)
+            return True
+        return operation
+
+
+class Flash(unittest.TestCase):
+    '''which operations the options of flash lead to'''
+
+    def flash(self, *words):
+        flasher = Recorder()
+        result = cli.flash(flasher, cli.parser().parse_args(['flash'] +
+                                                            list(words)))
+        return result, flasher.calls
+
+    def test_wipe_default(self):
+        self.assertEqual(self.flash('--boot', 'b', '--system', 's')[1],
+                         [('flash_openetna',)])
+        self.assertEqual(self.flash('--boot', 'b')[1],
+                         [('flash', 'boot', 'b')])
+        self.assertEqual(self.flash('--boot', 'b', '--wipe')[1],
+                         [('wipe',), ('flash', 'boot', 'b')])
+
+    def test_fleet(self):
+        self.assertEqual(self.flash('--boot', 'b', '--system', 's',
+                                    '--all')[1],
+                         [('flash_fleet', True, None)])
+        self.assertEqual(self.flash('--boot', 'b', '--system', 's',
+                                    '--no-wipe', '-s', 'A', '-s', 'B')[1],
+                         [('flash_fleet', False, ['A', 'B'])])
+
+    def test_changed(self):
+        self.assertEqual(self.flash('--boot', 'b', '--system', 's',
+                                    '--changed', '-s', 'A')[1],
+                         [('for_device', 'A'), ('flash_changed',)])
+        self.assertEqual(self.flash('--boot', 'b', '--system', 's',
+                                    '--base', 'old.img')[1],
+                         [('flash_delta', 'old.img')])
+
+    def test_rejected(self):
+        # never a fleet update wiping every phone
+        for words in (('--changed', '--all'), ('--base', 'old.img', '-s',
+                                               'A', '-s', 'B'),
+                      ('--changed', '--wipe')):
+            self.assertEqual(self.flash('--boot', 'b', '--system', 's',
+                                        *words), (False, []))
+
+
+class Main(unittest.TestCase):
+    '''the main window without a command'''
+
+    def test_command_names(self):
+        names = cli.command_names(cli.parser())
+        self.assertTrue('flash' in names and 'gui' in names)
+        self.assertFalse('out.json' in names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+The built-in fastboot client against the fake bootloader of the benchmarks
+'''
+
+import os
+import sys
+import socket
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'bench')]
+
+import sparse
+import fakedevice
+import fakebootloader
+import fastbootproto
+
+
+class Scripted(object):
+    '''bootloader sending scripted answers a byte at a time, after the
+    handshake, whatever the commands'''
+
+    def __init__(self, answers, close=False):
+        self.answers = answers
+        self.close = close
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.serial = 'tcp:127.0.0.1:%d' % self.listener.getsockname()[1]
+        self.received = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        sock = self.listener.accept()[0]
+        try:
+            if sock.recv(4) != 'FB01':
+                return
+            for byte in 'FB01':
+                sock.sendall(byte)
+            header = sock.recv(8)
+            self.received.append(sock.recv(struct.unpack('>Q', header)[0]))
+            for answer in self.answers:
+                for byte in struct.pack('>Q', len(answer)) + answer:
+                    sock.sendall(byte)
+            if not self.close:
+                sock.recv(1)
+        finally:
+            sock.close()
+            self.listener.close()
+
+
+class Responses(unittest.TestCase):
+    '''answers split in short reads'''
+
+    def client(self, answers, close=False):
+        bootloader = Scripted(answers, close)
+        client = fastbootproto.FastbootClient(
+            fastbootproto.TcpTransport(*fastbootproto.address(
+                bootloader.serial)), self.messages.append)
+        self.addCleanup(client.close)
+        return client
+
+    def setUp(self):
+        self.messages = []
+
+    def test_info(self):
+        client = self.client(['INFOerasing flash', 'TEXTdone', 'OKAY'])
+        self.assertEqual(client.erase('userdata'), '')
+        self.assertEqual(self.messages, ['erasing flash', 'done'])
+
+    def test_okay(self):
+        client = self.client(['OKAY0x00100000'])
+        self.assertEqual(client.getvar('max-download-size'), '0x00100000')
+
+    def test_fail(self):
+        client = self.client(['INFOchecking', 'FAILpartition locked'])
+        try:
+            client.flash('boot')
+        except fastbootproto.FastbootError, error:
+            self.assertEqual(str(error), 'remote: partition locked')
+        else:
+            self.fail('no error for a FAIL answer')
+        self.assertEqual(self.messages, ['checking'])
+
+    def test_unknown(self):
+        client = self.client(['WHAT'])
+        self.assertRaises(fastbootproto.FastbootError, client.boot)
+
+    def test_closed(self):
+        client = self.client(['INFOrebooting'], True)
+        self.assertRaises(fastbootproto.FastbootError, client.reboot)
+
+    def test_handshake(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+
+        def answer():
+            sock = listener.accept()[0]
+            sock.recv(4)
+            sock.sendall('ADB0')
+            sock.close()
+        thread = threading.Thread(target=answer)
+        thread.daemon = True
+        thread.start()
+        self.assertRaises(fastbootproto.FastbootError,
+                          fastbootproto.TcpTransport, '127.0.0.1',
+                          listener.getsockname()[1])
+
+
+class FakeBootloaderTest(unittest.TestCase):
+    '''a phone in fastboot mode with its bootloader on the network'''
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='uniflasher-test')
+        self.configure(time_scale=0, max_download_size=64 * 1024,
+                       info=['erasing before writing'])
+        self.bootloader = fakebootloader.FakeBootloader(self.home)
+        self.serial = self.bootloader.serial
+        fakedevice.Devices(self.home).set(self.serial, 'fastboot')
+        self.bootloader.start()
+
+    def tearDown(self):
+        self.bootloader.stop()
+        shutil.rmtree(self.home, True)
+
+    def configure(self, **changes):
+        config = fakedevice.load_config(self.home)
+        config.update(changes)
+        fakedevice.save_config(config, self.home)
+
+    def image(self, size, name='boot.img'):
+        path = os.path.join(self.home, name)
+        with open(path, 'wb') as out:
+            out.write(os.urandom(size))
+        return path
+
+    def session(self, *words):
+        session = fastbootproto.start(['fastboot', '-s', self.serial] +
+                                      list(words))
+        session.wait()
+        return session
+
+
+class Client(FakeBootloaderTest):
+    '''commands of the client'''
+
+    def setUp(self):
+        FakeBootloaderTest.setUp(self)
+        self.messages = []
+        self.client = fastbootproto.FastbootClient(
+            fastbootproto.TcpTransport(*fastbootproto.address(self.serial)),
+            self.messages.append)
+
+    def tearDown(self):
+        self.client.close()
+        FakeBootloaderTest.tearDown(self)
+
+    def test_download_flash(self):
+        # more than a transport message
+        self.configure(max_download_size=None)
+        path = self.image(fastbootproto.PACKET + 4321)
+        reports = []
+        self.assertEqual(self.client.download(path, reports.append), '')
+        self.assertEqual(reports, [fastbootproto.PACKET,
+                                   fastbootproto.PACKET + 4321])
+        self.assertEqual(self.bootloader.received, fastbootproto.PACKET +
+                         4321)
+        self.assertEqual(self.client.flash('boot'), '')
+        self.assertEqual(self.messages, ['erasing before writing'])
+
+    def test_flash_fail(self):
+        self.configure(failures={self.serial: ['flash system']})
+        self.client.download(self.image(1000))
+        self.assertRaises(fastbootproto.FastbootError, self.client.flash,
+                          'system')
+        # the session goes on
+        self.assertEqual(self.client.flash('boot'), '')
+
+    def test_too_large(self):
+        path = self.image(64 * 1024 + 1)
+        self.assertRaises(fastbootproto.FastbootError, self.client.download,
+                          path)
+        self.assertEqual(self.bootloader.received, 0)
+
+    def test_getvar(self):
+        self.assertEqual(self.client.getvar('max-download-size'),
+                         '0x00010000')
+        self.configure(max_download_size=None)
+        self.assertRaises(fastbootproto.FastbootError, self.client.getvar,
+                          'max-download-size')
+
+
+class Session(FakeBootloaderTest):
+    '''command lines, printed as the fastboot program does'''
+
+    def test_flash(self):
+        path = self.image(5000)
+        session = self.session('flash', 'boot', path)
+        self.assertEqual(session.returncode, 0)
+        lines = session.output.splitlines()
+        self.assertTrue(lines[0].strip().startswith("sending 'boot' (4 KB)"))
+        self.assertTrue(lines[0].endswith('s]'))
+        # as fastboot prints them, after the phase waiting for its result
+        self.assertEqual(lines[1].strip(), "writing 'boot'... (bootloader) "
+                         'erasing before writing')
+        self.assertTrue(lines[2].startswith('OKAY ['))
+        self.assertTrue(lines[3].startswith('finished. total time:'))
+
+    def test_fail(self):
+        self.configure(failures={self.serial: ['flash boot']})
+        session = self.session('flash', 'boot', self.image(5000))
+        self.assertEqual(session.returncode, 1)
+        self.assertTrue('FAILED (remote: flash write failure)' in
+                        session.output)
+
+    def test_max_download_size(self):
+        # an image larger than the limit, sent as sparse images within it
+        data = ''.join(os.urandom(sparse.BLOCK_SIZE) + '\0' *
+                       sparse.BLOCK_SIZE for number in range(20))
+        path = os.path.join(self.home, 'system.img')
+        with open(path, 'wb') as out:
+            out.write(data)
+        self.assertEqual(self.session('flash', 'system',
+                                      path).returncode, 1)
+        limit = sparse.max_download_size(
+            self.session('getvar', 'max-download-size').output)
+        self.assertEqual(limit, 64 * 1024)
+        parts = sparse.convert(path, os.path.join(self.home), limit)
+        self.assertTrue(len(parts) > 1)
+        for part in parts:
+            self.assertEqual(self.session('flash', 'system',
+                                          part).returncode, 0)
+        self.assertEqual(self.bootloader.received,
+                         sum(os.path.getsize(part) for part in parts))
+
+    def test_unreachable(self):
+        self.bootloader.stop()
+        session = self.session('reboot')
+        self.assertEqual(session.returncode, 1)
+        self.assertTrue(session.output.startswith('error: cannot reach'))
+
+
+if __name__ == '__main__':
+    unittest.main()
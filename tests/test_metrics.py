@@ -0,0 +1,158 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+The metrics endpoint, scraped on localhost
+'''
+
+import os
+import re
+import sys
+import urllib2
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import metrics
+import tracing
+
+# name{labels} value, as Prometheus parses them
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+
+class Monitor(object):
+    '''states of the phones, as the device monitor gives them'''
+
+    def devices(self):
+        return {'A1': 'device', 'B2': 'fastboot', 'C3': 'fastboot'}
+
+
+class Scrape(unittest.TestCase):
+    '''spans of a tracer counted and served'''
+
+    def setUp(self):
+        self.registry = metrics.Metrics(Monitor())
+        self.tracer = tracing.Tracer()
+        self.tracer.subscribe(self.registry.span_ended)
+        self.server = metrics.MetricsServer(self.registry, 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def scrape(self, path='/metrics'):
+        response = urllib2.urlopen('http://127.0.0.1:%d%s' %
+                                   (self.server.port, path), timeout=5)
+        try:
+            self.assertEqual(response.info()['Content-Type'],
+                             metrics.CONTENT_TYPE)
+            return response.read()
+        finally:
+            response.close()
+
+    def samples(self, text):
+        '''name{labels} -> value'''
+        return dict((found.group(1) + (found.group(2) or ''), found.group(3))
+                    for found in map(SAMPLE.match, text.splitlines())
+                    if found)
+
+    def update(self, ok=True):
+        with self.tracer.start('phone update', 'step'):
+            with self.tracer.start('fastboot flash', serial='A1',
+                                   bytes=1000) as span:
+                span.phase('sending system', 2.5, 'OKAY')
+                if not ok:
+                    span.set(exit_code=1)
+
+    def test_format(self):
+        self.update()
+        text = self.scrape()
+        self.assertTrue(text.endswith('\n'))
+        described = set()
+        typed = {}
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                described.add(line.split()[2])
+            elif line.startswith('# TYPE '):
+                name, kind = line.split()[2:]
+                # described first, and typed once
+                self.assertTrue(name in described)
+                self.assertFalse(name in typed)
+                self.assertTrue(kind in ('counter', 'gauge', 'histogram'))
+                typed[name] = kind
+            else:
+                found = SAMPLE.match(line)
+                self.assertTrue(found, line)
+                name = found.group(1)
+                if name not in typed:
+                    name = re.sub('_(bucket|sum|count)$', '', name)
+                self.assertTrue(name in typed, line)
+                float(found.group(3))
+        self.assertEqual(typed['uniflasher_commands_total'], 'counter')
+        self.assertEqual(typed['uniflasher_command_seconds'], 'histogram')
+        self.assertEqual(typed['uniflasher_devices'], 'gauge')
+
+    def test_counters(self):
+        self.update()
+        self.update(False)
+        samples = self.samples(self.scrape())
+        self.assertEqual(samples['uniflasher_commands_total'
+                                 '{command="fastboot flash",outcome="ok"}'],
+                         '1')
+        self.assertEqual(samples['uniflasher_commands_total'
+                                 '{command="fastboot flash",'
+                                 'outcome="failed"}'], '1')
+        self.assertEqual(samples['uniflasher_phones_total'
+                                 '{outcome="updated"}'], '2')
+        # only the successful sending, with the time fastboot printed
+        self.assertEqual(samples['uniflasher_sent_bytes_total'
+                                 '{serial="A1"}'], '1000')
+        self.assertEqual(samples['uniflasher_sending_seconds_total'
+                                 '{serial="A1"}'], '2.5')
+        self.assertEqual(samples['uniflasher_command_seconds_bucket'
+                                 '{command="fastboot flash",le="0.1"}'], '2')
+        self.assertEqual(samples['uniflasher_command_seconds_bucket'
+                                 '{command="fastboot flash",le="+Inf"}'], '2')
+        self.assertEqual(samples['uniflasher_command_seconds_count'
+                                 '{command="fastboot flash"}'], '2')
+
+    def test_gauge(self):
+        samples = self.samples(self.scrape('/'))
+        self.assertEqual(samples['uniflasher_devices{state="fastboot"}'],
+                         '2')
+        self.assertEqual(samples['uniflasher_devices{state="device"}'], '1')
+
+    def test_not_found(self):
+        try:
+            self.scrape('/other')
+        except urllib2.HTTPError, error:
+            self.assertEqual(error.code, 404)
+        else:
+            self.fail('no error for another path')
+
+
+class Histogram(unittest.TestCase):
+    '''buckets of the observations'''
+
+    def test_buckets(self):
+        histogram = metrics.Histogram('seconds', 'durations', ('step',),
+                                      (1, 10))
+        for amount in (0.5, 1, 5, 60):
+            histogram.observe(('wipe',), amount)
+        self.assertEqual(histogram.samples(), [
+            'seconds_bucket{step="wipe",le="1"} 2',
+            'seconds_bucket{step="wipe",le="10"} 3',
+            'seconds_bucket{step="wipe",le="+Inf"} 4',
+            'seconds_sum{step="wipe"} 66.5',
+            'seconds_count{step="wipe"} 4'])
+
+    def test_escape(self):
+        self.assertEqual(metrics.labels(('path',), ('a"b\\c\n',)),
+                         r'{path="a\"b\\c\n"}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Progress of the operations from the output of fastboot
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import progress
+
+
+class NoHistory(object):
+    '''durations of an operation never run'''
+
+    def estimate(self, operation, size=0):
+        return None
+
+    def record(self, operation, size, duration, phases=()):
+        pass
+
+
+class Rate(unittest.TestCase):
+    '''throughput measured by fastboot, or estimated before'''
+
+    def setUp(self):
+        self.progress = progress.Progress('flash system', 4096 * 1024,
+                                          NoHistory())
+
+    def test_estimated(self):
+        self.assertEqual(self.progress.rate(), None)
+        self.assertTrue(self.progress.estimated_rate() is not None)
+        self.progress.feed("sending 'system' (4096 KB)... ")
+        # not over yet
+        self.assertEqual(self.progress.rate(), None)
+
+    def test_same_line(self):
+        self.progress.feed("sending 'system' (4096 KB)... OKAY [  2.000s]")
+        self.assertEqual(self.progress.rate(), 2048 * 1024)
+
+    def test_next_line(self):
+        # as the built-in client prints them
+        for line in ("       sending 'system' (2048 KB)... ",
+                     'OKAY [  1.000s]',
+                     "        writing 'system'... ", 'OKAY [  3.000s]',
+                     "sending sparse 'system' (2048 KB)... ",
+                     'OKAY [  3.000s]'):
+            self.progress.feed(line)
+        # the writing time is not counted
+        self.assertEqual(self.progress.rate(), 1024 * 1024)
+
+    def test_failed(self):
+        self.progress.feed("sending 'system' (4096 KB)... ")
+        self.progress.feed('FAILED (remote: data too large)')
+        self.progress.feed("        writing 'system'... OKAY [  3.000s]")
+        self.assertEqual(self.progress.rate(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Round trips of images through sparse images
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sparse
+
+BLOCK = sparse.BLOCK_SIZE
+
+def image(*runs):
+    '''image made of (kind, blocks) runs: raw data, zeros or a pattern'''
+    data = []
+    for kind, count in runs:
+        if kind == 'raw':
+            data.append(os.urandom(count * BLOCK))
+        elif kind == 'zero':
+            data.append('\0' * count * BLOCK)
+        else:
+            data.append(kind * (count * BLOCK // len(kind)))
+    return ''.join(data)
+
+def chunks(path):
+    '''chunk types of a sparse image'''
+    with open(path, 'rb') as sparsefile:
+        header = sparse.FILE_HEADER.unpack(
+            sparsefile.read(sparse.FILE_HEADER.size))
+        kinds = []
+        for number in range(header[7]):
+            kind, reserved, count, total = sparse.CHUNK_HEADER.unpack(
+                sparsefile.read(sparse.CHUNK_HEADER.size))
+            sparsefile.read(total - sparse.CHUNK_HEADER.size)
+            kinds.append(kind)
+    return kinds
+
+
+class RoundTrip(unittest.TestCase):
+    '''convert, split then expand give back the image'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='uniflasher-test')
+        self.path = os.path.join(self.directory, 'system.img')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def convert(self, data, max_size=None):
+        with open(self.path, 'wb') as out:
+            out.write(data)
+        return sparse.convert(self.path, self.directory, max_size)
+
+    def expand(self, paths, prefill=''):
+        out = StringIO(prefill)
+        for path in paths:
+            with open(path, 'rb') as sparsefile:
+                sparse.expand(sparsefile, out)
+        return out.getvalue()
+
+    def test_single(self):
+        data = image(('raw', 3), ('zero', 5), ('raw', 1), ('\xde\xad', 2))
+        paths = self.convert(data)
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(self.expand(paths), data)
+
+    def test_fill(self):
+        data = image(('zero', 4), ('\x01\x02\x03\x04', 3), ('raw', 1))
+        paths = self.convert(data)
+        self.assertEqual(chunks(paths[0]), [sparse.FILL, sparse.FILL,
+                                            sparse.RAW])
+        # much smaller than the image
+        self.assertTrue(os.path.getsize(paths[0]) < 2 * BLOCK)
+        self.assertEqual(self.expand(paths), data)
+
+    def test_split(self):
+        data = image(('raw', 5), ('zero', 10), ('raw', 7), ('ab', 3),
+                     ('raw', 2))
+        limit = 3 * BLOCK
+        paths = self.convert(data, limit)
+        self.assertTrue(len(paths) > 3)
+        for path in paths:
+            self.assertTrue(os.path.getsize(path) <= limit)
+            self.assertTrue(sparse.DONT_CARE in chunks(path))
+        self.assertEqual(self.expand(paths), data)
+
+    def test_dont_care(self):
+        # blocks left as DONT_CARE keep what was there
+        data = image(('raw', 2), ('raw', 2))
+        paths = self.convert(data, 2 * BLOCK + 64)
+        self.assertEqual(len(paths), 2)
+        before = image(('raw', 4))
+        expanded = self.expand(paths[:1], before)
+        self.assertEqual(expanded[:2 * BLOCK], data[:2 * BLOCK])
+        self.assertEqual(expanded[2 * BLOCK:], before[2 * BLOCK:])
+
+    def test_not_aligned(self):
+        data = image(('raw', 2), ('zero', 2)) + os.urandom(100)
+        for max_size in (None, 2 * BLOCK + 64):
+            expanded = self.expand(self.convert(data, max_size))
+            self.assertEqual(len(expanded), 5 * BLOCK)
+            self.assertEqual(expanded[:len(data)], data)
+            self.assertEqual(expanded[len(data):],
+                             '\0' * (5 * BLOCK - len(data)))
+
+    def test_short_image(self):
+        with open(self.path, 'wb') as out:
+            out.write(image(('raw', 2)))
+        with open(self.path, 'rb') as imgfile:
+            self.assertRaises(sparse.SparseError, sparse.scan, imgfile,
+                              3 * BLOCK)
+
+
+class Split(unittest.TestCase):
+    '''parts of the runs within the download limit'''
+
+    def test_cover(self):
+        runs = [(sparse.RAW, 0, 10, 0), (sparse.FILL, 10, 5, '\0' * 4)]
+        parts = sparse.split(runs, 20, 4 * BLOCK)
+        for part in parts:
+            self.assertEqual(part[0][1], 0)
+            self.assertEqual(sum(run[2] for run in part), 20)
+            self.assertTrue(sum(sparse.chunk_size(run) for run in part) +
+                            sparse.FILE_HEADER.size <= 4 * BLOCK)
+        raw = sorted((run[1], run[2], run[3]) for part in parts
+                     for run in part if run[0] == sparse.RAW)
+        # the raw run is cut at block boundaries, with its file offsets
+        self.assertEqual(sum(count for first, count, offset in raw), 10)
+        for first, count, offset in raw:
+            self.assertEqual(offset, first * BLOCK)
+
+    def test_too_small(self):
+        self.assertRaises(sparse.SparseError, sparse.split,
+                          [(sparse.RAW, 0, 1, 0)], 1, BLOCK)
+
+
+class Expand(unittest.TestCase):
+    '''invalid sparse images'''
+
+    def test_not_sparse(self):
+        self.assertRaises(sparse.SparseError, sparse.expand,
+                          StringIO('\0' * 64), StringIO())
+
+    def test_truncated(self):
+        header = sparse.FILE_HEADER.pack(
+            sparse.MAGIC, 1, 0, sparse.FILE_HEADER.size,
+            sparse.CHUNK_HEADER.size, BLOCK, 1, 1, 0)
+        chunk = sparse.CHUNK_HEADER.pack(sparse.RAW, 0, 1,
+                                         sparse.CHUNK_HEADER.size + BLOCK)
+        self.assertRaises(sparse.SparseError, sparse.expand,
+                          StringIO(header + chunk + 'x' * 100), StringIO())
+
+    def test_max_download_size(self):
+        self.assertEqual(sparse.max_download_size(
+            'max-download-size: 0x10000000\nfinished.'), 0x10000000)
+        self.assertEqual(sparse.max_download_size('finished.'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+USB topology read from a fabricated sysfs tree, and the hub scheduler
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import devicemonitor
+import usbtopo
+
+
+class Hubs(unittest.TestCase):
+    '''root ports of the phones'''
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp(prefix='uniflasher-test')
+
+    def tearDown(self):
+        shutil.rmtree(self.sysfs, True)
+
+    def device(self, name, **attributes):
+        directory = os.path.join(self.sysfs, name)
+        os.makedirs(directory)
+        for attribute, value in attributes.items():
+            with open(os.path.join(directory, attribute), 'w') as out:
+                out.write(value + '\n')
+
+    def test_nesting(self):
+        self.device('usb1', serial='0000:00:1d.0', bDeviceClass='09')
+        self.device('1-1', bDeviceClass='09')
+        self.device('1-1.4', serial='HUB4', bDeviceClass='09')
+        self.device('1-1.4.2', serial='A1', bDeviceClass='00')
+        self.device('1-1.4.2:1.0', serial='interface')
+        self.device('1-1.1', serial='B2', bDeviceClass='00')
+        self.device('2-3', serial='C3', bDeviceClass='00')
+        self.assertEqual(usbtopo.hubs(self.sysfs), {'A1': '1-1', 'B2': '1-1',
+                                                    'C3': '2-3'})
+
+    def test_missing_attributes(self):
+        # no serial: not a phone to flash
+        self.device('1-2', bDeviceClass='00')
+        # no class: taken for a phone
+        self.device('1-3', serial='D4')
+        self.device('3-1.2')
+        self.assertEqual(usbtopo.hubs(self.sysfs), {'D4': '1-3'})
+        self.assertEqual(devicemonitor._read_sysfs(
+            os.path.join(self.sysfs, '1-2', 'serial')), None)
+
+    def test_no_sysfs(self):
+        self.assertEqual(usbtopo.hubs(os.path.join(self.sysfs, 'missing')),
+                         None)
+        self.assertEqual(usbtopo.hubs(self.sysfs), {})
+
+    def test_link(self):
+        self.assertEqual(usbtopo.link('1-1.4.2'), '1-1')
+        self.assertEqual(usbtopo.link('2-3'), '2-3')
+
+
+class Scheduler(unittest.TestCase):
+    '''transfers behind each hub'''
+
+    def setUp(self):
+        self.scheduler = usbtopo.HubScheduler({'A1': '1-1', 'A2': '1-1',
+                                               'A3': '1-1', 'B1': '2-1'}, 2)
+
+    def test_order(self):
+        ordered = self.scheduler.order(['A1', 'A2', 'A3', 'B1', 'X'])
+        # the busiest hub first, then one phone of each hub in turn
+        self.assertEqual(ordered[0], 'A1')
+        self.assertEqual(sorted(ordered[1:3]), ['B1', 'X'])
+        self.assertEqual(ordered[3:], ['A2', 'A3'])
+
+    def test_capacity(self):
+        self.assertEqual(self.scheduler.capacity(['A1', 'A2', 'A3', 'B1',
+                                                  'X', 'Y']), 5)
+
+    def test_transfer(self):
+        started = []
+        release = threading.Event()
+
+        def transfer(serial):
+            with self.scheduler.transfer(serial):
+                started.append(serial)
+                release.wait()
+        threads = [threading.Thread(target=transfer, args=(serial,))
+                   for serial in ('A1', 'A2', 'A3', 'X')]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        while len(started) < 3:
+            threads[0].join(0.01)
+        threads[0].join(0.1)
+        # the third phone of the hub waits for a slot
+        self.assertEqual(len(started), 3)
+        self.assertTrue('X' in started)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(started), ['A1', 'A2', 'A3', 'X'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Timing trace of the adb and fastboot commands and of the flashing steps
+
+Every command and step gets a span holding its device, image, bytes,
+exit code and the timings of the phases fastboot prints (sending 'boot'
+(2048 KB)... OKAY [  0.750s]).  The last spans are kept in memory and
+can be streamed to a JSON lines file or given to subscribers (see
+metrics) as they end; both can be exported in the Chrome trace format,
+for chrome://tracing or Perfetto, with one lane per device:
+
+    python tracing.py trace.jsonl trace.json
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import collections
+
+import outparse
+from runner import monotonic
+
+# spans kept in memory
+KEEP = 10000
+
+class Span(object):
+    '''a timed command or step, ended by end() or at the end of a with'''
+
+    def __init__(self, tracer, number, name, kind, parent, attributes):
+        self.tracer = tracer
+        self.id = number
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes = attributes
+        self.phases = []
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.started = monotonic()
+        self.duration = None
+
+    def set(self, **attributes):
+        '''add or change attributes'''
+        self.attributes.update(attributes)
+
+    def phase(self, name, duration=None, status=None):
+        '''record a sub-phase ending now, lasting duration seconds'''
+        offset = monotonic() - self.started
+        if duration is not None:
+            offset = max(offset - duration, 0)
+        self.phases.append({'name': name, 'start': offset,
+                            'duration': duration, 'status': status})
+
+    def end(self, **attributes):
+        '''end the span, once'''
+        if self.duration is None:
+            self.attributes.update(attributes)
+            self.duration = monotonic() - self.started
+            self.tracer._finished(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if error is not None:
+            self.set(error=str(error) or kind.__name__)
+        self.end()
+
+    def record(self):
+        '''the span as a dictionary, as written in JSON lines files'''
+        return {'id': self.id, 'parent': self.parent, 'name': self.name,
+                'kind': self.kind, 'thread': self.thread,
+                'start': self.start, 'duration': self.duration,
+                'attributes': self.attributes, 'phases': self.phases}
+
+
+def fastboot_phases(span):
+    '''outparse subscriber recording in a span the timings fastboot prints
+
+    fastboot prints the name of a phase, then OKAY and its duration once
+    it is over, on the same line or on the next one'''
+    def record(event):
+        if event.kind in (outparse.OKAY, outparse.FAILED) and event.name:
+            span.phase(event.name, event.duration, event.kind.upper())
+    return record
+
+
+class Tracer(object):
+    '''records the spans of all threads
+
+    spans started in a thread are children of the span currently open in
+    that thread, unless a parent is given'''
+
+    def __init__(self, keep=KEEP):
+        self._spans = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._count = 0
+        self._out = None
+        self._subscribers = []
+
+    def start(self, name, kind='command', parent=None, **attributes):
+        '''open a span in the current thread'''
+        stack = self._stack()
+        if parent is None and stack:
+            parent = stack[-1].id
+        with self._lock:
+            self._count += 1
+            number = self._count
+        span = Span(self, number, name, kind, parent, attributes)
+        stack.append(span)
+        return span
+
+    def current(self):
+        '''id of the span open in the current thread, or None'''
+        stack = self._stack()
+        return stack and stack[-1].id or None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _finished(self, span):
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        record = span.record()
+        with self._lock:
+            self._spans.append(record)
+            if self._out:
+                try:
+                    self._out.write(json.dumps(record) + '\n')
+                    self._out.flush()
+                except (IOError, ValueError), error:
+                    print >> sys.stderr, 'Cannot write the trace :', error
+                    self._out = None
+        for callback in self._subscribers:
+            try:
+                callback(record)
+            except Exception, error:
+                print >> sys.stderr, 'Error in span subscriber :', error
+
+    def subscribe(self, callback):
+        '''call callback(record) for each span as it ends'''
+        self._subscribers.append(callback)
+
+    def stream(self, path):
+        '''also append the spans to a JSON lines file as they end'''
+        out = open(path, 'a')
+        with self._lock:
+            previous, self._out = self._out, out
+        if previous:
+            previous.close()
+
+    def close(self):
+        '''stop streaming'''
+        with self._lock:
+            out, self._out = self._out, None
+        if out:
+            out.close()
+
+    def spans(self):
+        '''records of the spans kept in memory, in the order they ended'''
+        with self._lock:
+            return list(self._spans)
+
+tracer = Tracer()
+
+def traced(name):
+    '''decorator tracing a method of an object which may have a serial'''
+    def decorate(method):
+        def wrapper(self, *args, **kwargs):
+            with tracer.start(name, 'step',
+                              serial=getattr(self, 'serial', None),
+                              args=[str(arg) for arg in args]) as span:
+                result = method(self, *args, **kwargs)
+                span.set(ok=bool(result))
+                return result
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorate
+
+def command_span(args):
+    '''open the span of an adb or fastboot command line'''
+    words = list(args[1:])
+    attributes = {'args': list(words)}
+    if '-s' in words[:-1]:
+        index = words.index('-s')
+        attributes['serial'] = words[index + 1]
+        del words[index:index + 2]
+    name = os.path.basename(args[0])
+    if words:
+        name += ' ' + words[0]
+    if len(words) > 1 and os.path.isfile(words[-1]):
+        attributes['image'] = words[-1]
+        attributes['bytes'] = os.path.getsize(words[-1])
+    return tracer.start(name, **attributes)
+
+def read_jsonl(path):
+    '''records of a JSON lines trace file'''
+    records = []
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+def write_jsonl(records, path):
+    '''write records as a JSON lines file'''
+    with open(path, 'w') as out:
+        for record in records:
+            out.write(json.dumps(record) + '\n')
+
+def chrome_trace(records):
+    '''records in the Chrome trace event format
+
+    each device (or thread, without a device) is a lane; phases are
+    nested in their command'''
+    events = []
+    lanes = {}
+    origin = records and min(record['start'] for record in records) or 0
+    for record in records:
+        lane = record['attributes'].get('serial') or record['thread']
+        if lane not in lanes:
+            lanes[lane] = len(lanes) + 1
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                           'tid': lanes[lane], 'args': {'name': lane}})
+        start = (record['start'] - origin) * 1e6
+        events.append({'name': record['name'], 'cat': record['kind'],
+                       'ph': 'X', 'pid': 1, 'tid': lanes[lane], 'ts': start,
+                       'dur': (record['duration'] or 0) * 1e6,
+                       'args': record['attributes']})
+        for phase in record['phases']:
+            events.append({'name': phase['name'], 'cat': 'phase', 'ph': 'X',
+                           'pid': 1, 'tid': lanes[lane],
+                           'ts': start + phase['start'] * 1e6,
+                           'dur': (phase['duration'] or 0) * 1e6,
+                           'args': {'status': phase['status']}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(records, path):
+    '''write records as a Chrome trace file'''
+    with open(path, 'w') as out:
+        json.dump(chrome_trace(records), out)
+
+def save(records, path):
+    '''JSON lines for .jsonl files, Chrome trace format otherwise'''
+    if path.endswith('.jsonl'):
+        write_jsonl(records, path)
+    else:
+        write_chrome_trace(records, path)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print >> sys.stderr, 'usage: tracing.py trace.jsonl trace.json'
+        sys.exit(2)
+    write_chrome_trace(read_jsonl(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,141 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Copies of files to the sdcard of a phone which survive slow cables
+
+A file already on the phone with the same size and MD5 is not sent again.
+Others are sent by segments through the adb sync service and appended on
+the phone to a .part file, renamed once complete and checked: when a
+transfer is interrupted, the next one checks the MD5 of the .part file
+and goes on from its end.  Instead of a fixed timeout, a transfer is
+given a few times what it should take at the throughput measured by the
+previous ones, and the throughput of every transfer is reported, so that
+slow ports and cables stand out.
+'''
+
+import os
+import sys
+import hashlib
+
+import adbclient
+import partitions
+import progress
+import tracing
+from runner import monotonic
+
+# bytes sent at once then appended to the .part file
+SEGMENT = 8 * 1024 * 1024
+# timeout of a transfer, against its expected duration
+SLACK = 3
+MIN_TIMEOUT = 30
+# below that many bytes per second, the cable or port is suspect
+SLOW_RATE = 1024 * 1024
+
+class TransferError(Exception):
+    '''the file could not be copied'''
+
+
+def md5_prefix(path, length):
+    '''MD5 of the first length bytes of a file'''
+    md5 = hashlib.md5()
+    with open(path, 'rb') as source:
+        while length > 0:
+            data = source.read(min(length, SEGMENT))
+            if not data:
+                break
+            md5.update(data)
+            length -= len(data)
+    return md5.hexdigest()
+
+def device_md5(client, serial, path):
+    '''MD5 of a file of the phone, None if it cannot be computed'''
+    found = partitions.MD5.search(client.shell(serial,
+                                               "md5sum '%s'" % path))
+    return found and found.group(1)
+
+def timeout(size):
+    '''seconds a transfer of size bytes is given'''
+    rate = progress.history().rate('push') or progress.DEFAULT_RATE
+    return MIN_TIMEOUT + SLACK * float(size) / rate
+
+def push(client, serial, local, remote, report=None):
+    '''copy a file to the phone, unless it is already there
+
+    report(sent, size, rate) is called after each segment.  Return the
+    throughput in bytes per second, None if nothing was sent'''
+    with tracing.tracer.start('push', serial=serial, image=local,
+                              bytes=os.path.getsize(local)) as span:
+        try:
+            rate = send(client, serial, local, remote, span, report)
+        except adbclient.AdbError, error:
+            raise TransferError(str(error))
+        span.set(rate=rate)
+        return rate
+
+def send(client, serial, local, remote, span, report=None):
+    '''body of push'''
+    size = os.path.getsize(local)
+    md5 = md5_prefix(local, size)
+    part = remote + '.part'
+    segment = remote + '.segment'
+    sync = client.sync(serial)
+    try:
+        info = sync.stat(remote)
+        if info and info[1] == size and \
+           device_md5(client, serial, remote) == md5:
+            print >> sys.stderr, os.path.basename(local), \
+                    'is already on', serial
+            span.set(skipped=True)
+            return None
+        info = sync.stat(part)
+        resumed = 0
+        if info and 0 < info[1] <= size and \
+           device_md5(client, serial, part) == md5_prefix(local, info[1]):
+            resumed = info[1]
+            print >> sys.stderr, 'Resuming the copy of', \
+                    os.path.basename(local), 'after', \
+                    progress.format_size(resumed)
+        elif info:
+            client.shell(serial, "rm '%s'" % part)
+        span.set(resumed=resumed)
+        if not size:
+            sync.push(part, [])
+        sent = resumed
+        started = monotonic()
+        deadline = started + timeout(size - resumed)
+        with open(local, 'rb') as source:
+            source.seek(sent)
+            while sent < size:
+                if monotonic() > deadline:
+                    raise TransferError('timed out after %s, copy it again '
+                                        'to resume' %
+                                        progress.format_size(sent))
+                data = source.read(SEGMENT)
+                sync.push(segment, [data])
+                output = client.shell(serial, "cat '%s' >> '%s' && rm '%s'"
+                                      % (segment, part, segment))
+                if output.strip():
+                    raise TransferError(output.strip())
+                sent += len(data)
+                if report:
+                    report(sent, size, (sent - resumed) /
+                           max(monotonic() - started, 0.001))
+    finally:
+        sync.close()
+    duration = max(monotonic() - started, 0.001)
+    rate = (size - resumed) / duration
+    output = client.shell(serial, "mv '%s' '%s'" % (part, remote))
+    if output.strip():
+        raise TransferError(output.strip())
+    if device_md5(client, serial, remote) != md5:
+        raise TransferError('%s was corrupted on its way' % remote)
+    progress.history().record('push', size - resumed, duration)
+    print >> sys.stderr, '%s copied to %s: %s in %.1f s, %s/s%s' % (
+        os.path.basename(local), serial,
+        progress.format_size(size - resumed), duration,
+        progress.format_size(rate),
+        rate < SLOW_RATE and ' (slow port or cable?)' or '')
+    return rate
@@ -8,15 +8,31 @@
 
 A platform-independent automatic flasher for the OpenEtna images
 for the LG Eve GW620
+
+Operations run in a pool of worker threads, one at a time per phone, so
+that the window never waits for a phone; the dashboard shows every phone
+and what is being done on it.  Buttons act on the phones selected in the
+dashboard, or on the only phone connected.  With UNIFLASHER_METRICS_PORT
+set, the throughput of the station is served to Prometheus, see metrics.
 '''
 
 import wx
 import os
 import sys
-import subprocess
 import time
 import webbrowser
 
+import dashboard
+import flasher
+import logcat
+import metrics
+import progress
+import tracing
+import workers
+
+# milliseconds between two refreshes of the dashboard
+REFRESH = 500
+
 class MainWindow(wx.Frame):
     '''Main window of the OpenEtna flasher
 
@@ -38,33 +54,16 @@ class MainWindow(wx.Frame):
     def __init__(self):
         '''Perform initialization and launch main window'''
 
-        if os.name == 'nt':
-            self.osname = 'Windows'
-            sdkpath = 'android-sdk-windows'
-        else:
-            # Linux on linux boxes Darwin on MacOS
-            self.osname = os.uname()[0]
-            sdkpath = 'android-sdk-' \
-                    + {'Darwin': 'mac', 'Linux': 'linux'}[self.osname] \
-                    + '_x86'
-
-        if __file__:
-            curpath = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
-        else:
-            curpath = os.getcwd()
-
-        sdkpath = os.path.join(curpath, sdkpath)
-        imgpath = os.path.join(curpath, 'imgs')
+        self.flasher = flasher.Flasher(ui=self)
+        self.osname = self.flasher.osname
+        flasher.progress_display = dashboard.HiddenProgress
+        self.workers = workers.WorkerPool()
+        self._shown = []
 
-        self.adb = os.path.join(sdkpath, 'adb')
-        self.fastboot = os.path.join(sdkpath, 'fastboot')
+        imgpath = os.path.join(self.flasher.curpath, 'imgs')
 
         self.lastdir = ''
 
-        self.bootimg = ''
-        self.systemimg = ''
-        self.gapps = ''
-
         wx.Frame.__init__(self, None, title='Hello ' + self.osname,
                           size=(500, 300))
 
@@ -91,6 +90,10 @@ class MainWindow(wx.Frame):
                                     'Get &Google Apps',
                                     'Open the OpenEtna download page' +
                                     ' in a browser')
+        menutrace = filemenu.Append(wx.ID_ANY,
+                                    'Save timing &trace',
+                                    'Save the timings of the commands' +
+                                    ' run so far')
 
         # Creating the menubar.
         menubar = wx.MenuBar()
@@ -105,6 +108,7 @@ class MainWindow(wx.Frame):
         self.Bind(wx.EVT_MENU, self.on_forum, menuforum)
         self.Bind(wx.EVT_MENU, self.on_getoe, menugetoe)
         self.Bind(wx.EVT_MENU, self.on_getga, menugetga)
+        self.Bind(wx.EVT_MENU, self.on_trace, menutrace)
 
         # Window contents
         mainsizer = wx.BoxSizer(wx.VERTICAL)
@@ -143,6 +147,14 @@ class MainWindow(wx.Frame):
         self.wipebtn = wx.Button(self, label='wipe')
         self.Bind(wx.EVT_BUTTON, self.on_wipe, self.wipebtn)
         bottomsizer.Add(self.wipebtn, pos=(2, 0))
+        self.fleetbtn = wx.Button(self, label='Update all phones with wipe')
+        self.Bind(wx.EVT_BUTTON, self.on_fleet, self.fleetbtn)
+        bottomsizer.Add(self.fleetbtn, pos=(2, 3))
+        self.update_changedbtn = wx.Button(self,
+                                           label='Update changed partitions')
+        self.Bind(wx.EVT_BUTTON, self.on_update_changed,
+                  self.update_changedbtn)
+        bottomsizer.Add(self.update_changedbtn, pos=(3, 3))
 
         self.backupbtn = wx.Button(self, label='Backup Phone')
         self.Bind(wx.EVT_BUTTON, self.on_backup, self.backupbtn)
@@ -152,6 +164,14 @@ class MainWindow(wx.Frame):
         self.Bind(wx.EVT_BUTTON, self.on_restore, self.retorebtn)
         bottomsizer.Add(self.retorebtn, pos=(3, 1))
 
+        self.pullbtn = wx.Button(self, label='Copy last backup here')
+        self.Bind(wx.EVT_BUTTON, self.on_pull, self.pullbtn)
+        bottomsizer.Add(self.pullbtn, pos=(3, 2))
+
+        self.hostrestorebtn = wx.Button(self, label='Restore from here')
+        self.Bind(wx.EVT_BUTTON, self.on_host_restore, self.hostrestorebtn)
+        bottomsizer.Add(self.hostrestorebtn, pos=(4, 2))
+
         self.logcatbtn = wx.Button(self, label='ADB Logcat')
         self.Bind(wx.EVT_BUTTON, self.on_logcat, self.logcatbtn)
         bottomsizer.Add(self.logcatbtn, pos=(4, 0))
@@ -189,7 +209,32 @@ class MainWindow(wx.Frame):
 
         mainsizer.AddSpacer(10)
 
+        self.board = wx.ListCtrl(self, style=wx.LC_REPORT, size=(600, 150))
+        for column, (title, width) in enumerate((('Phone', 140),
+                                                 ('State', 80),
+                                                 ('Step', 220),
+                                                 ('Speed', 90),
+                                                 ('Time left', 70))):
+            self.board.InsertColumn(column, title, width=width)
+        mainsizer.Add(self.board, flag=wx.EXPAND | wx.LEFT | wx.RIGHT,
+                      border=10)
+        self.stopbtn = wx.Button(self, label='Stop selected phones')
+        self.Bind(wx.EVT_BUTTON, self.on_stop, self.stopbtn)
+        mainsizer.Add(self.stopbtn, flag=wx.ALIGN_RIGHT | wx.ALL, border=10)
+
         self.SetSizerAndFit(mainsizer)
+        self.CreateStatusBar()
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(REFRESH)
+
+        self.flasher.monitor.subscribe(self._on_device_event)
+        self.flasher.monitor.subscribe(dashboard.dashboard.device_event)
+        if os.environ.get('UNIFLASHER_METRICS_PORT'):
+            metrics.start(int(os.environ['UNIFLASHER_METRICS_PORT']),
+                          monitor=self.flasher.monitor)
+        self.flasher.start()
 
         self.Show()
 
@@ -205,9 +250,15 @@ class MainWindow(wx.Frame):
         dlg.ShowModal()
         dlg.Destroy()
 
+    def notify(self, message, title, warning=False):
+        '''tell something to the user, for the flasher'''
+        self._ok_dialog(message, title, warning and wx.ICON_EXCLAMATION or 0)
+
     def on_quit(self, event):
         '''Quit nicely'''
-        self._kill_server()
+        self.timer.Stop()
+        self.flasher.stop()
+        self.flasher.kill_server()
         self.Close(True)
 
     def on_oe(self, event):
@@ -226,22 +277,56 @@ class MainWindow(wx.Frame):
         '''Get latest mdpi gapps file through browser'''
         webbrowser.open('http://goo-inside.me/gapps/latest/6/tiny/')
 
+    def on_trace(self, event):
+        '''Save the timing trace, for chrome://tracing or as JSON lines'''
+        default = time.strftime('trace_%Y%m%d%H%M%S.json', time.localtime())
+        dlg = wx.FileDialog(self, 'Choose a file to save the trace',
+                            self.lastdir,
+                            defaultFile=default,
+                            wildcard='Chrome trace (*.json)|*.json|' +
+                            'JSON lines (*.jsonl)|*.jsonl',
+                            style=wx.SAVE | wx.OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.lastdir = dlg.GetDirectory()
+            path = os.path.join(self.lastdir, dlg.GetFilename())
+            try:
+                tracing.save(tracing.tracer.spans(), path)
+            except (IOError, OSError), error:
+                self._ok_dialog(str(error), 'Cannot save the trace',
+                                wx.ICON_EXCLAMATION)
+        dlg.Destroy()
+
     def on_boot(self, event):
         '''Select boot.img'''
-        self.bootimg = self._get_img_file(self.bootimg) or self.bootimg
-        self.bootctrl.SetValue(self.bootimg)
+        bootimg = self._get_img_file(self.flasher.bootimg) or \
+                self.flasher.bootimg
+        self.flasher.bootimg = bootimg
+        self.bootctrl.SetValue(bootimg)
+        bootimg and self.flasher.images.submit(bootimg, 'boot')
 
     def on_system(self, event):
         '''Select system.img'''
-        self.systemimg = self._get_img_file(self.systemimg) or self.systemimg
-        self.systemctrl.SetValue(self.systemimg)
+        systemimg = self._get_img_file(self.flasher.systemimg) or \
+                self.flasher.systemimg
+        self.flasher.systemimg = systemimg
+        self.systemctrl.SetValue(systemimg)
+        systemimg and self.flasher.images.submit(systemimg, 'system')
+
+    def _ask_images(self):
+        '''select the images which are not selected yet'''
+        if not self.flasher.bootimg:
+            self.on_boot(None)
+        if not self.flasher.systemimg:
+            self.on_system(None)
+        return self.flasher.bootimg and self.flasher.systemimg
 
     def _get_img_file(self, default):
         '''Select and return an img file'''
         filename = ''
         dlg = wx.FileDialog(self, 'Choose a file', self.lastdir,
                             defaultFile=os.path.split(default)[1],
-                            wildcard='*.img',
+                            wildcard='Images (*.img, *.img.gz, *.img.xz, ' +
+                            '*.zip)|*.img;*.img.gz;*.img.xz;*.zip',
                             style=wx.OPEN)
         if dlg.ShowModal() == wx.ID_OK:
             filename = dlg.GetFilename()
@@ -251,251 +336,201 @@ class MainWindow(wx.Frame):
 
     def on_devices(self, event):
         '''check if some device is connected and found by adb'''
-        self._devices()
+        self.flasher.devices()
 
-    def _devices(self):
-        '''check if some device is connected and found by adb'''
-        # If adb doesn't find the device on a mac ->
-        # http://www.zacpod.com/p/157
-        # /System/Library/Extensions/IOUSBFamily.kext/Contents/PlugIns/IOUSBCompositeDriver.kext/Contents/
-        result = do_and_log([self.adb, 'devices'])
-        if result.find('recovery') >= 0:
-            print >> sys.stderr, "The device is in recovery mode"
-            found = True
+    def _on_device_event(self, serial, state, previous):
+        '''called from the device monitor thread at each change'''
+        wx.CallAfter(self._show_device_event, serial, state)
+
+    def _show_device_event(self, serial, state):
+        if state:
+            self.SetStatusText('%s entered %s mode' % (serial, state))
         else:
-            print >> sys.stderr, "No device in recovery mode"
-            found = False
-        # self.ckbx_adb_ready.SetValue(found)
-        return found
+            self.SetStatusText('%s disconnected' % serial)
+        self.ckbx_adb_ready.SetValue('recovery' in
+                                     self.flasher.device_states())
+
+    def on_timer(self, event):
+        '''show the rows of the dashboard, keeping the selection'''
+        rows = dashboard.dashboard.rows()
+        serials = [row['serial'] for row in rows]
+        if serials != self._shown:
+            selected = self._selected()
+            self.board.DeleteAllItems()
+            for index, serial in enumerate(serials):
+                self.board.InsertStringItem(index, serial)
+                if serial in selected:
+                    self.board.Select(index)
+            self._shown = serials
+        for index, row in enumerate(rows):
+            for column, text in enumerate(row_texts(row)):
+                if column and self.board.GetItem(index,
+                                                 column).GetText() != text:
+                    self.board.SetStringItem(index, column, text)
+
+    def _selected(self):
+        '''serials selected in the dashboard'''
+        serials = []
+        index = self.board.GetFirstSelected()
+        while index != -1:
+            serials.append(self.board.GetItemText(index))
+            index = self.board.GetNextSelected(index)
+        return serials
+
+    def _targets(self):
+        '''phones the buttons act on: the selected ones, or the only one
+        connected; [None] lets the flasher tell there is no phone'''
+        selected = self._selected()
+        if selected:
+            return selected
+        serials = [serial for serial in self.flasher.monitor.devices()
+                   if serial != '?']
+        return len(serials) == 1 and serials or [None]
+
+    def _submit(self, label, name, *args):
+        '''run a method of the flasher on the target phones, in workers'''
+        for serial in self._targets():
+            device = flasher.Flasher(WorkerUI(self, serial), serial,
+                                     self.flasher)
+            self._start(serial, label, getattr(device, name), *args)
+
+    def _start(self, serial, label, operation, *args):
+        '''run an operation in a worker, unless the phone is busy'''
+        if not self.workers.submit(serial or 'phone', self._work, serial,
+                                   label, operation, args):
+            self.SetStatusText('%s is busy' % (serial or 'The phone'))
+
+    def _work(self, serial, label, operation, args):
+        '''body of the workers, showing the operation in the dashboard'''
+        if serial:
+            dashboard.dashboard.start(serial, label)
+        ok = False
+        try:
+            ok = operation(*args)
+        finally:
+            outcome = label + (ok and ' done' or ' failed')
+            if serial:
+                dashboard.dashboard.finish(serial, outcome)
+            wx.CallAfter(self.SetStatusText, (serial and serial + ': ' or '')
+                         + outcome)
+
+    def on_stop(self, event):
+        '''stop the command running on the selected phones'''
+        for serial in self._selected():
+            dashboard.dashboard.cancel(serial)
 
     def on_fbdevices(self, event):
         '''check if some device is connected and found by fastboot'''
-        self._fbdevices()
-
-    def _fbdevices(self):
-        '''check if some device is connected and found by fastboot'''
-        result = do_and_log([self.fastboot, 'devices'])
-        if result.find('?\tfastboot') >= 0:
-            print >> sys.stderr, "The device is in fastboot mode"
-            found = True
-        else:
-            print >> sys.stderr, "No device in fastboot"
-            found = False
-        # self.ckbx_fastb_ready.SetValue(found)
-        return found
+        self.flasher.fbdevices()
 
     def on_wipe(self, event):
         '''wipe device'''
-        self._wipe()
-
-    def _wipe(self):
-        '''wipe device'''
-        if self.osname == 'XWindows':
-            expectedlines = 3
-        else:
-            expectedlines = 2
-        if self._fbdevices():
-            return print_and_log([self.fastboot, '-w'], progress=expectedlines)
-        else:
-            self._ok_dialog('You must connect your phone in fastboot mode' +
-                            ' first', 'No device in fastboot',
-                            wx.ICON_EXCLAMATION)
-            return False
+        self._submit('wipe', 'wipe')
 
     def on_reboot(self, event):
         '''reboot adb device'''
-        self._reboot()
-
-    def _reboot(self):
-        '''reboot device'''
-        return print_and_log([self.adb, 'shell', 'reboot']) or \
-                print_and_log([self.adb, 'reboot'])
+        self._submit('reboot', 'reboot')
 
     def on_flashboot(self, event):
         '''flash boot'''
-        self._flash('boot', self.bootimg)
-        if not self.bootimg:
+        if not self.flasher.bootimg:
             self.on_boot(event)
-            self.bootimg and self._flash('boot', self.bootimg)
+        self._submit('flash boot', 'flash', 'boot', self.flasher.bootimg)
 
     def on_flashsystem(self, event):
         '''flash system'''
-        self._flash('system', self.systemimg)
-        if not self.systemimg:
+        if not self.flasher.systemimg:
             self.on_system(event)
-            self.systemimg and self._flash('system', self.systemimg)
-
-    def _flash(self, partition, imgfile):
-        '''flash some image to the given partition on device'''
-        if self.osname == 'XWindows':
-            expectedlines = 3
-        else:
-            expectedlines = 2
-        if not imgfile:
-            self._ok_dialog('You need to select a ' + partition +
-                            ' image first',
-                            'Missing '+ partition +'.img',
-                            wx.ICON_EXCLAMATION)
-            return False
-        if self._fbdevices():
-            return print_and_log([self.fastboot, 'flash', partition, imgfile],
-                                 progress=expectedlines)
-        else:
-            self._ok_dialog('You must put your phone in fastboot mode' +
-                            ' first', 'No device in fastboot',
-                            wx.ICON_EXCLAMATION)
-            return False
+        self._submit('flash system', 'flash', 'system',
+                     self.flasher.systemimg)
 
     def on_recovery(self, event):
         '''Launch recovery on device'''
-        self._recovery()
-
-    def _recovery(self):
-        '''fastboot boot everarecovery.img'''
-        if self.osname == 'XWindows':
-            expectedlines = 3
-        else:
-            expectedlines = 2
-        if self._fbdevices():
-            ok = print_and_log([self.fastboot, 'boot',
-                                os.path.join('imgs', 'everarecovery.img')],
-                               progress=expectedlines)
-            # since wait-for-device won't work in recovery
-            # actively poll device status
-            elapsed = 0
-            dialog = wx.ProgressDialog('Waiting for device',
-                                       'Device is not in recovery ' +
-                                       'mode yet...',
-                                       style = wx.PD_APP_MODAL |
-                                       wx.PD_SMOOTH |
-                                       wx.PD_AUTO_HIDE )
-            dialog.Pulse('')
-            while elapsed < 10:
-                ok = do_and_log([self.adb, 'devices']).find('recovery') >= 0
-                if ok:
-                    break
-                time.sleep(1)
-                elapsed += 1
-                dialog.UpdatePulse()
-            dialog.Destroy()
-            return ok
-        else:
-            self._ok_dialog('You must connect your phone in fastboot mode' +
-                            ' first', 'No device in fastboot',
-                            wx.ICON_EXCLAMATION)
-            return False
+        self._submit('recovery', 'recovery')
 
     def on_update_w_wipe(self, event):
         '''Update boot and system with wipe'''
-        self._flash_openetna()
-
-    def _flash_openetna(self):
-        '''very basic OpenEtna flash, adapted from OpenEtnaflash.bat'''
-        return self._wipe() and \
-                self._flash_openetna_wo_wipe()
+        self._ask_images() and self._submit('update with wipe',
+                                            'flash_openetna')
 
     def on_update_wo_wipe(self, event):
         '''Update boot and system with wipe'''
-        self._flash_openetna_wo_wipe()
-
-    def _flash_openetna_wo_wipe(self):
-        '''very basic OpenEtna flash without wipe'''
-        self.on_flashboot(None)
-        if not self.bootimg:
-            return False
-        self.on_flashsystem(None)
-        if not self.systemimg:
-            return False
-        self._ok_dialog('You can now manually switch off your phone ' +
-                        'and restart it. This can take a long time ' +
-                        '(up to 10 minutes).', 'Reboot')
-        return True
-
-    def _wait_for_device(self):
-        '''ask adb to wait for the device to be ready
-
-        will not work for recovery, only "normal" device'''
-        return print_and_log([self.adb, 'wait-for-device'])
+        self._ask_images() and self._submit('update without wipe',
+                                            'flash_openetna_wo_wipe')
 
-    def on_backup(self, event):
-        '''start backup on SDCard'''
-        self._simple_backup()
+    def on_update_changed(self, event):
+        '''Update only the partitions which differ from the images'''
+        self._ask_images() and self._submit('update changed partitions',
+                                            'flash_changed')
 
-    def _nandroid_backup(self):
-        '''launch nandroid backup on device (#duration : about 160s)
+    def on_fleet(self, event):
+        '''Update boot and system with wipe on all phones at once'''
+        if self._ask_images():
+            device = flasher.Flasher(WorkerUI(self, None), None,
+                                     self.flasher)
+            self._start(None, 'fleet update', device.flash_fleet)
 
-        adb shell nandroid-mobile.sh -b --norecovery --nomisc --nosplash1
-            --nosplash2 --defaultinput --autoreboot'''
-        if self.osname == 'XWindows':
-            expectedlines = 44
-        else:
-            expectedlines = 18
-        return print_and_log([self.adb, 'shell', 'nandroid-mobile.sh', '-b',
-                              '--norecovery', '--nomisc', '--nosplash1',
-                              '--nosplash2', '--defaultinput',
-                              '--autoreboot'], progress=expectedlines)
+    def on_backup(self, event):
+        '''start backup on SDCard'''
+        self._submit('backup', 'simple_backup')
 
     def on_restore(self, event):
         '''start restore from SDCard'''
-        self._nandroid_restore()
-
-    def _nandroid_restore(self):
-        '''launch nandroid on device
-
-        adb shell nandroid-mobile.sh -r --defaultinput'''
-        if self.osname == 'XWindows':
-            expectedlines = 88
-        else:
-            expectedlines = 25
-        return self._recovery() and \
-                print_and_log([self.adb, 'shell', 'nandroid-mobile.sh',
-                               '-r', '--defaultinput'],
-                              progress=expectedlines) and \
-                print_and_log([self.adb, 'shell', 'reboot'], progress=0)
-
-    def _simple_backup(self):
-        '''very basic backup, adapted from simplebackup.bat'''
-        return self._recovery() and \
-                self._nandroid_backup()
+        self._submit('restore', 'nandroid_restore')
+
+    def on_pull(self, event):
+        '''copy the last backup on SDCard to this computer'''
+        self._submit('copy backup here', 'pull_backup')
+
+    def on_host_restore(self, event):
+        '''restore a backup kept on this computer'''
+        serial = self._targets()[0]
+        if serial is None:
+            self.notify('Connect your phone in fastboot mode first',
+                        'No device in fastboot', True)
+            return
+        dates = self.flasher.backups.backups(serial)
+        if not dates:
+            self.notify('There is no backup of ' + serial +
+                        ' on this computer', 'Backup not found', True)
+            return
+        dlg = wx.SingleChoiceDialog(self, 'Backup to restore',
+                                    'Backups of ' + serial,
+                                    list(reversed(dates)))
+        date = dlg.ShowModal() == wx.ID_OK and dlg.GetStringSelection()
+        dlg.Destroy()
+        if date:
+            device = flasher.Flasher(WorkerUI(self, serial), serial,
+                                     self.flasher)
+            self._start(serial, 'restore from here',
+                        device.restore_from_host, serial, date)
 
     def on_gapps(self, event):
         '''Select the gapps file'''
         dlg = wx.FileDialog(self, 'Choose a file', self.lastdir,
-                            defaultFile=os.path.split(self.gapps)[1],
+                            defaultFile=os.path.split(self.flasher.gapps)[1],
                             wildcard='*.zip',
                             style=wx.OPEN)
         if dlg.ShowModal() == wx.ID_OK:
             self.lastdir = dlg.GetDirectory()
-            self.gapps = os.path.join(self.lastdir, dlg.GetFilename())
-            self.gappsctrl.SetValue(self.gapps)
+            self.flasher.gapps = os.path.join(self.lastdir, dlg.GetFilename())
+            self.gappsctrl.SetValue(self.flasher.gapps)
         dlg.Destroy()
 
     def on_installgapps(self, event):
-        self._install_gapps()
-        if not self.gapps:
+        if not self.flasher.gapps:
             self.on_gapps(event)
-            self.gapps and self._install_gapps()
-
-    def _install_gapps(self):
-        '''push gapps to device'''
-        if not self.gapps:
-            print >> sys.stderr, "You need to select a zipped gapps file first"
-            return
-        return print_and_log([self.adb, 'remount']) and \
-                print_and_log([self.adb, 'push', self.gapps,
-                               '/sdcard/'], timeout=60) and \
-                self._reboot()
-
-    def _kill_server(self):
-        return print_and_log([self.adb, 'kill-server'])
+        self._submit('install gapps', 'install_gapps')
 
     def on_logcat(self, event):
         '''launch device logcat'''
         self._logcat()
 
     def _logcat(self):
-        '''device logcat'''
-        if print_and_log([self.adb, 'devices']).find('  device') < 0:
+        '''device logcat, captured until the user stops it
+
+        with several devices, each one gets its own file'''
+        if 'device' not in self.flasher.device_states():
             self._ok_dialog('Your device was not found by adb',
                             'No device found',
                             wx.ICON_EXCLAMATION)
@@ -510,88 +545,60 @@ class MainWindow(wx.Frame):
         if dlg.ShowModal() == wx.ID_OK:
             self.lastdir = dlg.GetDirectory()
             logfile = os.path.join(self.lastdir, dlg.GetFilename())
-            log = do_and_log([self.adb, 'logcat'], timeout=100)
-            print >> sys.stderr, log
-            try:
-                logout = open(logfile, 'w')
-                print >> logout, log
-            finally:
-                logout.close()
+            captures = self.flasher.start_logcat(logfile,
+                                                 max_bytes=logcat.ROTATE_BYTES)
+            if captures:
+                self._ok_dialog('Saving the log output of ' +
+                                ', '.join(capture.serial
+                                          for capture in captures) +
+                                ' to ' + logfile + '\n\n' +
+                                'Press OK to stop.', 'ADB Logcat')
+            for capture in captures:
+                capture.stop()
+                print >> sys.stderr, capture.serial, ':', capture.lines, \
+                        'lines, last ones:'
+                print >> sys.stderr, '\n'.join(capture.tail()[-20:])
+            log = '\n'.join('\n'.join(capture.tail())
+                            for capture in captures)
         dlg.Destroy()
         return log
 
 
-def do_and_log(args, timeout=10, poll=0.1, printout=False,
-               progress=0):
-    '''spawn a subprocess to execute a command
-
-    kill the subprocess after a given timeout (active poll),
-    optionally print out the result
-    unbuffered process output can be displayed (cancels timeout, forces
-    printout)'''
-    cmd = ' '.join(args)
-    print >> sys.stderr, cmd
-    elapsed = 0.0
-    try:
-        pipe = subprocess.Popen(args,
-                                universal_newlines=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        if progress:
-            dialog = wx.ProgressDialog(os.path.split(cmd)[1],
-                                       cmd[:90],
-                                       maximum = progress,
-                                       style = wx.PD_APP_MODAL |
-                                       # wx.PD_REMAINING_TIME |
-                                       wx.PD_CAN_ABORT |
-                                       wx.PD_AUTO_HIDE )
-            output = ''
-            count = 0
-            while True:
-                line = pipe.stdout.readline()
-                if not line:
-                    if count != progress:
-                        print >> sys.stderr, 'Warning: read', count, 'lines'
-                        print >> sys.stderr, '         expected ',
-                        print >> sys.stderr, progress, 'lines'
-                    break
-                # ignore empty lines, adb launch, available backup list
-                # and end message of some fastboot versions
-                if len(line) > 1 and \
-                   not line.startswith(('*', '/', 'finished.')):
-                    count += 1
-                if count <= progress and \
-                   not dialog.Update(count, line[:-1])[0]:
-                    pipe.terminate()
-                    dialog.Destroy()
-                    output = ''
-                    break
-                output += line
-        else:
-            while pipe.poll() is None:
-                time.sleep(poll)
-                elapsed += poll
-                if elapsed > timeout:
-                    pipe.terminate()
-            output = pipe.communicate()[0]
-            if printout:
-                print >> sys.stderr, output
-        returncode = pipe.returncode
-        if returncode and returncode > 0:
-            print >> sys.stderr, 'Error #', pipe.returncode
-            return ''
-        if returncode and returncode < 0:
-            print >> sys.stderr, 'Interrupted by signal #', pipe.returncode
-            return ''
-        return output
-    except OSError, error:
-        # adb or fastboot not found
-        print >> sys.stderr, 'Error :', error.strerror
-        return ''
-
-def print_and_log(*args, **kwargs):
-    '''call do_and_log and print the returned process output'''
-    return do_and_log(*args, printout=True, **kwargs)
+class WorkerUI(object):
+    '''how the flasher talks to the user from a worker thread
+
+    messages are shown by the main thread, waits in the dashboard'''
+
+    def __init__(self, window, serial):
+        self.window = window
+        self.serial = serial
+
+    def notify(self, message, title, warning=False):
+        '''tell something to the user, without waiting for an answer'''
+        wx.CallAfter(self.window.notify, (self.serial and self.serial + ': '
+                                          or '') + message, title, warning)
+
+    def wait(self, title, message, poll):
+        '''call poll() until it returns something else than None'''
+        result = poll()
+        while result is None:
+            if self.serial:
+                dashboard.dashboard.step(self.serial, (callable(message) and
+                                                       message() or
+                                                       message)[:90])
+            result = poll()
+        return result
+
+
+def row_texts(row):
+    '''texts of the columns of a dashboard row'''
+    remaining = row['remaining']
+    # ~ for a rate estimated from the progress instead of measured
+    rate = row['rate'] and (row['estimated'] and '~' or '') + \
+            progress.format_size(row['rate']) + '/s' or ''
+    return [row['serial'], row['state'] or 'disconnected', row['step'], rate,
+            remaining is not None and '%d:%02d' % divmod(int(remaining), 60)
+            or '']
 
 if __name__ == '__main__':
     # Create the app, don't redirect stdout/stderr.
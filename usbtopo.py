@@ -0,0 +1,115 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Scheduling of the transfers to phones sharing a USB hub
+
+Phones plugged behind the same hub share its link to the computer: when
+too many of them receive an image at once, none goes faster and some fail
+with "status read failed".  The USB topology is read from sysfs, where a
+device named 1-1.4.2 is on port 2 of a hub on port 4 of a hub on port 1
+of the root hub of bus 1; every phone behind root port 1-1 shares its
+link.  The scheduler lets at most HUB_TRANSFERS transfers run at once
+behind each such link and interleaves the phones of the different hubs,
+so that idle hubs get work first.  Phones of unknown position, such as
+without sysfs, are not limited.
+'''
+
+import os
+import threading
+from contextlib import contextmanager
+
+from devicemonitor import SYSFS, _read_sysfs
+
+# transfers running at once behind a root port
+HUB_TRANSFERS = 2
+
+def link(name):
+    '''root port through which a USB device is connected, from its name'''
+    return name.split('.')[0]
+
+def hubs(sysfs=SYSFS):
+    '''dictionary serial -> root port of the USB devices having a serial
+
+    return None if there is no sysfs to look at'''
+    if not os.path.isdir(sysfs):
+        return None
+    found = {}
+    for name in os.listdir(sysfs):
+        # interfaces have a colon, root hubs are named usbN
+        if ':' in name or not name[:1].isdigit():
+            continue
+        device = os.path.join(sysfs, name)
+        serial = _read_sysfs(os.path.join(device, 'serial'))
+        # hubs have class 09
+        if serial and _read_sysfs(os.path.join(device,
+                                               'bDeviceClass')) != '09':
+            found[serial] = link(name)
+    return found
+
+
+class HubScheduler(object):
+    '''bound the transfers running at once behind each hub'''
+
+    def __init__(self, hubs=None, per_hub=HUB_TRANSFERS):
+        self.hubs = hubs or {}
+        self.per_hub = per_hub
+        self._active = {}
+        self._condition = threading.Condition()
+
+    def groups(self, serials):
+        '''serials by hub, a group of its own for a phone of unknown hub'''
+        groups = {}
+        for serial in serials:
+            groups.setdefault(self.hubs.get(serial, serial), []).append(serial)
+        return groups
+
+    def order(self, serials):
+        '''serials taking one phone of each hub in turn, busiest hubs first'''
+        groups = sorted(self.groups(serials).values(),
+                        key=lambda group: -len(group))
+        ordered = []
+        for index in range(max([len(group) for group in groups] or [0])):
+            ordered.extend(group[index] for group in groups
+                           if index < len(group))
+        return ordered
+
+    def capacity(self, serials):
+        '''transfers to these phones which can run at once'''
+        total = 0
+        for group in self.groups(serials).values():
+            if group[0] in self.hubs:
+                total += min(self.per_hub, len(group))
+            else:
+                total += len(group)
+        return total
+
+    def acquire(self, serial):
+        '''wait until a transfer to that phone may start'''
+        hub = self.hubs.get(serial)
+        if hub is None:
+            return
+        with self._condition:
+            while self._active.get(hub, 0) >= self.per_hub:
+                self._condition.wait()
+            self._active[hub] = self._active.get(hub, 0) + 1
+
+    def release(self, serial):
+        '''a transfer to that phone is over'''
+        hub = self.hubs.get(serial)
+        if hub is None:
+            return
+        with self._condition:
+            self._active[hub] -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def transfer(self, serial):
+        '''hold a transfer slot of the hub of the phone'''
+        self.acquire(serial)
+        try:
+            yield
+        finally:
+            self.release(serial)
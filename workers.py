@@ -0,0 +1,63 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Pool of threads running the operations started from the main window
+
+Each operation is submitted with a key, the serial of its phone: only
+one operation runs at a time for a key, operations on different phones
+run in parallel, up to the size of the pool.
+'''
+
+import sys
+import threading
+import Queue
+
+# operations running at once
+WORKERS = 8
+
+class WorkerPool(object):
+    '''threads started on demand, up to size'''
+
+    def __init__(self, size=WORKERS):
+        self.size = size
+        self._queue = Queue.Queue()
+        self._keys = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        '''run function(*args) in a worker
+
+        return False without running it if an operation with the same key
+        is pending or running'''
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            # the keys are those of the pending and running operations
+            if len(self._threads) < min(self.size, len(self._keys)):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((key, function, args))
+        return True
+
+    def busy(self, key):
+        '''is an operation with that key pending or running'''
+        with self._lock:
+            return key in self._keys
+
+    def _work(self):
+        while True:
+            key, function, args = self._queue.get()
+            try:
+                function(*args)
+            except Exception, error:
+                print >> sys.stderr, 'Error in', function.__name__, ':', error
+            finally:
+                with self._lock:
+                    self._keys.discard(key)
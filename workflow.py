@@ -0,0 +1,192 @@
+#
+# Copyright Sylvain.Soliman@m4x.org, m.pluvinage@gmail.com,
+# Tetsuo6995@gmail.com, admin@guimmer.co.cc
+# License GPL v2.0
+
+'''
+Sequences of steps which resume where they failed
+
+A workflow declares its steps, the steps each one requires and how many
+times each one is tried again when it fails.  The steps completed on a
+device are checkpointed in the data directory, with a fingerprint of the
+files the workflow uses: when a run fails, for instance on a USB glitch,
+the next run of the same workflow with the same files on that device
+starts after the last completed step instead of wiping and flashing boot
+again.  Steps whose effect does not survive a reboot, such as starting
+the recovery, are never checkpointed and run again when a remaining step
+requires them.  Checkpoints older than MAX_AGE are ignored.
+'''
+
+import os
+import sys
+import time
+import threading
+
+import config
+
+# seconds after which a checkpoint is not trusted anymore
+MAX_AGE = 24 * 3600
+
+class Step(object):
+    '''a step of a workflow
+
+    action(target) returns something true when it succeeds; it is tried
+    retries more times, delay seconds apart, when it fails'''
+
+    def __init__(self, name, action, requires=(), retries=0, delay=2.0,
+                 persistent=True):
+        self.name = name
+        self.action = action
+        self.requires = tuple(requires)
+        self.retries = retries
+        self.delay = delay
+        self.persistent = persistent
+
+    def __repr__(self):
+        return '<Step %s>' % self.name
+
+
+class Workflow(object):
+    '''steps ordered by their requirements, in declaration order otherwise'''
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError('step %s declared twice' % step.name)
+            self.steps[step.name] = step
+        self.order = []
+        placed = set()
+        remaining = list(steps)
+        while remaining:
+            ready = [step for step in remaining
+                     if all(name in placed for name in step.requires)]
+            if not ready:
+                raise ValueError('steps %s require unknown or circular steps'
+                                 % ', '.join(step.name for step in remaining))
+            self.order.append(ready[0])
+            placed.add(ready[0].name)
+            remaining.remove(ready[0])
+
+    def pending(self, done):
+        '''steps to run when the given ones are done, in order
+
+        steps not checkpointed are only run for the ones requiring them'''
+        needed = set(step.name for step in self.order
+                     if step.persistent and step.name not in done)
+        for step in reversed(self.order):
+            if step.name in needed:
+                needed.update(name for name in step.requires
+                              if not self.steps[name].persistent)
+        return [step for step in self.order if step.name in needed]
+
+
+class Checkpoints(object):
+    '''steps completed by the workflows on each device, in the data
+    directory'''
+
+    def __init__(self, path=None):
+        self.path = path or config.datapath('checkpoints.json')
+        self._lock = threading.Lock()
+
+    def done(self, workflow, serial, inputs):
+        '''steps of a workflow already done on a device with these inputs'''
+        with self._lock:
+            entry = config.load_json(self.path, {}).get(workflow + ' ' +
+                                                        serial)
+        if not entry or entry['inputs'] != inputs or \
+           time.time() - entry['time'] > MAX_AGE:
+            return []
+        return entry['done']
+
+    def save(self, workflow, serial, inputs, done, failed=None):
+        '''record the progress of a workflow on a device'''
+        self._update(workflow + ' ' + serial,
+                     {'inputs': inputs, 'done': list(done), 'failed': failed,
+                      'time': time.time()})
+
+    def clear(self, workflow, serial):
+        '''forget a workflow on a device, once it is over'''
+        self._update(workflow + ' ' + serial, None)
+
+    def _update(self, key, entry):
+        with self._lock:
+            entries = config.load_json(self.path, {})
+            if entry is None:
+                if key not in entries:
+                    return
+                del entries[key]
+            else:
+                entries[key] = entry
+            try:
+                config.save_json(self.path, entries)
+            except (IOError, OSError), error:
+                print >> sys.stderr, 'Cannot save the checkpoints :', error
+
+_checkpoints = None
+_checkpoints_lock = threading.Lock()
+
+def checkpoints():
+    '''Checkpoints of the data directory'''
+    global _checkpoints
+    with _checkpoints_lock:
+        if _checkpoints is None:
+            _checkpoints = Checkpoints()
+        return _checkpoints
+
+def fingerprint(*paths):
+    '''inputs of a workflow using these files, which change with them'''
+    inputs = []
+    for path in paths:
+        if path and os.path.exists(path):
+            info = os.stat(path)
+            inputs.append([os.path.abspath(path), info.st_size,
+                           int(info.st_mtime)])
+        else:
+            inputs.append([path, None, None])
+    return inputs
+
+def run(workflow, target, serial=None, inputs=None, store=None, report=None,
+        sleep=time.sleep):
+    '''run the steps of a workflow on target, resuming a failed run
+
+    without a serial nothing is checkpointed.  report(serial, step,
+    status) is called with started, done, retried and failed.  Return the
+    name of the failed step, None if everything went fine'''
+    store = serial and (store or checkpoints())
+    inputs = inputs or []
+    done = store and store.done(workflow.name, serial, inputs) or []
+    pending = workflow.pending(done)
+    if done:
+        print >> sys.stderr, 'Resuming %s on %s after %s' % (
+            workflow.name, serial, ', '.join(done))
+    done = list(done)
+    for step in pending:
+        if report:
+            report(serial, step.name, 'started')
+        ok = step.action(target)
+        for attempt in range(step.retries):
+            if ok:
+                break
+            print >> sys.stderr, 'Trying %s again (%d/%d)' % (
+                step.name, attempt + 1, step.retries)
+            if report:
+                report(serial, step.name, 'retried')
+            sleep(step.delay)
+            ok = step.action(target)
+        if not ok:
+            if store:
+                store.save(workflow.name, serial, inputs, done, step.name)
+            if report:
+                report(serial, step.name, 'failed')
+            return step.name
+        if step.persistent:
+            done.append(step.name)
+            if store:
+                store.save(workflow.name, serial, inputs, done)
+        if report:
+            report(serial, step.name, 'done')
+    if store:
+        store.clear(workflow.name, serial)
+    return None